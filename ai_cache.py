@@ -0,0 +1,147 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from config import *
+
+
+def normalize_question(question):
+    question = question.lower()
+    question = re.sub(r"[^\w\s$.]", " ", question)
+    question = re.sub(r"\.(?!\d)", " ", question)
+    return " ".join(question.split())
+
+
+def state_fingerprint(prompt):
+    # The system prompt is everything the model sees besides the question:
+    # balances, due date, score, points, the recent transactions and today's
+    # date. Two identical prompts get the same answer.
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+class AIAnswerCache:
+    # Answers are generated with temperature 0.0, so the same question against
+    # the same account state gets the same answer. Entries live in an in-process
+    # LRU with a TTL; when db_path is set they are also written to a small SQLite
+    # file so they survive restarts and are shared between workers.
+    def __init__(self, max_entries=AI_ANSWER_CACHE_SIZE, ttl=AI_ANSWER_CACHE_TTL, db_path=AI_ANSWER_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+        if self.db_path:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS ai_answer_cache ("
+                    "key TEXT PRIMARY KEY, answer TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_ai_answer_cache_last_used ON ai_answer_cache (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def key(self, question, prompt):
+        return hashlib.sha256(
+            f"{normalize_question(question)}|{state_fingerprint(prompt)}".encode()
+        ).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] > self.ttl:
+                del self._entries[key]
+                self._counts["expirations"] += 1
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+                self._counts["hits"] += 1
+                return entry[0]
+
+        answer = self._load(key, now) if self.db_path else None
+
+        with self._lock:
+            if answer is None:
+                self._counts["misses"] += 1
+                return None
+            self._counts["hits"] += 1
+            self._remember(key, answer, now)
+        return answer
+
+    def put(self, key, answer):
+        now = time.time()
+        with self._lock:
+            self._remember(key, answer, now)
+        if self.db_path:
+            self._store(key, answer, now)
+
+    def _remember(self, key, answer, created_at):
+        self._entries[key] = (answer, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counts["evictions"] += 1
+
+    def _load(self, key, now):
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT answer, created_at FROM ai_answer_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if now - row[1] > self.ttl:
+                    conn.execute("DELETE FROM ai_answer_cache WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE ai_answer_cache SET last_used = ? WHERE key = ?", (now, key))
+                return row[0]
+        except sqlite3.Error:
+            return None
+
+    def _store(self, key, answer, now):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO ai_answer_cache (key, answer, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, answer, now, now)
+                )
+                conn.execute("DELETE FROM ai_answer_cache WHERE created_at < ?", (now - self.ttl,))
+                conn.execute(
+                    "DELETE FROM ai_answer_cache WHERE key IN ("
+                    "SELECT key FROM ai_answer_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            size = len(self._entries)
+        lookups = counts["hits"] + counts["misses"]
+        return dict(
+            counts,
+            size=size,
+            max_entries=self.max_entries,
+            ttl=self.ttl,
+            persistent=bool(self.db_path),
+            hit_rate=round(counts["hits"] / lookups, 4) if lookups else 0.0
+        )
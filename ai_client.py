@@ -0,0 +1,126 @@
+import json
+import time
+import threading
+import requests
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from config import *
+
+
+class AIBusyError(Exception):
+    pass
+
+
+class AIDeadlineError(Exception):
+    pass
+
+
+class AIClient:
+    # Shared by every request in this worker process. Connections to Ollama are
+    # kept alive in the session pool, and at most `max_inflight` generations run
+    # at once; up to `max_queue` more wait for a slot, anything beyond that is
+    # turned away immediately with AIBusyError.
+    def __init__(self, url=OLLAMA_CHAT_URL, model=OLLAMA_MODEL,
+                 max_inflight=AI_MAX_INFLIGHT, max_queue=AI_MAX_QUEUE,
+                 queue_timeout=AI_QUEUE_TIMEOUT):
+        self.url = url
+        self.model = model
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_inflight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._waiting = 0
+
+    def payload(self, system_prompt, message, stream=False):
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": message}
+            ],
+            "stream": stream,
+            "options": {
+              "temperature": 0.0,
+              "top_p": 0.9,
+              "repeat_penalty": 1.05
+            }
+        }
+
+    @contextmanager
+    def slot(self, deadline):
+        # ---- Fast path: a generation slot is free ----
+        acquired = self._slots.acquire(blocking=False)
+
+        # ---- Otherwise wait in the bounded queue ----
+        if not acquired:
+            with self._lock:
+                if self._waiting >= self.max_queue:
+                    raise AIBusyError("AI queue is full")
+                self._waiting += 1
+            try:
+                wait = min(self.queue_timeout, deadline - time.monotonic())
+                acquired = self._slots.acquire(timeout=max(wait, 0))
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not acquired:
+                raise AIBusyError("Timed out waiting for an AI slot")
+
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def chat(self, system_prompt, message, timeout=AI_TIMEOUT):
+        deadline = time.monotonic() + timeout
+
+        with self.slot(deadline):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AIDeadlineError("Deadline passed while queued")
+            response = self.session.post(
+                self.url,
+                json=self.payload(system_prompt, message),
+                timeout=(AI_CONNECT_TIMEOUT, remaining)
+            )
+            response.raise_for_status()
+            return response.json()["message"]["content"]
+
+    def stream_chat(self, system_prompt, message, timeout=AI_TIMEOUT):
+        deadline = time.monotonic() + timeout
+
+        with self.slot(deadline):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AIDeadlineError("Deadline passed while queued")
+            response = self.session.post(
+                self.url,
+                json=self.payload(system_prompt, message, stream=True),
+                stream=True,
+                timeout=(AI_CONNECT_TIMEOUT, remaining)
+            )
+            # Closing the response (on completion, error, or when the caller
+            # closes this generator) drops the connection and stops Ollama.
+            try:
+                response.raise_for_status()
+
+                # Ollama streams one JSON object per line
+                for line in response.iter_lines():
+                    if time.monotonic() > deadline:
+                        raise AIDeadlineError("Generation exceeded its deadline")
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    token = chunk.get("message", {}).get("content", "")
+                    if token:
+                        yield token
+                    if chunk.get("done"):
+                        break
+            finally:
+                response.close()
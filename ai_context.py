@@ -0,0 +1,364 @@
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta, date
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from models import db, Account, Transaction, get_data_version
+from config import *
+
+AIContext = namedtuple('AIContext', ['prompt', 'summary'])
+
+
+def credit_cycle_totals(credit_acc):
+    due_date = date.fromisoformat(credit_acc.due_date)
+    start_cycle = due_date - timedelta(days=BILLING_CYCLE_DAYS - 1)
+    start_dt = datetime.combine(start_cycle, datetime.min.time())
+    end_dt = datetime.combine(due_date, datetime.max.time())
+
+    def total(*criteria):
+        return db.session.query(func.coalesce(func.sum(Transaction.amount), 0.0)).filter(
+            *criteria,
+            Transaction.timestamp >= start_dt,
+            Transaction.timestamp <= end_dt
+        ).scalar()
+
+    drawn = total(Transaction.from_account_id == credit_acc.id,
+                  Transaction.description == 'Credit withdraw')
+    paid = total(Transaction.to_account_id == credit_acc.id,
+                 Transaction.description == 'Credit payment')
+    return drawn, paid
+
+
+def build_summary(user, accounts):
+    credit_acc = next((a for a in accounts if a.type == "credit"), None)
+    spending_acc = next((a for a in accounts if a.type == "spending"), None)
+    savings_acc = next((a for a in accounts if a.type == "savings"), None)
+
+    # Calculate minimum due for credit
+    remaining_min_due = 0
+    if credit_acc and credit_acc.due_date:
+        drawn, paid = credit_cycle_totals(credit_acc)
+        carried_balance = max(credit_acc.past_amt, 0)
+        min_due = round(MIN_PAYMENT_AMT * carried_balance, 2)
+        remaining_min_due = max(min_due - paid, 0)
+
+    # Plain values only, so the summary can outlive the DB session
+    return {
+        'username': user.username,
+        'credit_score': user.credit_score,
+        'reward_points': user.reward_points,
+        'allowance_rate': user.allowance_rate,
+        'two_factor_enabled': user.two_factor_enabled,
+        'savings_apr': user.savings_apr,
+        'spending_balance': spending_acc.balance if spending_acc else 0,
+        'savings_balance': savings_acc.balance if savings_acc else 0,
+        'credit_balance': credit_acc.balance if credit_acc else 0,
+        'credit_limit': credit_acc.credit_limit if credit_acc else 0,
+        'credit_interest_rate': credit_acc.interest_rate if credit_acc else 0,
+        'past_due': credit_acc.past_due if credit_acc else False,
+        'past_amt': credit_acc.past_amt if credit_acc else 0,
+        'due_date': credit_acc.due_date if credit_acc else None,
+        'remaining_min_due': remaining_min_due,
+    }
+
+
+def recent_transactions(user_id, limit=AI_CONTEXT_RECENT_TX):
+    def label(acc):
+        if acc is None:
+            return 'Bank'
+        if acc.user_id != user_id:
+            return acc.user.username
+        return acc.type
+
+    transactions = (
+        Transaction.query
+        .options(
+            joinedload(Transaction.from_account).joinedload(Account.user),
+            joinedload(Transaction.to_account).joinedload(Account.user)
+        )
+        .filter(
+            (Transaction.from_user_id == user_id) |
+            (Transaction.to_user_id == user_id)
+        )
+        .order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+    return [
+        f"- {tx.timestamp:%Y-%m-%d} | {tx.description} | ${tx.amount:.2f} | "
+        f"{label(tx.from_account)} → {label(tx.to_account)}"
+        for tx in transactions
+    ]
+
+
+def build_ai_system_prompt(summary, recent, today=None):
+    today = today or date.today()
+    credit_balance = summary['credit_balance']
+    credit_limit = summary['credit_limit']
+    past_amt = summary['past_amt']
+    recent_block = '\n'.join(recent) or '- No transactions yet.'
+
+    context = f"""
+You are a friendly, educational AI assistant embedded in a home banking web application called My Home Bank, designed for children and families.
+
+Your role is to teach financial responsibility and guide users ONLY using the information explicitly provided below.
+
+Today's Date: {today.strftime('%a, %Y-%m-%d')}
+
+====================
+STRICT INFORMATION BOUNDARY
+====================
+
+You MUST follow these rules:
+
+- Only use information explicitly shown in this context.
+- Never invent balances, transactions, interest amounts, dates, fees, or rules.
+- Never assume missing data.
+- Never estimate numbers unless they can be calculated directly from values provided here.
+- If information is missing, say: "I don’t have enough information to determine that."
+- Do NOT predict future balances unless you clearly show the calculation using only provided numbers.
+- Do NOT fabricate transaction history.
+- Do NOT fabricate credit score history.
+- Do NOT fabricate billing cycle events.
+- Do NOT create new rules, fees, or rewards.
+- If unsure about an action, direct the user to /help.
+
+You are not allowed to make up information.
+
+====================
+USER CONTEXT
+====================
+- Username: {summary['username']}
+- Credit Score: {summary['credit_score']}
+- Reward Points: {summary['reward_points']}
+- Weekly Allowance: {summary['allowance_rate']} (automatically deposited into savings every Friday)
+- Two-Factor Enabled: {summary['two_factor_enabled']}
+
+====================
+SPENDING ACCOUNT CONTEXT
+====================
+- Spending Balance: ${summary['spending_balance']}
+
+====================
+SAVINGS ACCOUNT CONTEXT
+====================
+- Savings Balance: ${summary['savings_balance']}
+- Monthly Savings Interest Rate: {(summary['savings_apr'] * 100) / 12}% (compounds monthly on due date)
+
+====================
+CREDIT ACCOUNT CONTEXT
+====================
+- Is {'' if summary['past_due'] else 'NOT'} past due!
+{f'- Past Due Amount: ${past_amt}' if summary['past_due'] else ''}
+
+- Credit Balance: ${credit_balance}
+- Credit Limit: ${credit_limit}
+- Credit Utilization: {((credit_balance / credit_limit) * 100) if credit_limit > 0 else 0}%
+- Available Credit: ${credit_limit - credit_balance}
+- Minimum Due: ${summary['remaining_min_due']}
+- Due Date: {summary['due_date'] or 'N/A'}
+- Monthly Credit Interest Rate: {(summary['credit_interest_rate'] * 100) / 12}%
+- Billing cycle length: 30 days
+
+====================
+RECENT TRANSACTIONS
+====================
+{recent_block}
+
+====================
+ACCOUNT RULES
+====================
+
+SPENDING ACCOUNT:
+- Available funds.
+- Used for everyday purchases and payments.
+- Used to pay credit balance.
+- Receives redeemed reward cash.
+- Can send money to other users' spending accounts.
+
+SAVINGS ACCOUNT:
+- Saved funds.
+- Earns monthly compound interest.
+- 10% fee on withdrawals.
+- Can ONLY transfer to the user's own spending account.
+- Minimum $1 withdrawal.
+- Earns 1 reward point per $1 deposited.
+
+CREDIT ACCOUNT:
+- Borrowed funds.
+- Has a credit limit.
+- Borrowing increases credit balance.
+- Payments decrease credit balance.
+- Cannot be used in normal transfers.
+- Must use credit-specific routes.
+- Has a billing cycle and due date.
+- Minimum payment is based on carried balance.
+- ${NO_PAYMENT_FEE}0 late fee is added to balance if minimum not paid on time.
+- Can become "past due" if minimum unpaid.
+- Interest posts at the end of the billing cycle on the due date.
+
+====================
+CREDIT SCORE SCALE
+====================
+Credit score must be interpreted using this exact scale:
+
+300–399: Very Poor
+400–499: Poor
+500–599: Fair
+600–699: Good
+700–799: Very Good
+800–850: Excellent
+
+- Accurately classify the score.
+- Never describe a low score as “good,” “great,” or “excellent.”
+- Be honest but supportive.
+- Encourage improvement when score is below 600.
+
+====================
+TRANSFER RULES
+====================
+Route: dashboard → transfer
+
+- Cannot transfer to the same account.
+- Cannot transfer from credit account.
+- Cannot transfer to credit account.
+- Savings withdrawals have 10% penalty.
+- Savings → only to own spending.
+- Spending accounts of other users display as the username of the owner.
+
+Process:
+- Select "From" account (source account)
+    - Spending
+    - Savings
+- Select "To" account (destination account)
+    - Spending
+    - Savings
+    - Username of other user
+- Set "Amount"
+- Set "Description"
+- Click "Transfer"
+
+====================
+CREDIT ACTIONS
+====================
+- dashboard → borrow - Borrow from credit to spending (cannot exceed available limit).
+- dashboard → pay - Pay from spending to credit.
+- If minimum due is fully paid, past due status clears.
+
+Borrow Process:
+- Enter amount
+- Click Draw Funds
+
+Pay Process:
+- Enter amount
+- Click Pay
+
+====================
+CREDIT SCORE FACTORS
+====================
+
+Score can increase for:
+- Paying full balance on time.
+- Keeping utilization below 30%.
+- Making strong partial payments.
+- Responsible borrowing and repayment.
+
+Score can decrease for:
+- Missing minimum payment.
+- Carrying high utilization (over 80%).
+- Going over credit limit.
+- Making very small payments toward large balances.
+
+High utilization = balance above 80% of limit.
+Low utilization = balance below 30% of limit.
+Credit maturity does not change score.
+New credit accounts does not change score.
+Credit score updates on the due date.
+
+====================
+REWARD SYSTEM
+====================
+
+Users earn reward points for:
+- Depositing into savings. (1 point for every $1.00)
+- Making strong credit payments. (up to {MAX_POINTS} points monthly)
+- Responsible credit utilization.
+
+Full, responsible payment earns the highest reward.
+Partial payments may earn partial rewards.
+
+Rewards can be redeemed at dashboard → reward points → redeem.
+Cash rewards deposit into spending account.
+Reward points do not expire.
+
+====================
+SITE NAVIGATION
+====================
+
+dashboard (Account overview, transactions, credit info)
+dashboard → transfer (Transfer money between accounts)
+dashboard → borrow (Borrow from credit)
+dashboard → pay (Pay credit balance) 
+dashboard → credit score → history (View graph showing credit score history)
+dashboard → reward points → redeem (Use reward points to redeem rewards)
+dashboard → preferences (Update profile/password/2FA)
+dashboard → help (Financial education/assistance)
+
+When advising users, reference these routes naturally.
+
+====================
+BEHAVIOR INSTRUCTIONS
+====================
+- Be friendly and encouraging.
+- Use simple language appropriate for children.
+- Avoid technical financial jargon unless explained.
+- Explain financial concepts simply.
+- Personalize advice using ONLY provided values.
+- If data is missing, say you do not have enough information.
+- Never guess.
+- Never fabricate.
+- Never simulate unseen system behavior.
+- Never mention backend systems, databases, or implementation. 
+"""
+    return context
+
+
+def fit_prompt(summary, recent, budget=AI_PROMPT_TOKEN_BUDGET):
+    # Rough token estimate; drop the oldest transactions first, then cut hard
+    max_chars = budget * AI_CHARS_PER_TOKEN
+    recent = list(recent)
+    prompt = build_ai_system_prompt(summary, recent)
+    while len(prompt) > max_chars and recent:
+        recent.pop()
+        prompt = build_ai_system_prompt(summary, recent)
+    return prompt[:max_chars]
+
+
+class AIContextCache:
+    # Per-process cache of each user's AI prompt. An entry is reused until the
+    # user's data version moves (any committed change to their profile,
+    # accounts or transactions) or the date changes.
+    def __init__(self, max_users=AI_CONTEXT_CACHE_SIZE):
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        key = (get_data_version(user.id), date.today())
+
+        with self._lock:
+            entry = self._entries.get(user.id)
+            if entry and entry[0] == key:
+                self._entries.move_to_end(user.id)
+                return entry[1]
+
+        summary = build_summary(user, user.accounts)
+        context = AIContext(fit_prompt(summary, recent_transactions(user.id)), summary)
+
+        with self._lock:
+            self._entries[user.id] = (key, context)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return context
@@ -1,25 +1,63 @@
 import os
-import io
 import glob
 import json
+import time
 import pyotp
-import qrcode
-import base64
-import requests
 from dotenv import load_dotenv
-from flask import Flask, render_template, redirect, url_for, request, flash, abort, current_app, session, send_from_directory
+from flask import Flask, render_template, redirect, url_for, request, flash, abort, current_app, session, send_from_directory, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.utils import secure_filename
+from markupsafe import Markup
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
-from models import db, User, Account, Transaction, init_db
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, User, Account, Transaction, Reward, ScheduledTransfer, init_db, get_data_version
+from ai_client import AIClient, AIBusyError
+from ai_context import AIContextCache
+from ai_cache import AIAnswerCache
+from identity import load_user_with_accounts, current_accounts
+from ratelimit_storage import SQLiteStorage  # registers the sqlite:// limiter storage
+from ledger import (
+    adjust_balance, set_points, redeem_reward, run_atomic,
+    InsufficientFunds, InsufficientPoints, RewardUnavailable
+)
+from transfers import (
+    validate_transfer, apply_transfers, transfer_log_lines, TransferError,
+    remaining_minimum_due, apply_credit_payment, credit_payment_log_line
+)
+from idempotency import idempotent, new_idempotency_key
+from images import read_upload, queue_upload, InvalidImage, image_url, image_srcset, background_image
+from assets import asset_url, send_asset, cache_upload_variants
+from twofactor import provisioning_uri, qr_version, qr_svg, forget_qr
+from fragments import FragmentCache
+from exports import stream_export, parse_filters, ExportError, FORMATS as EXPORT_FORMATS
+from rollups import family_analytics, parse_range, AnalyticsError
+from points import points_summary
+from challenges import (
+    parse as parse_challenge, create as new_challenge, remove as remove_challenge,
+    progress_rows as challenge_rows, grouped as grouped_challenges, status as challenge_status,
+    percent as challenge_percent, ChallengeError, METRICS as CHALLENGE_METRICS
+)
+from search import search_transactions, parse_search, SearchError
+from bulk_settings import (
+    read_file as read_settings, validate as validate_settings, plan as plan_settings,
+    basis as settings_basis, apply as apply_settings, export as export_settings,
+    SettingsError, FORMATS as SETTINGS_FORMATS
+)
 from datetime import datetime, timedelta, date
-from rewards import REWARDS
+from rewards import catalog, availability, parse_reward, save_reward, RewardError, LIMIT_PERIODS
+from notifications import (
+    unread as unread_notifications, mark_read as mark_notifications_read, as_dict as notification_dict,
+    KINDS as NOTIFICATION_KINDS
+)
+from scheduler import (
+    parse as parse_schedule, create as new_schedule, pause as pause_schedule, remove as remove_schedule,
+    ScheduleError, KINDS as SCHEDULE_KINDS, INTERVALS as SCHEDULE_INTERVALS
+)
 from config import *
 
 load_dotenv(".env") 
@@ -37,16 +75,28 @@ AUTH_LOG_FILE = os.path.join(os.path.dirname(__file__), "log/auth.log")
 limiter = Limiter(
     key_func=get_remote_address,
     app=app,
-    default_limits=["2000 per day", "500 per hour"]
+    default_limits=["2000 per day", "500 per hour"],
+    storage_uri=RATELIMIT_STORAGE_URI,
+    strategy="fixed-window"
 )
 
 db.init_app(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = '/'
+app.jinja_env.globals['new_idempotency_key'] = new_idempotency_key
+app.jinja_env.globals.update(image_url=image_url, image_srcset=image_srcset, background_image=background_image, asset_url=asset_url)
+app.after_request(cache_upload_variants)
 init_db(app)
+ai_client = AIClient()
+ai_contexts = AIContextCache()
+ai_answers = AIAnswerCache()
+fragments = FragmentCache()
 
 def log_user_transaction(user, message):
+    log_user_transactions(user, [message])
+
+def log_user_transactions(user, messages):
     log_dir = "log/transactions"
     os.makedirs(log_dir, exist_ok=True)
     log_file = os.path.join(log_dir, user.username)
@@ -59,7 +109,8 @@ def log_user_transaction(user, message):
         if write_header:
             f.write(header)
             f.write(separator)
-        f.write(f"{timestamp} | {message}\n")
+        for message in messages:
+            f.write(f"{timestamp} | {message}\n")
         
 def log_user_auth(user, message):
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -75,6 +126,21 @@ def log_user_auth(user, message):
             f.write(separator)
         f.write(f"{timestamp} | {message}\n")
         
+def log_ai_timing(user, message):
+    os.makedirs(os.path.dirname(AI_LOG_FILE), exist_ok=True)
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    header = "TIMESTAMP           | RESULT  | USERNAME       | TTFT     | TOTAL    | TOKENS\n"
+    separator = "-" * 80 + "\n"
+
+    write_header = not os.path.exists(AI_LOG_FILE) or os.path.getsize(AI_LOG_FILE) == 0
+
+    with open(AI_LOG_FILE, "a") as f:
+        if write_header:
+            f.write(header)
+            f.write(separator)
+        f.write(f"{timestamp} | {message}\n")
+
 def fmt_auth(result, event, user, ip):
         return (
             f"{result:<7} | "
@@ -95,250 +161,8 @@ def requires_role(role):
         return wrapped
     return decorator
     
-def build_ai_system_prompt(user, accounts, transactions):
-    credit_acc = next((a for a in accounts if a.type == "credit"), None)
-    spending_acc = next((a for a in accounts if a.type == "spending"), None)
-    savings_acc = next((a for a in accounts if a.type == "savings"), None)
-
-    # Calculate minimum due for credit
-    remaining_min_due = 0
-    if credit_acc:
-        due_date = date.fromisoformat(credit_acc.due_date)
-        start_cycle = due_date - timedelta(days=BILLING_CYCLE_DAYS - 1)
-        start_dt = datetime.combine(start_cycle, datetime.min.time())
-        end_dt = datetime.combine(due_date, datetime.max.time())
-
-        draws = [tx.amount for tx in transactions
-                 if tx.from_account_id == credit_acc.id and tx.description == 'Credit withdraw'
-                 and start_dt <= tx.timestamp <= end_dt]
-        payments = [tx.amount for tx in transactions
-                    if tx.to_account_id == credit_acc.id and tx.description == 'Credit payment'
-                    and start_dt <= tx.timestamp <= end_dt]
-
-        carried_balance = max(credit_acc.past_amt, 0)
-        min_due = round(MIN_PAYMENT_AMT * carried_balance, 2)
-        borrowed_this_cycle = max(sum(draws) - sum(payments), 0)
-        remaining_min_due = min_due - sum(payments)
-        remaining_min_due = max(remaining_min_due, 0)
-
-    context = f"""
-You are a friendly, educational AI assistant embedded in a home banking web application called My Home Bank, designed for children and families.
-
-Your role is to teach financial responsibility and guide users ONLY using the information explicitly provided below.
-
-Today's Date: {datetime.now().strftime('%a, %Y-%m-%d')}
-
-====================
-STRICT INFORMATION BOUNDARY
-====================
-
-You MUST follow these rules:
-
-- Only use information explicitly shown in this context.
-- Never invent balances, transactions, interest amounts, dates, fees, or rules.
-- Never assume missing data.
-- Never estimate numbers unless they can be calculated directly from values provided here.
-- If information is missing, say: "I don’t have enough information to determine that."
-- Do NOT predict future balances unless you clearly show the calculation using only provided numbers.
-- Do NOT fabricate transaction history.
-- Do NOT fabricate credit score history.
-- Do NOT fabricate billing cycle events.
-- Do NOT create new rules, fees, or rewards.
-- If unsure about an action, direct the user to /help.
-
-You are not allowed to make up information.
-
-====================
-USER CONTEXT
-====================
-- Username: {user.username}
-- Credit Score: {user.credit_score}
-- Reward Points: {user.reward_points}
-- Weekly Allowance: {user.allowance_rate} (automatically deposited into savings every Friday)
-- Two-Factor Enabled: {user.two_factor_enabled}
-
-====================
-SPENDING ACCOUNT CONTEXT
-====================
-- Spending Balance: ${spending_acc.balance if spending_acc else 0}
-
-====================
-SAVINGS ACCOUNT CONTEXT
-====================
-- Savings Balance: ${savings_acc.balance if savings_acc else 0}
-- Monthly Savings Interest Rate: {(user.savings_apr * 100) / 12}% (compounds monthly on due date)
-
-====================
-CREDIT ACCOUNT CONTEXT
-====================
-- Is {'' if credit_acc.past_due else 'NOT'} past due!
-{f'- Past Due Amount: ${credit_acc.past_amt}' if credit_acc.past_due else ''}
-
-- Credit Balance: ${credit_acc.balance if credit_acc else 0}
-- Credit Limit: ${credit_acc.credit_limit if credit_acc else 0}
-- Credit Utilization: {((credit_acc.balance / credit_acc.credit_limit) * 100) if credit_acc.credit_limit > 0 else 0}%
-- Available Credit: ${credit_acc.credit_limit - credit_acc.balance}
-- Minimum Due: ${remaining_min_due if credit_acc else 0}
-- Due Date: {credit_acc.due_date if credit_acc else 'N/A'}
-- Monthly Credit Interest Rate: {(credit_acc.interest_rate * 100) / 12 if credit_acc else 0}%
-- Billing cycle length: 30 days
-
-====================
-ACCOUNT RULES
-====================
-
-SPENDING ACCOUNT:
-- Available funds.
-- Used for everyday purchases and payments.
-- Used to pay credit balance.
-- Receives redeemed reward cash.
-- Can send money to other users' spending accounts.
-
-SAVINGS ACCOUNT:
-- Saved funds.
-- Earns monthly compound interest.
-- 10% fee on withdrawals.
-- Can ONLY transfer to the user's own spending account.
-- Minimum $1 withdrawal.
-- Earns 1 reward point per $1 deposited.
-
-CREDIT ACCOUNT:
-- Borrowed funds.
-- Has a credit limit.
-- Borrowing increases credit balance.
-- Payments decrease credit balance.
-- Cannot be used in normal transfers.
-- Must use credit-specific routes.
-- Has a billing cycle and due date.
-- Minimum payment is based on carried balance.
-- ${NO_PAYMENT_FEE}0 late fee is added to balance if minimum not paid on time.
-- Can become "past due" if minimum unpaid.
-- Interest posts at the end of the billing cycle on the due date.
-
-====================
-CREDIT SCORE SCALE
-====================
-Credit score must be interpreted using this exact scale:
-
-300–399: Very Poor
-400–499: Poor
-500–599: Fair
-600–699: Good
-700–799: Very Good
-800–850: Excellent
-
-- Accurately classify the score.
-- Never describe a low score as “good,” “great,” or “excellent.”
-- Be honest but supportive.
-- Encourage improvement when score is below 600.
-
-====================
-TRANSFER RULES
-====================
-Route: dashboard → transfer
-
-- Cannot transfer to the same account.
-- Cannot transfer from credit account.
-- Cannot transfer to credit account.
-- Savings withdrawals have 10% penalty.
-- Savings → only to own spending.
-- Spending accounts of other users display as the username of the owner.
-
-Process:
-- Select "From" account (source account)
-    - Spending
-    - Savings
-- Select "To" account (destination account)
-    - Spending
-    - Savings
-    - Username of other user
-- Set "Amount"
-- Set "Description"
-- Click "Transfer"
-
-====================
-CREDIT ACTIONS
-====================
-- dashboard → borrow - Borrow from credit to spending (cannot exceed available limit).
-- dashboard → pay - Pay from spending to credit.
-- If minimum due is fully paid, past due status clears.
-
-Borrow Process:
-- Enter amount
-- Click Draw Funds
-
-Pay Process:
-- Enter amount
-- Click Pay
-
-====================
-CREDIT SCORE FACTORS
-====================
-
-Score can increase for:
-- Paying full balance on time.
-- Keeping utilization below 30%.
-- Making strong partial payments.
-- Responsible borrowing and repayment.
-
-Score can decrease for:
-- Missing minimum payment.
-- Carrying high utilization (over 80%).
-- Going over credit limit.
-- Making very small payments toward large balances.
-
-High utilization = balance above 80% of limit.
-Low utilization = balance below 30% of limit.
-Credit maturity does not change score.
-New credit accounts does not change score.
-Credit score updates on the due date.
-
-====================
-REWARD SYSTEM
-====================
-
-Users earn reward points for:
-- Depositing into savings. (1 point for every $1.00)
-- Making strong credit payments. (up to {MAX_POINTS} points monthly)
-- Responsible credit utilization.
-
-Full, responsible payment earns the highest reward.
-Partial payments may earn partial rewards.
-
-Rewards can be redeemed at dashboard → reward points → redeem.
-Cash rewards deposit into spending account.
-Reward points do not expire.
-
-====================
-SITE NAVIGATION
-====================
-
-dashboard (Account overview, transactions, credit info)
-dashboard → transfer (Transfer money between accounts)
-dashboard → borrow (Borrow from credit)
-dashboard → pay (Pay credit balance) 
-dashboard → credit score → history (View graph showing credit score history)
-dashboard → reward points → redeem (Use reward points to redeem rewards)
-dashboard → preferences (Update profile/password/2FA)
-dashboard → help (Financial education/assistance)
-
-When advising users, reference these routes naturally.
-
-====================
-BEHAVIOR INSTRUCTIONS
-====================
-- Be friendly and encouraging.
-- Use simple language appropriate for children.
-- Avoid technical financial jargon unless explained.
-- Explain financial concepts simply.
-- Personalize advice using ONLY provided values.
-- If data is missing, say you do not have enough information.
-- Never guess.
-- Never fabricate.
-- Never simulate unseen system behavior.
-- Never mention backend systems, databases, or implementation. 
-"""
-    return context
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
         
 @app.errorhandler(RequestEntityTooLarge)
@@ -355,8 +179,12 @@ def ratelimit_handler(e):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_user_with_accounts(int(user_id))
     
+@app.route('/static/dist/<path:filename>')
+def static_asset(filename):
+    return send_asset(filename)
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory('static', 'favicon.ico')
@@ -418,11 +246,12 @@ def rewards():
     reset_required = current_user.reset_password
     if reset_required:
         return redirect(url_for('reset_password'))
-    return render_template("rewards.html", rewards=REWARDS, user=current_user)
+    return render_template("rewards.html", rewards=catalog(), left=availability(current_user.id), user=current_user)
 
-@app.route("/redeem/<int:points>", methods=["POST"])
+@app.route("/redeem/<int:reward_id>", methods=["POST"])
 @login_required
-def redeem(points):
+@idempotent
+def redeem(reward_id):
     def fmt(action, path, amount, balance, desc=''):
         return (
             f"{action:<8} | "
@@ -432,80 +261,66 @@ def redeem(points):
             f"{' | ' + desc if desc else ''}"
         )
             
-    reward = next((r for r in REWARDS if r["points"] == points), None)
-    if not reward:
+    if not any(r.id == reward_id for r in catalog()):
         flash("Invalid reward.", "error")
         return redirect(url_for("rewards"))
 
-    if current_user.reward_points < points:
-        flash("Not enough reward points.", "error")
-        return redirect(url_for("rewards"))
-
-    current_user.reward_points -= points
+    spending_account = current_accounts().get("spending")
 
-    if reward["type"] == "cash":
-        spending_account = Account.query.filter_by(user_id=current_user.id, type="spending").first()
-        if spending_account:
-            og_balance = spending_account.balance
-            spending_account.balance += reward["amount"]
-            tx = Transaction(
+    def apply():
+        # Price, stock and limits are those in the database at write time,
+        # whatever the page showed
+        reward = redeem_reward(current_user, reward_id)
+        new_balance = None
+        if reward.type == "cash" and spending_account:
+            new_balance = adjust_balance(spending_account, reward.amount)
+            db.session.add(Transaction(
                 from_account_id=None,
                 to_account_id=spending_account.id,
                 from_user_id=None,
                 to_user_id=current_user.id,
-                amount=reward["amount"],
-                to_balance_after=spending_account.balance,
-                description=f"Redeemed reward: {reward['name']}"
-            )
-            db.session.add(tx)
-            
-            log_user_transaction(
-                current_user,
-                fmt(
-                    "REWARD",
-                    f"Bank → {spending_account.type}",
-                    f"${reward["amount"]}",
-                    f"${og_balance:.2f} → ${spending_account.balance:.2f}",
-                    'Redeemed reward points'
-                )
+                amount=reward.amount,
+                to_balance_after=new_balance,
+                description=f"Redeemed reward: {reward.name}"
+            ))
+        return reward, new_balance
+
+    try:
+        reward, new_balance = run_atomic(apply)
+    except InsufficientPoints:
+        flash("Not enough reward points.", "error")
+        return redirect(url_for("rewards"))
+    except RewardUnavailable:
+        flash("That reward is sold out or you have reached its limit for now.", "error")
+        return redirect(url_for("rewards"))
+
+    if new_balance is not None:
+        log_user_transaction(
+            current_user,
+            fmt(
+                "REWARD",
+                f"Bank → {spending_account.type}",
+                f"${reward.amount:g}",
+                f"${new_balance - reward.amount:.2f} → ${new_balance:.2f}",
+                'Redeemed reward points'
             )
-    db.session.commit()
+        )
 
     with open(LOG_FILE, "a") as f:
         log_entry = (
             f"\n============ {datetime.now():%m-%d-%Y %H:%M} =============\n"
             f" User      : {current_user.username}\n"
-            f" Reward    : {reward['name']}\n"
-            f" Points    : {points} points\n"
+            f" Reward    : {reward.name}\n"
+            f" Points    : {reward.points} points\n"
         )
         f.write(log_entry)
-    flash(f"Successfully redeemed: {reward['name']}", "success")
+    flash(f"Successfully redeemed: {reward.name}", "success")
     return redirect(url_for("rewards"))
 
-@app.route('/dashboard')
-@login_required
-def dashboard():
-    if current_user.reset_password:
-        return redirect(url_for('reset_password'))
-
-    accounts = Account.query.filter_by(user_id=current_user.id).all()
-
-    transactions = (
-        Transaction.query
-        .filter(
-            (Transaction.from_user_id == current_user.id) |
-            (Transaction.to_user_id == current_user.id)
-        )
-        .order_by(
-            Transaction.timestamp.desc(),
-            Transaction.id.desc()
-        )
-        .all()
-    )
-
+def credit_summary(accounts, today):
+    # Credit-cycle figures for the account cards (the payment-due alerts are
+    # precomputed by notifications.py)
     credit_info = {}
-    credit_alerts = []
-    today = date.today()
 
     for acc in accounts:
         if acc.type != 'credit' or not acc.due_date:
@@ -555,246 +370,169 @@ def dashboard():
             'remaining_min_due': round(max(remaining_min_due, 0), 2)
         }
 
-        # ---------- Alerts ----------
-        if remaining_min_due > 0 and due_date <= today:
-            credit_alerts.append({
-                'past_due': acc.past_due,
-                'account_id': acc.id,
-                'balance': acc.balance,
-                'due_date': due_date.strftime('%b %d, %Y'),
-                'min_due': min_due,
-                'remaining_min_due': round(max(remaining_min_due, 0), 2)
-            })
-        elif acc.past_due:
-            credit_alerts.append({
-                'past_due': acc.past_due,
-                'account_id': acc.id,
-                'balance': acc.balance,
-                'due_date': (due_date - timedelta(days=30)).strftime('%b %d, %Y'),
-                'min_due': min_due,
-                'remaining_min_due': round(max(remaining_min_due, 0), 2)
-            })
+    return credit_info
 
-    return render_template(
-        'dashboard.html',
-        accounts=accounts,
-        transactions=transactions,
-        credit_info=credit_info,
-        credit_alerts=credit_alerts,
-        timestamp = datetime.now().strftime('%b %d, %Y')
-    )
-
-@app.route('/transfer', methods=['GET', 'POST'])
+@app.route('/dashboard')
 @login_required
-def transfer():
+def dashboard():
     if current_user.reset_password:
         return redirect(url_for('reset_password'))
-        
-    def fmt(action, path, amount, balance, desc=''):
-            return (
-                f"{action:<8} | "
-                f"{path:<20} | "
-                f"{amount:<8} | "
-                f"{balance:<41}"
-                f"{' | ' + desc if desc else ''}"
-            )
 
-    if request.method == 'POST':
-        from_raw = request.form['from_account']
-        to_raw   = request.form['to_account']
-        amount   = round(float(request.form['amount']), 2)
-        desc     = request.form.get('description', '').strip()
+    accounts = sorted(current_user.accounts, key=lambda acc: acc.id)
 
-        # ---- Parent-only Bank handling ----
-        from_bank = from_raw == 'bank'
-        to_bank   = to_raw == 'bank'
+    transactions = (
+        Transaction.query
+        .filter(
+            (Transaction.from_user_id == current_user.id) |
+            (Transaction.to_user_id == current_user.id)
+        )
+        .order_by(
+            Transaction.timestamp.desc(),
+            Transaction.id.desc()
+        )
+        .all()
+    )
 
-        if (from_bank or to_bank) and current_user.role != 'parent':
-            abort(403)
-            
-        if from_bank and to_bank:
-            flash('Cannot transfer to the same account', 'error')
-            return redirect(url_for('transfer'))
+    # ---- Account cards ----
+    # Only change when the user's data version does (or the day turns over),
+    # so they are rendered once per version
+    today = date.today()
+    stamp = f"{get_data_version(current_user.id)}:{today.isoformat()}"
+    account_cards_html = fragments.get('account_cards', current_user.id, stamp)
 
-        from_acc = None if from_bank else Account.query.get_or_404(int(from_raw))
-        to_acc   = None if to_bank else Account.query.get_or_404(int(to_raw))
-        og_from_balance = from_acc.balance if from_acc else None
-        og_to_balance = to_acc.balance if to_acc else None
+    if account_cards_html is None:
+        credit_info = credit_summary(accounts, today)
+        account_cards_html = render_template('_account_cards.html', accounts=accounts, credit_info=credit_info)
+        fragments.put('account_cards', current_user.id, stamp, account_cards_html)
 
-        # ---- Validation ----
-        if not from_bank and not to_bank and from_acc.id == to_acc.id:
-            flash('Cannot transfer to the same account', 'error')
-            return redirect(url_for('transfer'))
+    # ---- Credit alerts: the unread notifications, one indexed query ----
+    notifications = unread_notifications(current_user.id)
 
-        if not from_bank and from_acc.user_id != current_user.id and current_user.role != 'parent':
-            abort(403)
+    return render_template(
+        'dashboard.html',
+        accounts=accounts,
+        transactions=transactions,
+        account_cards_html=Markup(account_cards_html),
+        credit_alerts_html=Markup(render_template(
+            '_credit_alerts.html', notifications=notifications, kinds=NOTIFICATION_KINDS
+        )),
+        notifications_after=notifications[-1].id if notifications else 0,
+        notify_poll_seconds=NOTIFY_POLL_SECONDS,
+        timestamp = datetime.now().strftime('%b %d, %Y')
+    )
 
-        if amount <= 0:
-            flash('Invalid transfer amount', 'error')
-            return redirect(url_for('transfer'))
+@app.route('/api/notifications')
+@login_required
+def api_notifications():
+    # Polled by the dashboard: unread notifications newer than ?after=<id>,
+    # with the alert overlay re-rendered for all unread ones when any are new
+    after = request.args.get('after', 0, type=int)
+    new = unread_notifications(current_user.id, after)
+    html = None
+    if new:
+        html = render_template(
+            '_credit_alerts.html', notifications=unread_notifications(current_user.id), kinds=NOTIFICATION_KINDS
+        )
+    return {
+        'notifications': [notification_dict(n) for n in new],
+        'last_id': new[-1].id if new else after,
+        'html': html,
+    }
 
-        if not from_bank and from_acc.type == 'credit':
-            flash('Cannot transfer from credit accounts', 'error')
-            return redirect(url_for('transfer'))
+@app.route('/api/notifications/read', methods=['POST'])
+@login_required
+def read_notifications():
+    # JSON body: {"ids": [<notification id>, ...]}; only the user's own are marked
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        return {'error': 'Expected a list of notification ids'}, 400
+    return {'read': mark_notifications_read(current_user.id, ids)}
+
+@app.route('/export/transactions')
+@login_required
+def export_transactions():
+    # ?format=csv|ofx|ndjson&start=YYYY-MM-DD&end=YYYY-MM-DD&account=<id>...
+    # Children export their own history; parents get the whole family, or
+    # one member with ?user=<id>
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+    try:
+        start, end, account_ids = parse_filters(request.args)
+    except ExportError:
+        abort(400)
 
-        if not to_bank and to_acc.type == 'credit':
-            flash('Cannot transfer to credit accounts', 'error')
-            return redirect(url_for('transfer'))
+    user_id = current_user.id
+    if current_user.role == 'parent':
+        user_id = request.args.get('user', type=int)
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"homebank-transactions-{date.today():%Y%m%d}.{extension}"
+    return Response(
+        stream_with_context(stream_export(fmt, user_id, start, end, account_ids)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
 
-        # ---- Savings rules ----
-        penalty = 0
-        if not from_bank and from_acc.type == 'savings':
-            if not (
-                not to_bank and
-                to_acc.user_id == from_acc.user_id and
-                to_acc.type == 'spending'
-            ):
-                flash('Savings can only transfer to your own spending account', 'error')
-                return redirect(url_for('transfer'))
-
-            if amount < 1.00:
-                flash('Minimum $1 transfer from savings required', 'error')
-                return redirect(url_for('transfer'))
-
-            penalty = round(amount * 0.10, 2)
-            total = amount + penalty
-
-            if from_acc.balance < total:
-                flash(f'Insufficient funds including ${penalty:.2f} penalty', 'error')
-                return redirect(url_for('transfer'))
-
-            from_acc.balance -= penalty
-
-            if penalty >= 0.01:
-                db.session.add(Transaction(
-                    from_account_id=from_acc.id,
-                    to_account_id=None,
-                    from_user_id=from_acc.user_id,
-                    to_user_id=None,
-                    amount=penalty,
-                    from_balance_after=from_acc.balance,
-                    to_balance_after=to_acc.balance,
-                    description='Savings withdrawal penalty'
-                ))
-                log_user_transaction(
-                    current_user,
-                    fmt(
-                        "PENALTY",
-                        f"{from_acc.type} → Bank",
-                        f"${penalty:.2f}",
-                        f"${og_from_balance:.2f} → ${from_acc.balance:.2f}",
-                        'Savings withdrawal penalty'
-                    )
-                )
-                og_from_balance = from_acc.balance
-                flash(f'Savings withdrawal penalty applied: ${penalty:.2f}', 'error')
-
-        # ---- Debit source ----
-        if not from_bank:
-            if from_acc.balance < amount:
-                flash('Insufficient funds', 'error')
-                return redirect(url_for('transfer'))
-            from_acc.balance -= amount
-
-        # ---- Credit destination ----
-        if not to_bank:
-            to_acc.balance += amount
-
-        # ---- Transaction log ----
-        db.session.add(Transaction(
-            from_account_id=None if from_bank else from_acc.id,
-            to_account_id=None if to_bank else to_acc.id,
-            from_user_id=current_user.id if from_bank else from_acc.user_id,
-            to_user_id=None if to_bank else to_acc.user_id,
-            amount=amount,
-            from_balance_after=None if from_bank else from_acc.balance,
-            to_balance_after=to_acc.balance,
-            description=desc or (
-                'Bank deposit' if from_bank else
-                'Bank withdrawal' if to_bank else
-                'Transfer'
-            )
-        ))
+@app.route('/search')
+@login_required
+def search():
+    # Ranked full-text search over descriptions, usernames and account types.
+    # Children only ever see their own transactions; parents search the whole
+    # family, or one member with ?user=<id>
+    try:
+        match, start, end, account_ids, limit, offset = parse_search(request.args)
+    except SearchError as e:
+        return {'error': str(e)}, 400
 
-        # ---- Activity logs ----
-        if from_bank:
-            log_user_transaction(
-                current_user,
-                fmt(
-                    "TRANSFER",
-                    f"Bank → {to_acc.user.username}",
-                    f"${amount:.2f}",
-                    f"${og_to_balance:.2f} → ${to_acc.balance:.2f}",
-                    desc
-                )
-            )
+    user_id = current_user.id
+    if current_user.role == 'parent':
+        user_id = request.args.get('user', type=int)
 
-            log_user_transaction(
-                to_acc.user,
-                fmt(
-                    "RECEIVED",
-                    f"Bank → {to_acc.type}",
-                    f"${amount:.2f}",
-                    f"${og_to_balance:.2f} → ${to_acc.balance:.2f}",
-                    desc
-                )
-            )
+    return search_transactions(match, user_id, start, end, account_ids, limit, offset)
 
-        elif to_bank:
-            log_user_transaction(
-                from_acc.user,
-                fmt(
-                    "TRANSFER",
-                    f"{from_acc.type} → Bank",
-                    f"${amount:.2f}",
-                    f"${og_from_balance:.2f} → ${from_acc.balance:.2f}",
-                    desc
-                )
-            )
+@app.route('/transfer', methods=['GET', 'POST'])
+@login_required
+@idempotent
+def transfer():
+    if current_user.reset_password:
+        return redirect(url_for('reset_password'))
+        
+    if request.method == 'POST':
+        amount = round(float(request.form['amount']), 2)
+        desc   = request.form.get('description', '').strip()
 
-        elif from_acc.user == to_acc.user:
-            log_user_transaction(
-                from_acc.user,
-                fmt(
-                    "TRANSFER",
-                    f"{from_acc.type} → {to_acc.type}",
-                    f"${amount:.2f}",
-                    f"${og_from_balance:.2f} → ${from_acc.balance:.2f} ≡ "
-                    f"${og_to_balance:.2f} → ${to_acc.balance:.2f}",
-                    desc
-                )
+        try:
+            leg = validate_transfer(
+                current_user,
+                request.form['from_account'],
+                request.form['to_account'],
+                amount,
+                desc
             )
+        except TransferError as e:
+            if e.status != 400:
+                abort(e.status)
+            flash(e.message, 'error')
+            return redirect(url_for('transfer'))
 
-        else:
-            log_user_transaction(
-                from_acc.user,
-                fmt(
-                    "TRANSFER",
-                    f"{from_acc.type} → {to_acc.user.username}",
-                    f"${amount:.2f}",
-                    f"${og_from_balance:.2f} → ${from_acc.balance:.2f}",
-                    desc
-                )
-            )
+        # ---- Apply atomically ----
+        try:
+            after, = run_atomic(lambda: apply_transfers(current_user, [leg]))
+        except InsufficientFunds:
+            flash('Insufficient funds', 'error')
+            return redirect(url_for('transfer'))
 
-            log_user_transaction(
-                to_acc.user,
-                fmt(
-                    "RECEIVED",
-                    f"{from_acc.user.username} → {to_acc.type}",
-                    f"${amount:.2f}",
-                    f"${og_to_balance:.2f} → ${to_acc.balance:.2f}",
-                    desc
-                )
-            )
+        # ---- Activity logs ----
+        for user, message in transfer_log_lines(current_user, leg, after):
+            log_user_transaction(user, message)
 
-        # ---- Rewards ----
-        if not to_bank and to_acc.type == 'savings' and to_acc.user_id == current_user.id:
-            points = int(amount * SAVINGS_REWARD_RATE)
-            current_user.reward_points = (current_user.reward_points or 0) + points
-            flash(f'Awarded {points} reward points for adding to savings!', 'success')
+        if leg.penalty >= 0.01:
+            flash(f'Savings withdrawal penalty applied: ${leg.penalty:.2f}', 'error')
 
-        db.session.commit()
+        if leg.points:
+            flash(f'Awarded {leg.points} reward points for adding to savings!', 'success')
 
         flash(f'Transfer of ${amount:.2f} completed successfully', 'success')
         return redirect(url_for('transfer'))
@@ -803,11 +541,10 @@ def transfer():
     if current_user.role == 'parent':
         accounts = Account.query.filter(Account.type.in_(['spending', 'savings'])).all()
     else:
-        accounts = Account.query.filter_by(user_id=current_user.id)\
-            .filter(Account.type.in_(['spending', 'savings'])).all()
+        accounts = [acc for acc in current_user.accounts if acc.type in ('spending', 'savings')]
 
-    own_savings = Account.query.filter_by(user_id=current_user.id, type='savings').all()
-    own_spending = Account.query.filter_by(user_id=current_user.id, type='spending').all()
+    own_savings = [acc for acc in current_user.accounts if acc.type == 'savings']
+    own_spending = [acc for acc in current_user.accounts if acc.type == 'spending']
     other_spending = Account.query.filter(
         Account.user_id != current_user.id,
         Account.type == 'spending'
@@ -821,8 +558,79 @@ def transfer():
         other_accounts=other_accounts
     )
 
+@app.route('/transfer/batch', methods=['POST'])
+@login_required
+@idempotent
+def transfer_batch():
+    # JSON body: {"transfers": [{"from": <account id|"bank">, "to": ..., "amount": ..., "description": ...}, ...]}
+    # Every leg is validated first; the batch is applied all-or-nothing in one
+    # transaction and the response carries a result per leg.
+    if current_user.reset_password:
+        abort(403)
+
+    data = request.get_json(silent=True) or {}
+    items = data.get('transfers') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return {"ok": False, "error": "Expected a non-empty list of transfers"}, 400
+    if len(items) > BATCH_TRANSFER_MAX_LEGS:
+        return {"ok": False, "error": f"At most {BATCH_TRANSFER_MAX_LEGS} transfers per batch"}, 400
+
+    # ---- Validate every leg ----
+    legs, results = [], []
+    balances = {}
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise TransferError('Invalid transfer')
+            try:
+                amount = round(float(item.get('amount')), 2)
+            except (TypeError, ValueError):
+                raise TransferError('Invalid transfer amount')
+            legs.append(validate_transfer(
+                current_user,
+                str(item.get('from')),
+                str(item.get('to')),
+                amount,
+                str(item.get('description') or '').strip(),
+                balances
+            ))
+            results.append({"index": index, "ok": True})
+        except TransferError as e:
+            results.append({"index": index, "ok": False, "error": e.message})
+
+    if not all(r['ok'] for r in results):
+        return {"ok": False, "results": results}, 400
+
+    # ---- Apply atomically ----
+    try:
+        applied = run_atomic(lambda: apply_transfers(current_user, legs))
+    except InsufficientFunds as e:
+        for result, leg in zip(results, legs):
+            if leg.from_acc is not None and leg.from_acc.id == e.account_id:
+                result.update(ok=False, error='Insufficient funds')
+        return {"ok": False, "results": results}, 409
+
+    # ---- Activity logs, one write per user ----
+    lines = {}
+    for leg, after in zip(legs, applied):
+        for user, message in transfer_log_lines(current_user, leg, after):
+            lines.setdefault(user, []).append(message)
+    for user, messages in lines.items():
+        log_user_transactions(user, messages)
+
+    for result, leg, after in zip(results, legs, applied):
+        result.update(
+            amount=leg.amount,
+            penalty=leg.penalty,
+            points=leg.points,
+            from_balance=after.get('from'),
+            to_balance=after.get('to')
+        )
+    return {"ok": True, "results": results}
+
 @app.route('/credit/withdraw', methods=['GET','POST'])
 @login_required
+@idempotent
 def credit_withdraw():
     reset_required = current_user.reset_password
     if reset_required:
@@ -837,37 +645,46 @@ def credit_withdraw():
             f"{' | ' + desc if desc else ''}"
         )
         
-    credit = Account.query.filter_by(user_id=current_user.id, type='credit').first()
-    spending = Account.query.filter_by(user_id=current_user.id, type='spending').first()
-    og_from_balance = credit.balance if credit else None
-    og_to_balance = spending.balance if spending else None
+    credit = current_accounts().get('credit')
+    spending = current_accounts().get('spending')
     
     if request.method == 'POST':
         amount = round(float(request.form['amount']), 2)
         if credit is None or spending is None:
             flash('Missing accounts', 'error')
             return redirect(url_for('dashboard'))
+        if amount <= 0:
+            flash('Invalid amount', 'error')
+            return redirect(url_for('credit_withdraw'))
         available = credit.credit_limit - credit.balance
         if amount > available:
             flash('Amount exceeds credit limit', 'error')
             return redirect(url_for('credit_withdraw'))
 
-        credit.balance += amount
-        spending.balance += amount
-        tx = Transaction(from_account_id=credit.id, to_account_id=spending.id,
-                         from_user_id=current_user.id, to_user_id=current_user.id,
-                         amount=amount, from_balance_after=credit.balance,
-                         to_balance_after=spending.balance, description='Credit withdraw')
-        db.session.add(tx)
-        db.session.commit()
+        def apply():
+            credit_balance = adjust_balance(credit, amount, maximum=Account.credit_limit)
+            spending_balance = adjust_balance(spending, amount)
+            tx = Transaction(from_account_id=credit.id, to_account_id=spending.id,
+                             from_user_id=current_user.id, to_user_id=current_user.id,
+                             amount=amount, from_balance_after=credit_balance,
+                             to_balance_after=spending_balance, description='Credit withdraw')
+            db.session.add(tx)
+            return credit_balance, spending_balance
+
+        try:
+            credit_balance, spending_balance = run_atomic(apply)
+        except InsufficientFunds:
+            flash('Amount exceeds credit limit', 'error')
+            return redirect(url_for('credit_withdraw'))
+
         log_user_transaction(
             current_user,
             fmt(
                 "TRANSFER",
                 f"{credit.type} → {spending.type}",
                 f"${amount:.2f}",
-                f"${og_from_balance:.2f} → ${credit.balance:.2f} ≡ "
-                f"${og_to_balance:.2f} → ${spending.balance:.2f}",
+                f"${credit_balance - amount:.2f} → ${credit_balance:.2f} ≡ "
+                f"${spending_balance - amount:.2f} → ${spending_balance:.2f}",
                 'Credit withdraw'
             )
         )
@@ -877,84 +694,51 @@ def credit_withdraw():
 
 @app.route('/credit/pay', methods=['GET','POST'])
 @login_required
+@idempotent
 def credit_pay():
     reset_required = current_user.reset_password
     if reset_required:
         return redirect(url_for('reset_password'))
         
-    def fmt(action, path, amount, balance, desc=''):
-        return (
-            f"{action:<8} | "
-            f"{path:<20} | "
-            f"{amount:<8} | "
-            f"{balance:<41}"
-            f"{' | ' + desc if desc else ''}"
-        )    
-    
-    credit = Account.query.filter_by(user_id=current_user.id, type='credit').first()
-    spending = Account.query.filter_by(user_id=current_user.id, type='spending').first()
-    og_from_balance = spending.balance if spending else None
-    og_to_balance = credit.balance if credit else None
+    credit = current_accounts().get('credit')
+    spending = current_accounts().get('spending')
 
     if request.method == 'POST':
         amount = round(float(request.form['amount']), 2)
 
-        if spending.balance < amount:
+        if amount <= 0:
+            flash('Invalid amount', 'error')
+            return redirect(url_for('credit_pay'))
+        elif spending.balance < amount:
             flash('Insufficient funds in spending account', 'error')
             return redirect(url_for('credit_pay'))
         elif amount > credit.balance:
             flash('Amount exceeds balance due', 'error')
             return redirect(url_for('credit_pay'))
 
-        carried_balance = max(credit.past_amt, 0)
-        min_due = round(MIN_PAYMENT_AMT * carried_balance, 2)
-        cycle_start = date.fromisoformat(credit.due_date) - timedelta(days=30)
-        cycle_start_dt = datetime.combine(cycle_start, datetime.min.time())
-        cycle_end_dt = datetime.combine(date.fromisoformat(credit.due_date), datetime.max.time())
-
-        payments = Transaction.query.filter(
-            Transaction.to_account_id == credit.id,
-            Transaction.description == 'Credit payment',
-            Transaction.timestamp >= cycle_start_dt,
-            Transaction.timestamp <= cycle_end_dt
-        ).all()
-
-        already_paid = sum(tx.amount for tx in payments)
-        remaining_min_due = round(max(min_due - already_paid, 0), 2)
+        remaining_min_due = remaining_minimum_due(credit)
         applied_to_min = min(amount, remaining_min_due)
         remaining_min_due -= applied_to_min
 
-        if credit.past_due and remaining_min_due <= 0:
-            credit.past_due = False
-            flash('Your account is no longer past due 😃', 'success')
+        clears_past_due = credit.past_due and remaining_min_due <= 0
 
-        spending.balance -= amount
-        credit.balance -= amount
-        
+        try:
+            spending_balance, credit_balance = run_atomic(
+                lambda: apply_credit_payment(spending, credit, amount, clears_past_due)
+            )
+        except InsufficientFunds as e:
+            if e.account_id == spending.id:
+                flash('Insufficient funds in spending account', 'error')
+            else:
+                flash('Amount exceeds balance due', 'error')
+            return redirect(url_for('credit_pay'))
 
-        tx = Transaction(
-            from_account_id=spending.id,
-            to_account_id=credit.id,
-            from_user_id=spending.user_id,
-            to_user_id=credit.user_id,
-            amount=amount,
-            from_balance_after=spending.balance,
-            to_balance_after=credit.balance,
-            description='Credit payment'
-        )
-        db.session.add(tx)
+        if clears_past_due:
+            flash('Your account is no longer past due 😃', 'success')
 
-        db.session.commit()
         log_user_transaction(
             current_user,
-            fmt(
-                "PAYMENT",
-                f"{spending.type} → {credit.type}",
-                f"${amount:.2f}",
-                f"${og_from_balance:.2f} → ${spending.balance:.2f} ≡ "
-                f"${og_to_balance:.2f} → ${credit.balance:.2f}",
-                "Credit payment"
-            )
+            credit_payment_log_line(spending, credit, amount, spending_balance, credit_balance)
         )
         flash(f'Thank you for your payment! ${amount:.2f} applied to credit balance', 'success')
         return redirect(url_for('credit_pay'))
@@ -986,23 +770,83 @@ def credit_history():
         history=history
     )
 
+@app.route("/analytics")
+@login_required
+@requires_role('parent')
+def analytics():
+    children = User.query.filter_by(role='child').order_by(User.username).all()
+    return render_template("analytics.html", children=children)
+
+@app.route("/api/analytics")
+@login_required
+@requires_role('parent')
+def analytics_api():
+    # Answered from the daily rollups only, so any range costs the same
+    # whatever the size of the transaction history
+    try:
+        start, end, period, user_ids = parse_range(request.args)
+    except AnalyticsError as e:
+        return {'error': str(e)}, 400
+    return family_analytics(start, end, period, user_ids)
+
+@app.route("/api/points")
+@login_required
+@requires_role('parent')
+def points_api():
+    # Points earned and spent per period and reason, same parameters as
+    # /api/analytics
+    try:
+        start, end, period, user_ids = parse_range(request.args)
+    except AnalyticsError as e:
+        return {'error': str(e)}, 400
+    return points_summary(start, end, period, user_ids)
+
+@app.route("/challenges")
+@login_required
+def challenges():
+    # Parents see every child's progress, children their own; either way it
+    # is read as kept by the triggers, in one query
+    parent = current_user.role == 'parent'
+    rows = challenge_rows(None if parent else current_user.id)
+    children = User.query.filter_by(role='child').order_by(User.username).all() if parent else []
+    return render_template(
+        "challenges.html", active_challenges=grouped_challenges(rows), children=children,
+        metrics=CHALLENGE_METRICS, status=challenge_status, percent=challenge_percent
+    )
+
+@app.route("/challenges/create", methods=["POST"])
+@login_required
+@requires_role('parent')
+def create_challenge():
+    children = User.query.filter_by(role='child').all()
+    try:
+        values, user_ids = parse_challenge(request.form, children)
+    except ChallengeError as e:
+        for error in e.errors:
+            flash(error, 'error')
+        return redirect(url_for('challenges'))
+    new_challenge(values, user_ids, current_user)
+    flash(f"Challenge created: {values['title']}", 'success')
+    return redirect(url_for('challenges'))
+
+@app.route("/challenges/<int:challenge_id>/delete", methods=["POST"])
+@login_required
+@requires_role('parent')
+def delete_challenge(challenge_id):
+    if not remove_challenge(challenge_id):
+        abort(404)
+    flash("Challenge deleted", 'success')
+    return redirect(url_for('challenges'))
+
 @app.route('/admin', methods=['GET', 'POST'])
 @login_required
 @requires_role('parent')
 def admin_panel():
+    # ?q= filters by username, ?page= pages through the results; both are
+    # carried through the edit forms so a save lands back on the same page
+    search = request.values.get('q', '').strip()
+    page = request.values.get('page', 1, type=int)
 
-    users = User.query.all()
-    logs = {}
-
-    def read_log(path):
-        try:
-            with open(path, 'r') as f:
-                return ''.join(f.readlines())
-        except FileNotFoundError:
-            return "Log file not found."
-        except Exception as e:
-            return f"Error reading log: {e}"
-            
     def fmt(action, path, amount, balance, desc=''):
         return (
             f"{action:<8} | "
@@ -1012,23 +856,19 @@ def admin_panel():
             f"{' | ' + desc if desc else ''}"
         )    
 
-    logs['Rewards'] = read_log(LOG_FILE)
-    logs['Credit'] = read_log('log/interest_history.log')
-    logs['Authentication'] = read_log(AUTH_LOG_FILE)
-
-    transaction_logs = {}
-    for file_path in sorted(glob.glob('log/transactions/*')):
-        filename = os.path.basename(file_path)
-        transaction_logs[filename] = read_log(file_path)
-
-    logs['Transactions'] = transaction_logs
-
     if request.method == 'POST':
         try:
             user_id = int(request.form.get('user_id', 0))
         except ValueError:
             abort(400)
-        user = User.query.get(user_id)
+        # The user and all of their accounts in one query
+        user = db.session.execute(
+            db.select(User).options(joinedload(User.accounts)).where(User.id == user_id)
+        ).unique().scalar_one_or_none()
+        if user is None:
+            abort(404)
+        accounts = {acc.type: acc for acc in user.accounts}
+
         new_password = request.form.get('password')
         if new_password:
             user.password_hash = generate_password_hash(new_password)
@@ -1039,38 +879,37 @@ def admin_panel():
         for acc_type in ['spending', 'savings', 'credit']:
             new_balance = request.form.get(f'{acc_type}_balance')
             if new_balance is not None and new_balance != '':
-                acc = Account.query.filter_by(user_id=user.id, type=acc_type).first()
+                acc = accounts.get(acc_type)
                 if acc:
                     og_balance = acc.balance
                     acc.balance = float(new_balance)
                     if og_balance != acc.balance:
                         log_user_transaction(
-                            acc.user,
+                            user,
                             fmt(
                                 "MODIFIED",
-                                f"{acc.user.username} {acc.type}",
+                                f"{user.username} {acc.type}",
                                 f"${(acc.balance - og_balance):.2f}",
                                 f"${og_balance:.2f} → ${acc.balance:.2f}",
                                 f"Balance Changed by {current_user.username}"
                             )
                         )
                     
+        credit_acc = accounts.get('credit')
 
         new_credit_limit = request.form.get('credit_limit')
         if new_credit_limit is not None and new_credit_limit != '':
-            credit_acc = Account.query.filter_by(user_id=user.id, type='credit').first()
             if credit_acc:
                 credit_acc.credit_limit = float(new_credit_limit)
 
         new_interest_rate = request.form.get('interest_rate')
         if new_interest_rate is not None and new_interest_rate != '':
-            credit_acc = Account.query.filter_by(user_id=user.id, type='credit').first()
             if credit_acc:
                 credit_acc.interest_rate = float(new_interest_rate)
 
         new_rewards = request.form.get('reward_points')
         if new_rewards is not None and new_rewards != '':
-            user.reward_points = int(new_rewards)
+            set_points(user, int(new_rewards), 'admin', f"Set by {current_user.username}")
             
         new_score = request.form.get('credit_score')
         if new_score is not None and new_score != '':
@@ -1088,16 +927,174 @@ def admin_panel():
         two_fa_requested = 'two_factor_enabled' in request.form
         if two_fa_requested == 1 and not user.two_factor_enabled:
             flash('You can only disable 2FA, setup must be performed by user', 'error')
-            return redirect(url_for('admin_panel'))
+            return redirect(url_for('admin_panel', q=search or None, page=page))
         elif two_fa_requested == 0 and user.two_factor_enabled: 
+            forget_qr(provisioning_uri(user))
             user.two_factor_enabled = False
             user.totp_secret = None
 
         db.session.commit()
         flash(f'Updated user {user.username}', 'success')
+        return redirect(url_for('admin_panel', q=search or None, page=page))
+
+    # One page of users, with every account on the page loaded by a single
+    # extra IN query instead of one lazy load per user
+    query = db.select(User).options(selectinload(User.accounts)).order_by(User.username)
+    if search:
+        query = query.where(User.username.icontains(search, autoescape=True))
+    users = db.paginate(query, page=page, per_page=ADMIN_USERS_PER_PAGE, error_out=False)
+
+    logs = {}
+
+    def read_log(path):
+        try:
+            with open(path, 'r') as f:
+                return ''.join(f.readlines())
+        except FileNotFoundError:
+            return "Log file not found."
+        except Exception as e:
+            return f"Error reading log: {e}"
+
+    logs['Rewards'] = read_log(LOG_FILE)
+    logs['Credit'] = read_log('log/interest_history.log')
+    logs['Authentication'] = read_log(AUTH_LOG_FILE)
+
+    transaction_logs = {}
+    for file_path in sorted(glob.glob('log/transactions/*')):
+        filename = os.path.basename(file_path)
+        transaction_logs[filename] = read_log(file_path)
+
+    logs['Transactions'] = transaction_logs
+
+    return render_template('admin.html', users=users, search=search, logs=logs)
+
+@app.route('/admin/settings/export')
+@login_required
+@requires_role('parent')
+def admin_settings_export():
+    # Every user's settings and balances, in the format the import reads
+    fmt = request.args.get('format', 'csv')
+    if fmt not in SETTINGS_FORMATS:
+        abort(400)
+    filename = f"homebank-settings-{date.today():%Y%m%d}.{fmt}"
+    return Response(
+        export_settings(fmt),
+        mimetype=SETTINGS_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/admin/settings/import', methods=['POST'])
+@login_required
+@requires_role('parent')
+def admin_settings_import():
+    # Step one uploads a file and shows what would change. Step two posts the
+    # previewed values back with the basis they were diffed against, and
+    # applies them all in one transaction.
+    confirm = 'payload' in request.form
+    try:
+        if confirm:
+            payload = json.loads(request.form['payload'])
+            if not isinstance(payload, dict):
+                abort(400)
+            rows = [{'username': username, **values} for username, values in payload.items()]
+        else:
+            file = request.files.get('file')
+            if not file or not file.filename:
+                flash('Choose a CSV or JSON file to import', 'error')
+                return redirect(url_for('admin_panel'))
+            rows = read_settings(file.filename, file.read())
+        values, users = validate_settings(rows)
+    except ValueError:
+        abort(400)
+    except SettingsError as e:
+        return render_template('admin_import.html', errors=e.errors, changes=[])
+
+    changes = plan_settings(values, users)
+    if not confirm:
+        return render_template(
+            'admin_import.html', errors=[], changes=changes,
+            payload=json.dumps(values), basis=settings_basis(changes)
+        )
+
+    if request.form.get('basis') != settings_basis(changes):
+        flash('Settings changed since the preview was made, please review the import again', 'error')
         return redirect(url_for('admin_panel'))
 
-    return render_template('admin.html', users=users, logs=logs)
+    lines = apply_settings(changes, current_user)
+    db.session.commit()
+    for user, messages in lines.items():
+        log_user_transactions(user, messages)
+
+    flash(f"Imported {len(changes)} change(s) for {len(lines)} user(s)", 'success')
+    return redirect(url_for('admin_panel'))
+
+@app.route('/admin/rewards', methods=['GET', 'POST'])
+@login_required
+@requires_role('parent')
+def admin_rewards():
+    # Reward catalog editor. Rewards are retired by unticking active rather
+    # than deleted, so past redemptions keep pointing at them.
+    if request.method == 'POST':
+        reward_id = request.form.get('reward_id', type=int)
+        try:
+            save_reward(reward_id, parse_reward(request.form))
+        except RewardError as e:
+            for error in e.errors:
+                flash(error, 'error')
+        else:
+            flash(f"Saved {request.form.get('name', '').strip()}", 'success')
+        return redirect(url_for('admin_rewards'))
+
+    rewards = Reward.query.order_by(Reward.active.desc(), Reward.points.desc(), Reward.id).all()
+    return render_template('admin_rewards.html', rewards=rewards, limit_periods=LIMIT_PERIODS)
+
+@app.route('/admin/scheduled', methods=['GET', 'POST'])
+@login_required
+@requires_role('parent')
+def admin_scheduled():
+    # Recurring transfers; scheduler.py runs them as they fall due
+    page = request.values.get('page', 1, type=int)
+    if request.method == 'POST':
+        try:
+            new_schedule(parse_schedule(request.form, current_user), current_user)
+        except ScheduleError as e:
+            for error in e.errors:
+                flash(error, 'error')
+        else:
+            flash('Scheduled transfer saved', 'success')
+        return redirect(url_for('admin_scheduled', page=page))
+
+    query = db.select(ScheduledTransfer).options(
+        selectinload(ScheduledTransfer.from_account).selectinload(Account.user),
+        selectinload(ScheduledTransfer.to_account).selectinload(Account.user),
+    ).order_by(ScheduledTransfer.next_run_at.is_(None), ScheduledTransfer.next_run_at, ScheduledTransfer.id)
+    rules = db.paginate(query, page=page, per_page=SCHEDULES_PER_PAGE, error_out=False)
+    accounts = Account.query.join(User).options(selectinload(Account.user)).order_by(User.username, Account.type).all()
+    return render_template(
+        'admin_scheduled.html', rules=rules, accounts=accounts,
+        kinds=SCHEDULE_KINDS, intervals=SCHEDULE_INTERVALS
+    )
+
+@app.route('/admin/scheduled/<int:rule_id>/pause', methods=['POST'])
+@login_required
+@requires_role('parent')
+def pause_scheduled(rule_id):
+    rule = db.session.get(ScheduledTransfer, rule_id)
+    if rule is None:
+        abort(404)
+    paused = rule.next_run_at is not None
+    pause_schedule(rule, paused)
+    flash('Scheduled transfer paused' if paused else 'Scheduled transfer resumed', 'success')
+    return redirect(url_for('admin_scheduled', page=request.form.get('page', 1, type=int)))
+
+@app.route('/admin/scheduled/<int:rule_id>/delete', methods=['POST'])
+@login_required
+@requires_role('parent')
+def delete_scheduled(rule_id):
+    if not remove_schedule(rule_id):
+        abort(404)
+    flash('Scheduled transfer deleted', 'success')
+    return redirect(url_for('admin_scheduled', page=request.form.get('page', 1, type=int)))
 
 @app.route('/admin/create_user', methods=['GET','POST'])
 @login_required
@@ -1157,7 +1154,7 @@ def reset_password():
 @app.route("/help")
 @login_required
 def help():
-    credit_acc = Account.query.filter_by(user_id=current_user.id, type='credit').first()
+    credit_acc = current_accounts().get('credit')
     return render_template(
         "help.html",
         current_user=current_user,
@@ -1176,40 +1173,92 @@ def ai_help():
     if not message:
         return {"response": "Please enter a question."}
 
-    # Gather context
-    accounts = Account.query.filter_by(user_id=current_user.id).all()
-    transactions = Transaction.query.filter(
-        (Transaction.from_user_id == current_user.id) |
-        (Transaction.to_user_id == current_user.id)
-    ).all()
-
-    system_prompt = build_ai_system_prompt(current_user, accounts, transactions)
+    context = ai_contexts.get(current_user)
+    cache_key = ai_answers.key(message, context.prompt)
+    cached = ai_answers.get(cache_key)
+    if cached is not None:
+        return {"response": cached}
 
     try:
-        response = requests.post(
-            "http://localhost:11434/api/chat",
-            json={
-                "model": "llama3.2:latest",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": message}
-                ],
-                "stream": False,
-                "options": {
-                  "temperature": 0.0,
-                  "top_p": 0.9,
-                  "repeat_penalty": 1.05
-                }
-            },
-            timeout=120
-        )
-        result = response.json()
-        ai_reply = result["message"]["content"]
+        ai_reply = ai_client.chat(context.prompt, message)
+        ai_answers.put(cache_key, ai_reply)
+    except AIBusyError:
+        ai_reply = AI_BUSY_MESSAGE
     except Exception:
-        ai_reply = "AI assistant is currently unavailable."
+        ai_reply = AI_UNAVAILABLE_MESSAGE
 
     return {"response": ai_reply}
 
+@app.route("/ai_help/stream", methods=["POST"])
+@login_required
+def ai_help_stream():
+    message = (request.json or {}).get("message", "").strip()
+    if not message:
+        return Response(
+            sse_event("token", {"token": "Please enter a question."}) + sse_event("done", {}),
+            mimetype="text/event-stream"
+        )
+
+    context = ai_contexts.get(current_user)
+    cache_key = ai_answers.key(message, context.prompt)
+    cached = ai_answers.get(cache_key)
+    if cached is not None:
+        return Response(
+            sse_event("token", {"token": cached}) + sse_event("done", {"ttft_ms": 0, "cached": True}),
+            mimetype="text/event-stream"
+        )
+
+    system_prompt = context.prompt
+    username = current_user.username
+
+    def generate():
+        started = time.monotonic()
+        first_token_at = None
+        tokens = 0
+        answer = []
+        result = 'FAIL'
+        upstream = ai_client.stream_chat(system_prompt, message)
+
+        try:
+            for token in upstream:
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                tokens += 1
+                answer.append(token)
+                yield sse_event("token", {"token": token})
+            result = 'SUCCESS'
+            ai_answers.put(cache_key, "".join(answer))
+        except GeneratorExit:
+            # Client went away, closing upstream below cancels the generation
+            result = 'CANCEL'
+            raise
+        except AIBusyError:
+            result = 'BUSY'
+            yield sse_event("error", {"error": AI_BUSY_MESSAGE})
+        except Exception:
+            yield sse_event("error", {"error": AI_UNAVAILABLE_MESSAGE})
+        finally:
+            upstream.close()
+            ttft = f"{(first_token_at - started) * 1000:.0f}ms" if first_token_at else "-"
+            total = f"{(time.monotonic() - started) * 1000:.0f}ms"
+            log_ai_timing(None, f"{result:<7} | {username:<14} | {ttft:<8} | {total:<8} | {tokens}")
+
+        yield sse_event("done", {
+            "ttft_ms": round((first_token_at - started) * 1000) if first_token_at else None
+        })
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route("/admin/ai_cache")
+@login_required
+@requires_role('parent')
+def ai_cache_stats():
+    return ai_answers.stats()
 
 @app.route('/2fa/setup', methods=['GET', 'POST'])
 @login_required
@@ -1231,16 +1280,25 @@ def two_factor_setup():
         current_user.totp_secret = pyotp.random_base32()
         db.session.commit()
 
-    totp_uri = pyotp.totp.TOTP(current_user.totp_secret).provisioning_uri(
-        name=current_user.username, issuer_name="My Home Bank"
-    )
+    # The QR itself is a separate request; the version in its URL changes
+    # with the secret so browsers never show a stale code
+    qr_url = url_for('two_factor_qr', v=qr_version(provisioning_uri(current_user)))
+    return render_template('2fa_setup.html', qr_url=qr_url)
 
-    img = qrcode.make(totp_uri)
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    qr_data = base64.b64encode(buffer.getvalue()).decode()
+@app.route('/2fa/qr.svg')
+@login_required
+def two_factor_qr():
+    if not current_user.totp_secret:
+        abort(404)
 
-    return render_template('2fa_setup.html', qr_data=qr_data)
+    version, svg = qr_svg(provisioning_uri(current_user))
+    response = Response(svg, mimetype='image/svg+xml')
+    response.set_etag(version)
+    if request.args.get('v') == version:
+        response.headers['Cache-Control'] = f"private, max-age={TOTP_QR_MAX_AGE}"
+    else:
+        response.headers['Cache-Control'] = "private, no-cache"
+    return response.make_conditional(request)
     
 @app.route('/2fa/verify', methods=['GET', 'POST'])
 @limiter.limit("5 per minute")
@@ -1271,6 +1329,8 @@ def two_factor_verify():
 @app.route('/2fa/disable', methods=['POST'])
 @login_required
 def two_factor_disable():
+    if current_user.totp_secret:
+        forget_qr(provisioning_uri(current_user))
     current_user.two_factor_enabled = False
     current_user.totp_secret = None
     db.session.commit()
@@ -1308,38 +1368,29 @@ def preferences():
 
             current_user.username = new_username
 
-            # Avatar upload
-            file = request.files.get('avatar')
-            if file and file.filename:
+            # Avatar and background uploads are checked here and resized in
+            # the background; the new image shows once its variants exist
+            uploads = []
+            for kind, field, error in (('avatar', 'avatar', 'Invalid file type'),
+                                       ('bg', 'background', 'Invalid background file type')):
+                file = request.files.get(field)
+                if not file or not file.filename:
+                    continue
                 if not allowed_file(file.filename):
-                    flash('Invalid file type', 'error')
+                    flash(error, 'error')
                     return redirect(url_for('preferences'))
-
-                filename = secure_filename(
-                    f"user_{current_user.id}.{file.filename.rsplit('.',1)[1].lower()}"
-                )
-
-                os.makedirs(app.config['AVATAR_FOLDER'], exist_ok=True)
-                file_path = os.path.join(app.config['AVATAR_FOLDER'], filename)
-                file.save(file_path)
-
-                current_user.avatar = filename
-                
-            # Background upload
-            bg_file = request.files.get('background')
-            if bg_file and bg_file.filename:
-                if not allowed_file(bg_file.filename):
-                    flash('Invalid background file type', 'error')
+                try:
+                    data, digest = read_upload(file)
+                except InvalidImage:
+                    flash(error, 'error')
                     return redirect(url_for('preferences'))
-
-                bg_filename = secure_filename(
-                    f"user_{current_user.id}.{bg_file.filename.rsplit('.',1)[1].lower()}"
-                )
-                os.makedirs(app.config['BG_FOLDER'], exist_ok=True)
-                bg_file.save(os.path.join(app.config['BG_FOLDER'], bg_filename))
-                current_user.background = bg_filename
+                uploads.append((kind, data, digest))
 
             db.session.commit()
+
+            for kind, data, digest in uploads:
+                queue_upload(app, current_user.id, kind, data, digest)
+
             flash('Profile updated successfully', 'success')
 
         # Password update
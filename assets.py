@@ -0,0 +1,135 @@
+import os
+import re
+import glob
+import gzip
+import json
+import shutil
+import hashlib
+import mimetypes
+from flask import request, url_for, send_from_directory
+from werkzeug.security import safe_join
+from config import *
+
+try:
+    import brotli
+except ImportError:  # optional: without it only .gz copies are written
+    brotli = None
+
+STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
+
+# Resized uploads are already named by content hash (see images.py)
+UPLOAD_VARIANT_RE = re.compile(r'(avatar|bg)/[0-9a-f]{16}-\d+\.(webp|jpg)')
+# Names build() writes: stem.<10 hex digits>.ext
+FINGERPRINTED_RE = re.compile(r'(.*/)?[^/]+\.[0-9a-f]{10}(\.[^./]+)?')
+
+_manifest = None
+
+
+# ---- Build step (python assets.py) ----
+def fingerprint(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data, hashlib.sha256(data).hexdigest()[:10]
+
+
+def write_compressed(path, data):
+    with open(f"{path}.gz", 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(f"{path}.br", 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build():
+    manifest = {}
+    for pattern in ASSET_SOURCES:
+        for source in sorted(glob.glob(os.path.join(STATIC_FOLDER, pattern))):
+            name = os.path.relpath(source, STATIC_FOLDER).replace(os.sep, '/')
+            data, digest = fingerprint(source)
+            stem, ext = os.path.splitext(name)
+            hashed = f"{stem}.{digest}{ext}"
+            manifest[name] = hashed
+
+            target = os.path.join(ASSET_DIST_FOLDER, hashed)
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            if ext.lstrip('.').lower() in ASSET_COMPRESS_EXTENSIONS:
+                write_compressed(target, data)
+
+    os.makedirs(ASSET_DIST_FOLDER, exist_ok=True)
+    tmp = f"{ASSET_MANIFEST}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, ASSET_MANIFEST)
+    return manifest
+
+
+# ---- URLs ----
+def load_manifest():
+    global _manifest
+    try:
+        with open(ASSET_MANIFEST) as f:
+            _manifest = json.load(f)
+    except (OSError, ValueError):
+        _manifest = {}
+    return _manifest
+
+
+def asset_url(name):
+    # Fingerprinted URL from the manifest. Anything not in it (no build yet,
+    # or an image a user uploaded before uploads were fingerprinted) gets its
+    # plain static URL with the file's mtime as a cache-busting version.
+    manifest = _manifest if _manifest is not None else load_manifest()
+    hashed = manifest.get(name)
+    if hashed:
+        return url_for('static', filename=f"dist/{hashed}")
+    try:
+        version = int(os.path.getmtime(os.path.join(STATIC_FOLDER, name)))
+    except OSError:
+        return url_for('static', filename=name)
+    return url_for('static', filename=name, v=version)
+
+
+# ---- Serving ----
+def set_immutable(response):
+    response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    return response
+
+
+def send_asset(filename):
+    # Serves a file from static/dist, picking the .br or .gz copy when the client
+    # accepts it. A front-end server can do the same straight from static/dist.
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = None
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        compressed = safe_join(ASSET_DIST_FOLDER, filename + suffix)
+        if request.accept_encodings[encoding] and compressed and os.path.isfile(compressed):
+            response = send_from_directory(ASSET_DIST_FOLDER, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(ASSET_DIST_FOLDER, filename, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    if FINGERPRINTED_RE.fullmatch(filename):
+        return set_immutable(response)
+    # manifest.json and anything else unhashed changes in place on the next
+    # build, so browsers must check back with the server before reusing it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def cache_upload_variants(response):
+    # after_request hook: content-hashed upload variants never change either
+    if request.endpoint == 'static' and response.status_code == 200:
+        filename = (request.view_args or {}).get('filename', '')
+        if UPLOAD_VARIANT_RE.fullmatch(filename):
+            set_immutable(response)
+    return response
+
+
+if __name__ == '__main__':
+    manifest = build()
+    print(f"Fingerprinted {len(manifest)} assets into {ASSET_DIST_FOLDER}"
+          f"{'' if brotli else ' (brotli not installed, gzip only)'}")
@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import time
+import sqlite3
+from datetime import datetime, timedelta
+from models import db
+from config import *
+
+# Online snapshots of the live database through SQLite's backup API. Pages
+# are copied BACKUP_PAGES_PER_STEP at a time with a pause between steps, so
+# the backup only ever holds the database for one short step and workers
+# and the billing job keep writing while it runs. Usage:
+#   python backups.py snapshot          (take one, then apply retention)
+#   python backups.py schedule          (snapshot every BACKUP_INTERVAL seconds)
+#   python backups.py list
+#   python backups.py verify [FILE]     (default: newest snapshot)
+#   python backups.py restore FILE
+
+SNAPSHOT_RE = re.compile(r'^homebank-(\d{8}-\d{6})\.db$')
+
+# Tables a snapshot must contain to be worth restoring
+REQUIRED_TABLES = ('user', 'account', 'transaction')
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def database_path():
+    from app import app
+    with app.app_context():
+        return db.engine.url.database
+
+
+def snapshot_name(when):
+    return f"homebank-{when:%Y%m%d-%H%M%S}.db"
+
+
+def snapshots(folder=BACKUP_FOLDER):
+    # (taken at, path), newest first
+    found = []
+    for name in os.listdir(folder) if os.path.isdir(folder) else ():
+        match = SNAPSHOT_RE.match(name)
+        if match:
+            found.append((datetime.strptime(match.group(1), '%Y%m%d-%H%M%S'), os.path.join(folder, name)))
+    return sorted(found, reverse=True)
+
+
+def copy_database(source_path, dest_path, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP,
+                  max_restarts=BACKUP_MAX_RESTARTS):
+    # Stepped copy. A write to the source between steps makes SQLite start
+    # the copy over, so each restart doubles the step size, and after
+    # max_restarts the rest is copied in a single step (writers then wait for
+    # that one step). Returns (pages copied, restarts, seconds).
+    started = time.perf_counter()
+    restarts = 0
+    source = sqlite3.connect(source_path, timeout=BACKUP_BUSY_TIMEOUT)
+    try:
+        while True:
+            seen = {'remaining': None}
+
+            def progress(status, remaining, total):
+                if seen['remaining'] is not None and remaining > seen['remaining']:
+                    raise _Restarted()
+                seen['remaining'] = remaining
+                seen['total'] = total
+
+            dest = sqlite3.connect(dest_path)
+            try:
+                step = pages * 2 ** restarts if restarts < max_restarts else -1
+                source.backup(dest, pages=step, progress=progress, sleep=sleep)
+                return seen.get('total', 0), restarts, time.perf_counter() - started
+            except _Restarted:
+                restarts += 1
+            finally:
+                dest.close()
+    finally:
+        source.close()
+
+
+def verify(path):
+    # Integrity check plus the tables the app cannot run without. Returns row
+    # counts for those tables.
+    if not os.path.exists(path):
+        raise BackupError(f"{path} does not exist")
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchall()
+        if result != [('ok',)]:
+            raise BackupError(f"{path} failed the integrity check: {result[:5]}")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = [t for t in REQUIRED_TABLES if t not in tables]
+        if missing:
+            raise BackupError(f"{path} is missing table(s): {', '.join(missing)}")
+        return {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in REQUIRED_TABLES}
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f"{path} is not a usable database: {e}")
+    finally:
+        conn.close()
+
+
+def snapshot(source_path, folder=BACKUP_FOLDER, now=None):
+    # Copies to a temp name and only renames once the copy verifies, so a
+    # half-written file never looks like a snapshot
+    now = now or datetime.now()
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, snapshot_name(now))
+    while os.path.exists(path):
+        # Two snapshots in the same second (restore's safety copy, say)
+        now += timedelta(seconds=1)
+        path = os.path.join(folder, snapshot_name(now))
+    tmp = path + '.tmp'
+    try:
+        pages, restarts, elapsed = copy_database(source_path, tmp)
+        counts = verify(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path, pages, restarts, elapsed, counts
+
+
+def prune(folder=BACKUP_FOLDER, now=None):
+    # Keeps the newest BACKUP_KEEP_LAST snapshots, plus the newest of each of
+    # the last BACKUP_KEEP_DAYS days and BACKUP_KEEP_WEEKS weeks
+    now = now or datetime.now()
+    existing = snapshots(folder)
+    keep = {path for _, path in existing[:BACKUP_KEEP_LAST]}
+    days, weeks = set(), set()
+    for taken, path in existing:
+        day = taken.date()
+        week = day - timedelta(days=day.weekday())
+        if now - taken <= timedelta(days=BACKUP_KEEP_DAYS) and day not in days:
+            days.add(day)
+            keep.add(path)
+        if now - taken <= timedelta(weeks=BACKUP_KEEP_WEEKS) and week not in weeks:
+            weeks.add(week)
+            keep.add(path)
+
+    removed = []
+    for _, path in existing:
+        if path not in keep:
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+
+def restore(snapshot_path, target_path, folder=BACKUP_FOLDER):
+    # Verifies the snapshot, saves the current database as a snapshot of its
+    # own, then copies the snapshot over the live file through the backup API
+    # so open connections see the restored data rather than a swapped inode
+    verify(snapshot_path)
+    safety = snapshot(target_path, folder)[0]
+    source = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+    target = sqlite3.connect(target_path, timeout=BACKUP_BUSY_TIMEOUT)
+    try:
+        started = time.perf_counter()
+        floor = _max_data_version(target) + 1
+        source.backup(target)
+        # The snapshot's data versions are older than ones the page caches
+        # have already seen, so move every user past all of them
+        with target:
+            target.execute(
+                'INSERT INTO user_data_version (user_id, version) SELECT id, :floor FROM "user" WHERE true '
+                'ON CONFLICT(user_id) DO UPDATE SET version = version + :floor',
+                {'floor': floor}
+            )
+        return safety, time.perf_counter() - started
+    finally:
+        target.close()
+        source.close()
+
+
+def _max_data_version(conn):
+    try:
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM user_data_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+def _report_snapshot(path, pages, restarts, elapsed, counts):
+    size = os.path.getsize(path) / 1024 / 1024
+    print(f"{datetime.now()}: snapshot {path} ({size:.1f} MB, {pages} pages) in {elapsed:.2f}s"
+          f"{f', {restarts} restart(s)' if restarts else ''}; "
+          + ', '.join(f"{table}: {count}" for table, count in counts.items()))
+
+
+def take_snapshot(db_path):
+    _report_snapshot(*snapshot(db_path))
+    for path in prune():
+        print(f"  removed {path}")
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'snapshot'
+    db_path = database_path()
+    try:
+        if command == 'snapshot':
+            take_snapshot(db_path)
+        elif command == 'schedule':
+            while True:
+                take_snapshot(db_path)
+                time.sleep(BACKUP_INTERVAL)
+        elif command == 'list':
+            for taken, path in snapshots():
+                print(f"{taken}  {os.path.getsize(path) / 1024 / 1024:8.1f} MB  {path}")
+        elif command == 'verify':
+            existing = snapshots()
+            path = sys.argv[2] if len(sys.argv) > 2 else (existing[0][1] if existing else None)
+            if path is None:
+                raise BackupError("No snapshots to verify")
+            counts = verify(path)
+            print(f"{path} is OK; " + ', '.join(f"{table}: {count}" for table, count in counts.items()))
+        elif command == 'restore' and len(sys.argv) > 2:
+            safety, elapsed = restore(sys.argv[2], db_path)
+            print(f"Restored {sys.argv[2]} in {elapsed:.2f}s; the previous database was saved as {safety}")
+        else:
+            print("usage: python backups.py snapshot|schedule|list|verify [FILE]|restore FILE")
+            sys.exit(2)
+    except BackupError as e:
+        print(f"Backup error: {e}")
+        sys.exit(1)
@@ -0,0 +1,80 @@
+# Load benchmark for the AI client against the local Ollama stub. Usage:
+#   python -m bench.ai_client_bench --requests 200 --concurrency 20
+import time
+import argparse
+import statistics
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from ai_client import AIClient, AIBusyError
+from bench import ollama_stub
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(label, call, total, concurrency):
+    latencies, busy, errors = [], 0, 0
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            call()
+            return "ok", time.perf_counter() - started
+        except AIBusyError:
+            return "busy", time.perf_counter() - started
+        except Exception:
+            return "error", time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for status, elapsed in pool.map(one, range(total)):
+            if status == "ok":
+                latencies.append(elapsed * 1000)
+            elif status == "busy":
+                busy += 1
+            else:
+                errors += 1
+    wall = time.perf_counter() - started
+
+    print(
+        f"{label:<26} | ok {len(latencies):>4} | busy {busy:>4} | err {errors:>4} | "
+        f"p50 {percentile(latencies, 50):>7.1f}ms | p95 {percentile(latencies, 95):>7.1f}ms | "
+        f"mean {statistics.mean(latencies) if latencies else 0:>7.1f}ms | {total / wall:>6.1f} req/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--ttft", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--max-inflight", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=8)
+    args = parser.parse_args()
+
+    server = ollama_stub.start(ttft=args.ttft, token_delay=args.token_delay)
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/chat"
+    client = AIClient(url=url, max_inflight=args.max_inflight,
+                      max_queue=args.max_queue, queue_timeout=5)
+
+    def fresh_connection():
+        requests.post(url, json=client.payload("system", "question"), timeout=120).json()
+
+    def pooled():
+        client.chat("system", "question")
+
+    def pooled_stream():
+        for _ in client.stream_chat("system", "question"):
+            pass
+
+    print(f"{args.requests} requests, {args.concurrency} concurrent callers, "
+          f"{args.max_inflight} in flight, queue {args.max_queue}\n")
+    run("unbounded requests.post", fresh_connection, args.requests, args.concurrency)
+    run("AIClient.chat", pooled, args.requests, args.concurrency)
+    run("AIClient.stream_chat", pooled_stream, args.requests, args.concurrency)
+    server.shutdown()
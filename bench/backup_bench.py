@@ -0,0 +1,104 @@
+# Takes snapshots of a synthetic database through backups.py while another
+# process keeps making small transfers against it, and reports backup time
+# and the writer's latency before and during the backup. Usage:
+#   python -m bench.backup_bench --rows 500000 --interval 0.02
+#   python -m bench.backup_bench --rows 500000 --naive   (also a single-step copy, for comparison)
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+from models import db
+import importer
+import backups
+from bench.import_bench import make_app, write_csv
+
+IDLE_SECONDS = 2
+
+
+def writer(path, interval, stop, results):
+    # One transfer per transaction, like a request would make
+    rng = random.Random(1)
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    accounts = [row[0] for row in conn.execute("SELECT id FROM account")]
+    samples = []
+    while not stop.is_set():
+        src, dst = rng.sample(accounts, 2)
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE account SET balance = balance - 1 WHERE id = ?", (src,))
+        conn.execute("UPDATE account SET balance = balance + 1 WHERE id = ?", (dst,))
+        conn.execute(
+            'INSERT INTO "transaction" (amount, description, from_account_id, to_account_id) VALUES (1, ?, ?, ?)',
+            ("Bench transfer", src, dst),
+        )
+        conn.execute("COMMIT")
+        samples.append((started, time.perf_counter() - started))
+        time.sleep(interval)
+    conn.close()
+    results.put(samples)
+
+
+def latencies(samples, start, end):
+    values = sorted(latency for started, latency in samples if start <= started < end)
+    if not values:
+        return "no writes"
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return (f"{len(values):6,} writes  p50 {pick(0.5):7.2f} ms  p99 {pick(0.99):8.2f} ms  "
+            f"max {values[-1] * 1000:8.2f} ms")
+
+
+def single_step(source_path, dest_path):
+    started = time.perf_counter()
+    source, dest = sqlite3.connect(source_path), sqlite3.connect(dest_path)
+    source.backup(dest)
+    dest.close()
+    source.close()
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--interval", type=float, default=0.02, help="seconds between writes")
+    parser.add_argument("--naive", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bank.db")
+        source = os.path.join(tmp, "history.csv")
+        write_csv(source, args.rows)
+        app = make_app(path)
+        with app.app_context():
+            with db.engine.connect() as connection:
+                accounts = importer.Accounts(connection)
+            importer.import_rows(importer.read_csv(accounts, source), report=lambda line: None)
+        print(f"database: {args.rows:,} transactions, {os.path.getsize(path) / 1024 / 1024:.0f} MB")
+
+        stop, results = multiprocessing.Event(), multiprocessing.Queue()
+        process = multiprocessing.Process(target=writer, args=(path, args.interval, stop, results))
+        process.start()
+
+        phases = []
+        start = time.perf_counter()
+        time.sleep(IDLE_SECONDS)
+        phases.append(("no backup", start, time.perf_counter(), None))
+
+        start = time.perf_counter()
+        snapshot, pages, restarts, elapsed, counts = backups.snapshot(path, os.path.join(tmp, "backups"))
+        phases.append((f"stepped ({restarts} restarts)", start, time.perf_counter(), elapsed))
+
+        if args.naive:
+            start = time.perf_counter()
+            elapsed = single_step(path, os.path.join(tmp, "naive.db"))
+            phases.append(("single step", start, time.perf_counter(), elapsed))
+
+        stop.set()
+        samples = results.get()
+        process.join()
+
+        for name, start, end, elapsed in phases:
+            took = f"backup {elapsed:6.2f}s" if elapsed is not None else " " * 14
+            print(f"{name:22} {took}  {latencies(samples, start, end)}")
@@ -0,0 +1,115 @@
+# Streams a large synthetic transaction history through each export format
+# and reports throughput and memory. Usage:
+#   python -m bench.export_bench --rows 2000000
+#   python -m bench.export_bench --rows 500000 --naive   (load everything first, for comparison)
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import resource
+from datetime import datetime, timedelta
+from flask import Flask
+from models import db, User, Account
+from exports import stream_export, stream_rows, transactions_query, export_csv
+
+USERS = 4
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    db.init_app(app)
+    return app
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def setup(path, rows):
+    app = make_app(path)
+    with app.app_context():
+        db.create_all()
+        for i in range(USERS):
+            user = User(username=f"kid{i}", password_hash="")
+            db.session.add(user)
+            db.session.flush()
+            for acc_type in ('spending', 'savings', 'credit'):
+                db.session.add(Account(user_id=user.id, type=acc_type, balance=0.0))
+        db.session.commit()
+
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+    conn = sqlite3.connect(path)
+    batch = []
+    for i in range(rows):
+        src, dst = rng.sample(range(1, USERS * 3 + 1), 2)
+        batch.append((src, dst, (src - 1) // 3 + 1, (dst - 1) // 3 + 1, round(rng.uniform(1, 100), 2),
+                      (start + timedelta(seconds=i * 30)).strftime('%Y-%m-%d %H:%M:%S'),
+                      'Transfer', round(rng.uniform(0, 1000), 2), round(rng.uniform(0, 1000), 2)))
+        if len(batch) == 50_000:
+            conn.executemany(
+                "INSERT INTO \"transaction\" (from_account_id, to_account_id, from_user_id, to_user_id, amount, "
+                "timestamp, description, from_balance_after, to_balance_after) VALUES (?,?,?,?,?,?,?,?,?)", batch)
+            batch = []
+    if batch:
+        conn.executemany(
+            "INSERT INTO \"transaction\" (from_account_id, to_account_id, from_user_id, to_user_id, amount, "
+            "timestamp, description, from_balance_after, to_balance_after) VALUES (?,?,?,?,?,?,?,?,?)", batch)
+    conn.commit()
+    conn.close()
+    return app
+
+
+def run(label, chunks):
+    before = rss_mb()
+    max_rss = before
+    started = time.perf_counter()
+    first = None
+    size = 0
+    for n, chunk in enumerate(chunks):
+        if first is None:
+            first = time.perf_counter() - started
+        size += len(chunk)
+        if n % 50 == 0:
+            max_rss = max(max_rss, rss_mb())
+    elapsed = time.perf_counter() - started
+    max_rss = max(max_rss, rss_mb())
+    print(f"{label:<8} {size / 1024 / 1024:8.1f} MB in {elapsed:6.2f}s  "
+          f"({size / 1024 / 1024 / elapsed:6.1f} MB/s, first byte {first * 1000:6.1f} ms, "
+          f"RSS +{max_rss - before:6.1f} MB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--formats", default="csv,ndjson,ofx")
+    parser.add_argument("--naive", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export.db")
+        started = time.perf_counter()
+        app = setup(path, args.rows)
+        print(f"built {args.rows:,} transactions in {time.perf_counter() - started:.1f}s "
+              f"({os.path.getsize(path) / 1024 / 1024:.0f} MB database)")
+
+        with app.app_context():
+            for fmt in args.formats.split(','):
+                run(fmt, stream_export(fmt, None))
+
+            if args.naive:
+                # What a plain .all() export would do: every row in memory first
+                def naive():
+                    rows = list(stream_rows(transactions_query(None)))
+                    yield from export_csv(iter(rows))
+                run("naive", naive())
+
+        print(f"peak process RSS {peak_mb():.0f} MB")
@@ -0,0 +1,101 @@
+# Loads a synthetic CSV history through importer.py into a temp database
+# (with the rollup and search triggers installed, as in production) and
+# reports rows/s. Usage:
+#   python -m bench.import_bench --rows 1000000
+#   python -m bench.import_bench --rows 20000 --naive   (ORM row-at-a-time, for comparison)
+import os
+import csv
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from flask import Flask
+from models import db, User, Account, Transaction, init_db
+import importer
+
+USERS = 4
+TYPES = ('spending', 'savings', 'credit')
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    db.init_app(app)
+    init_db(app)
+    with app.app_context():
+        for i in range(USERS):
+            user = User(username=f"kid{i}", password_hash="")
+            db.session.add(user)
+            db.session.flush()
+            for acc_type in TYPES:
+                db.session.add(Account(user_id=user.id, type=acc_type, balance=0.0))
+        db.session.commit()
+    return app
+
+
+def write_csv(path, rows):
+    rng = random.Random(0)
+    start = datetime(2018, 1, 1)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['timestamp', 'amount', 'description', 'from_user', 'from_account_type', 'to_user', 'to_account_type'])
+        for i in range(rows):
+            src, dst = rng.sample(range(USERS), 2)
+            writer.writerow([
+                start + timedelta(seconds=i * 30), round(rng.uniform(1, 100), 2),
+                rng.choice(('Transfer', 'Weekly allowance', 'Lawn mowing', 'Birthday money')),
+                f"kid{src}", 'spending', f"kid{dst}", rng.choice(('spending', 'savings')),
+            ])
+
+
+def naive(rows):
+    # Row-at-a-time through the ORM, balances read back from the accounts
+    started = time.perf_counter()
+    with db.engine.connect() as connection:
+        accounts = importer.Accounts(connection)
+    for row in rows:
+        if isinstance(row, importer.ImportRowError):
+            continue
+        timestamp, amount, description, from_acc, to_acc = row
+        src = db.session.get(Account, from_acc.id)
+        dst = db.session.get(Account, to_acc.id)
+        src.balance -= amount
+        dst.balance += amount
+        db.session.add(Transaction(
+            timestamp=timestamp, amount=amount, description=description,
+            from_account_id=src.id, to_account_id=dst.id, from_user_id=src.user_id, to_user_id=dst.user_id,
+            from_balance_after=src.balance, to_balance_after=dst.balance,
+        ))
+        db.session.commit()
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--naive", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "history.csv")
+        write_csv(source, args.rows)
+        print(f"wrote {args.rows:,} rows ({os.path.getsize(source) / 1024 / 1024:.0f} MB CSV)")
+
+        app = make_app(os.path.join(tmp, "bulk.db"))
+        with app.app_context():
+            with db.engine.connect() as connection:
+                accounts = importer.Accounts(connection)
+            imported, skipped, errors, elapsed = importer.import_rows(
+                importer.read_csv(accounts, source), report=lambda line: None
+            )
+            print(f"bulk     {imported:,} rows in {elapsed:6.2f}s  ({imported / elapsed:10,.0f} rows/s, "
+                  f"indexes, rollups and search index rebuilt at the end)")
+
+        if args.naive:
+            app = make_app(os.path.join(tmp, "naive.db"))
+            with app.app_context():
+                with db.engine.connect() as connection:
+                    accounts = importer.Accounts(connection)
+                elapsed = naive(importer.read_csv(accounts, source))
+                print(f"naive    {args.rows:,} rows in {elapsed:6.2f}s  ({args.rows / elapsed:10,.0f} rows/s)")
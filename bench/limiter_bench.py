@@ -0,0 +1,56 @@
+# Rate limiter overhead per request, and correctness across processes. Usage:
+#   python -m bench.limiter_bench --hits 20000 --processes 4
+import os
+import time
+import argparse
+import tempfile
+import statistics
+from multiprocessing import Pool
+from limits import parse
+from limits.storage import MemoryStorage
+from limits.strategies import FixedWindowRateLimiter
+from ratelimit_storage import SQLiteStorage
+
+LIMIT = parse("5 per minute")
+
+
+def time_hits(storage, hits):
+    limiter = FixedWindowRateLimiter(storage)
+    samples = []
+    for i in range(hits):
+        started = time.perf_counter()
+        limiter.hit(LIMIT, f"10.0.{i % 250}.{i % 97}", "/login")
+        samples.append((time.perf_counter() - started) * 1_000_000)
+    samples.sort()
+    return statistics.mean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+
+def hammer(args):
+    uri, hits = args
+    limiter = FixedWindowRateLimiter(SQLiteStorage(uri))
+    allowed = 0
+    for _ in range(hits):
+        allowed += limiter.hit(LIMIT, "203.0.113.7", "/login")
+    return allowed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=20000)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f"sqlite:///{os.path.join(tmp, 'ratelimit.db')}"
+
+        print(f"{args.hits} hits, limit {LIMIT}\n")
+        for label, storage in (("memory", MemoryStorage()), ("sqlite", SQLiteStorage(uri))):
+            mean, p50, p99 = time_hits(storage, args.hits)
+            print(f"{label:<8} | mean {mean:>7.1f}us | p50 {p50:>7.1f}us | p99 {p99:>7.1f}us")
+
+        # Every process hits the same client key; only LIMIT.amount may pass in total
+        SQLiteStorage(uri).reset()
+        with Pool(args.processes) as pool:
+            allowed = sum(pool.map(hammer, [(uri, 200)] * args.processes))
+        print(f"\n{args.processes} processes x 200 hits on one key: {allowed} allowed "
+              f"(expected {LIMIT.amount}) -> {'OK' if allowed == LIMIT.amount else 'MISMATCH'}")
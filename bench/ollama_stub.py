@@ -0,0 +1,81 @@
+# Minimal stand-in for the Ollama /api/chat endpoint, for local testing and
+# load benchmarks without a model. Usage:
+#   python -m bench.ollama_stub --port 11434 --ttft 0.5 --token-delay 0.02
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+REPLY = "Great question! Saving a little every week is a wonderful habit."
+
+
+def make_handler(ttft, token_delay):
+    class OllamaStubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            if self.path != "/api/chat":
+                self.send_error(404)
+                return
+
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            tokens = [w + " " for w in REPLY.split()]
+            time.sleep(ttft)
+
+            if not body.get("stream", True):
+                time.sleep(token_delay * len(tokens))
+                data = json.dumps({
+                    "model": body.get("model"),
+                    "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                    "done": True
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for token in tokens:
+                    self._chunk({"message": {"role": "assistant", "content": token}, "done": False})
+                    time.sleep(token_delay)
+                self._chunk({"message": {"role": "assistant", "content": ""}, "done": True})
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # Client cancelled the generation
+                self.close_connection = True
+
+        def _chunk(self, obj):
+            line = (json.dumps(obj) + "\n").encode()
+            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+
+        def log_message(self, *args):
+            pass
+
+    return OllamaStubHandler
+
+
+def start(port=0, ttft=0.2, token_delay=0.01):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(ttft, token_delay))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.ttft, args.token_delay))
+    print(f"Ollama stub listening on http://127.0.0.1:{args.port}/api/chat")
+    server.serve_forever()
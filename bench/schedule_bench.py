@@ -0,0 +1,83 @@
+# Files a large number of scheduled transfers in a temp database, a few of
+# them due, and times one scheduler.run_due() pass: the due lookup goes
+# through the next_run_at index, so the pass should cost about the same
+# whether 1,000 or 1,000,000 rules are on file. Usage:
+#   python -m bench.schedule_bench --rules 200000 --due 100
+#   python -m bench.schedule_bench --rules 200000 --due 100 --naive   (also a load-every-rule scan, for comparison)
+import os
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select
+from models import db, User, Account, ScheduledTransfer
+import scheduler
+from bench.import_bench import make_app
+
+
+def file_rules(count, due, now):
+    rng = random.Random(0)
+    parent = User(username="parent", password_hash="", role="parent")
+    db.session.add(parent)
+    db.session.flush()
+    spending = db.session.execute(select(Account.id).where(Account.type == 'spending')).scalars().all()
+    rows = []
+    for i in range(count):
+        # The first `due` rules fell due a minute ago, the rest later this year
+        next_run = now - timedelta(minutes=1) if i < due else now + timedelta(minutes=rng.randint(1, 525600))
+        rows.append(dict(
+            created_by=parent.id, from_account_id=None, to_account_id=rng.choice(spending),
+            kind='fixed', amount=1.0, description='Bench chore pay', interval='weekly', every=1,
+            starts_at=next_run, next_run_at=next_run, failures=0,
+        ))
+        if len(rows) == 10000:
+            db.session.execute(insert(ScheduledTransfer), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(ScheduledTransfer), rows)
+    db.session.commit()
+
+
+def naive_scan(now):
+    # What a scheduler without next_run_at would do: read every rule and work
+    # out in Python which are due
+    started = time.perf_counter()
+    due = [rule.id for rule in db.session.execute(select(ScheduledTransfer)).scalars()
+           if rule.next_run_at is not None and rule.next_run_at <= now]
+    db.session.expunge_all()
+    return len(due), time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, default=200_000)
+    parser.add_argument("--due", type=int, default=100)
+    parser.add_argument("--naive", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bank.db")
+        app = make_app(path)
+        now = datetime.now()
+        with app.app_context():
+            file_rules(args.rules, args.due, now)
+            print(f"database: {args.rules:,} scheduled transfers, {args.due:,} due")
+
+            started = time.perf_counter()
+            ids = scheduler.due_ids(now, args.due + 1)
+            print(f"due lookup      {(time.perf_counter() - started) * 1000:9.2f} ms  ({len(ids)} rules)")
+
+            if args.naive:
+                found, elapsed = naive_scan(now)
+                print(f"full scan       {elapsed * 1000:9.2f} ms  ({found} rules)")
+
+            started = time.perf_counter()
+            ran, failed = scheduler.run_due(now, log=lambda user, messages: None)
+            elapsed = time.perf_counter() - started
+            print(f"run_due pass    {elapsed * 1000:9.2f} ms  ({len(ran)} ran, {len(failed)} failed, "
+                  f"{elapsed / max(len(ran) + len(failed), 1) * 1000:.2f} ms per rule)")
+
+            started = time.perf_counter()
+            ran, failed = scheduler.run_due(now, log=lambda user, messages: None)
+            print(f"idle pass       {(time.perf_counter() - started) * 1000:9.2f} ms  ({len(ran)} ran)")
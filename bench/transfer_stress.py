@@ -0,0 +1,125 @@
+# Concurrency stress test for balance updates: many processes move money
+# between the same few accounts at once, then the total is checked. Usage:
+#   python -m bench.transfer_stress --processes 8 --transfers 300
+#   python -m bench.transfer_stress --naive    (old read-modify-write, loses money)
+import os
+import time
+import random
+import argparse
+import tempfile
+from multiprocessing import Pool
+from flask import Flask
+from sqlalchemy import func
+from models import db, User, Account, Transaction
+from ledger import adjust_balance, run_atomic, InsufficientFunds
+
+START_BALANCE = 1000.0
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    db.init_app(app)
+    return app
+
+
+def setup(path, accounts):
+    app = make_app(path)
+    with app.app_context():
+        db.create_all()
+        for i in range(accounts):
+            user = User(username=f"kid{i}", password_hash="")
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Account(user_id=user.id, type='spending', balance=START_BALANCE))
+        db.session.commit()
+
+
+def worker(args):
+    path, transfers, naive, seed = args
+    rng = random.Random(seed)
+    app = make_app(path)
+    done = rejected = 0
+
+    with app.app_context():
+        ids = [acc_id for (acc_id,) in db.session.query(Account.id).all()]
+        for _ in range(transfers):
+            src_id, dst_id = rng.sample(ids, 2)
+            amount = round(rng.uniform(1, 50), 2)
+            src = db.session.get(Account, src_id)
+            dst = db.session.get(Account, dst_id)
+
+            if naive:
+                # What the routes used to do: read, modify in Python, commit
+                if src.balance < amount:
+                    rejected += 1
+                    db.session.rollback()
+                    continue
+                src.balance -= amount
+                dst.balance += amount
+                db.session.add(Transaction(from_account_id=src.id, to_account_id=dst.id,
+                                           from_user_id=src.user_id, to_user_id=dst.user_id,
+                                           amount=amount, description='Transfer'))
+                db.session.commit()
+                done += 1
+                continue
+
+            def move():
+                adjust_balance(src, -amount, minimum=0)
+                adjust_balance(dst, amount)
+                db.session.add(Transaction(from_account_id=src.id, to_account_id=dst.id,
+                                           from_user_id=src.user_id, to_user_id=dst.user_id,
+                                           amount=amount, description='Transfer'))
+            try:
+                run_atomic(move)
+                done += 1
+            except InsufficientFunds:
+                rejected += 1
+    return done, rejected
+
+
+def check(path):
+    app = make_app(path)
+    with app.app_context():
+        accounts = Account.query.all()
+        total = round(sum(acc.balance for acc in accounts), 2)
+        expected = round(START_BALANCE * len(accounts), 2)
+        negative = sum(1 for acc in accounts if acc.balance < 0)
+
+        # Every balance must equal its start plus what the transaction rows say
+        mismatched = 0
+        for acc in accounts:
+            incoming = db.session.query(func.coalesce(func.sum(Transaction.amount), 0.0)).filter(Transaction.to_account_id == acc.id).scalar()
+            outgoing = db.session.query(func.coalesce(func.sum(Transaction.amount), 0.0)).filter(Transaction.from_account_id == acc.id).scalar()
+            if abs(START_BALANCE + incoming - outgoing - acc.balance) > 0.005:
+                mismatched += 1
+        return total, expected, negative, mismatched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--transfers", type=int, default=300)
+    parser.add_argument("--accounts", type=int, default=4)
+    parser.add_argument("--naive", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stress.db")
+        setup(path, args.accounts)
+
+        started = time.perf_counter()
+        with Pool(args.processes) as pool:
+            results = pool.map(worker, [(path, args.transfers, args.naive, seed) for seed in range(args.processes)])
+        elapsed = time.perf_counter() - started
+
+        done = sum(r[0] for r in results)
+        rejected = sum(r[1] for r in results)
+        total, expected, negative, mismatched = check(path)
+
+        print(f"mode        : {'naive read-modify-write' if args.naive else 'conditional updates'}")
+        print(f"transfers   : {done} applied, {rejected} rejected in {elapsed:.2f}s ({done / elapsed:.0f}/s)")
+        print(f"money       : ${total:,.2f} (expected ${expected:,.2f})")
+        print(f"negative    : {negative} accounts")
+        print(f"mismatched  : {mismatched} accounts disagree with their transaction history")
+        print("RESULT      :", "OK" if total == expected and not negative and not mismatched else "LOST UPDATES")
@@ -0,0 +1,211 @@
+import io
+import csv
+import math
+import json
+import hashlib
+from collections import namedtuple, defaultdict
+from sqlalchemy import select, update
+from sqlalchemy.orm import selectinload
+from models import db, User, Account, bump_data_version
+from ledger import record_points_set
+from transfers import fmt
+from config import *
+
+# File column -> (account type, or None for the user row), attribute, type,
+# allowed range. Blank cells leave the current value alone.
+Field = namedtuple('Field', 'account attr kind minimum maximum money')
+
+FIELDS = {
+    'spending_balance': Field('spending', 'balance', float, None, None, True),
+    'savings_balance': Field('savings', 'balance', float, None, None, True),
+    'credit_balance': Field('credit', 'balance', float, None, None, True),
+    'credit_limit': Field('credit', 'credit_limit', float, 0, None, True),
+    'interest_rate': Field('credit', 'interest_rate', float, 0, 1, False),
+    'allowance_rate': Field(None, 'allowance_rate', float, 0, None, True),
+    'savings_apr': Field(None, 'savings_apr', float, 0, 1, False),
+    'reward_points': Field(None, 'reward_points', int, 0, None, False),
+    'credit_score': Field(None, 'credit_score', int, 300, 850, False),
+}
+
+COLUMNS = ['username'] + list(FIELDS)
+
+FORMATS = {'csv': 'text/csv', 'json': 'application/json'}
+
+# One changed value: model and primary key to update, plus what the preview
+# and audit log show
+Change = namedtuple('Change', 'user model row_id field attr old new')
+
+
+class SettingsError(Exception):
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def load_users(usernames=None):
+    # Users and every account they own, in two queries whatever the count
+    stmt = select(User).options(selectinload(User.accounts)).order_by(User.username)
+    if usernames is not None:
+        stmt = stmt.where(User.username.in_(usernames))
+    return db.session.execute(stmt).scalars().all()
+
+
+def _value(user, field):
+    if field.account is None:
+        return getattr(user, field.attr)
+    acc = next((a for a in user.accounts if a.type == field.account), None)
+    return getattr(acc, field.attr) if acc else None
+
+
+def show(field, value):
+    if value is None:
+        return '-'
+    return f"${value:.2f}" if field.money else f"{value}"
+
+
+def read_file(filename, data):
+    # CSV with a header row, or JSON as a list of objects (a {"users": [...]}
+    # wrapper is accepted too). Returns a list of {column: raw value} dicts.
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    try:
+        if filename.lower().endswith('.json'):
+            rows = json.loads(text)
+            if isinstance(rows, dict):
+                rows = rows.get('users')
+            if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+                raise SettingsError(['JSON must be a list of objects, one per user'])
+            return rows
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or 'username' not in reader.fieldnames:
+            raise SettingsError(['CSV needs a header row with a username column'])
+        return list(reader)
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        raise SettingsError([f'Could not read {filename}: {e}'])
+
+
+def validate(rows):
+    # Raw rows to {username: {column: value}}, collecting every problem so the
+    # admin can fix the whole file in one go
+    errors = []
+    values = {}
+    for line, row in enumerate(rows, start=1):
+        username = str(row.get('username') or '').strip()
+        if not username:
+            errors.append(f'Row {line}: username is required')
+            continue
+        if username in values:
+            errors.append(f'Row {line}: {username} appears more than once')
+            continue
+        unknown = set(row) - set(COLUMNS)
+        if unknown:
+            errors.append(f"Row {line}: unknown column(s) {', '.join(sorted(unknown))}")
+
+        parsed = {}
+        for column, field in FIELDS.items():
+            raw = row.get(column)
+            if raw is None or str(raw).strip() == '':
+                continue
+            try:
+                value = float(str(raw).strip())
+                if not math.isfinite(value):
+                    raise ValueError(raw)
+            except ValueError:
+                errors.append(f'Row {line}: {column} must be a number, got {raw!r}')
+                continue
+            if field.kind is int:
+                if not value.is_integer():
+                    errors.append(f'Row {line}: {column} must be a whole number, got {raw!r}')
+                    continue
+                value = int(value)
+            if field.minimum is not None and value < field.minimum:
+                errors.append(f'Row {line}: {column} must be at least {field.minimum}')
+                continue
+            if field.maximum is not None and value > field.maximum:
+                errors.append(f'Row {line}: {column} must be at most {field.maximum}')
+                continue
+            parsed[column] = round(value, 2) if field.money else value
+        values[username] = parsed
+
+    users = {u.username: u for u in load_users(list(values))}
+    for username in values:
+        if username not in users:
+            errors.append(f'Unknown user {username}')
+    if errors:
+        raise SettingsError(errors)
+    return values, users
+
+
+def plan(values, users):
+    changes = []
+    for username, parsed in values.items():
+        user = users[username]
+        accounts = {acc.type: acc for acc in user.accounts}
+        for column, new in parsed.items():
+            field = FIELDS[column]
+            if field.account is None:
+                model, row_id = User, user.id
+            elif field.account in accounts:
+                model, row_id = Account, accounts[field.account].id
+            else:
+                continue
+            old = _value(user, field)
+            if old != new:
+                changes.append(Change(user, model, row_id, column, field.attr, old, new))
+    return changes
+
+
+def basis(changes):
+    # Fingerprint of the values a preview was computed against; applying
+    # refuses to go ahead if any of them has moved since
+    state = [(c.model.__name__, c.row_id, c.attr, c.old) for c in changes]
+    return hashlib.sha256(json.dumps(state, default=str).encode()).hexdigest()
+
+
+def apply(changes, admin):
+    # Bulk UPDATEs by primary key, one statement per table, in the caller's
+    # transaction. Returns {user: [MODIFIED log lines]} for the caller to
+    # write once the commit has gone through.
+    record_points_set(
+        [(c.row_id, c.new) for c in changes if c.model is User and c.attr == 'reward_points'],
+        'admin', f"Bulk import by {admin.username}"
+    )
+    rows = {User: defaultdict(dict), Account: defaultdict(dict)}
+    for c in changes:
+        rows[c.model][c.row_id][c.attr] = c.new
+    for model, by_id in rows.items():
+        if by_id:
+            db.session.execute(update(model), [{'id': row_id, **attrs} for row_id, attrs in by_id.items()])
+
+    # Bulk updates skip the flush hooks, so record the change for the caches
+    user_ids = {c.user.id for c in changes}
+    db.session.info.setdefault('touched_user_ids', set()).update(user_ids)
+    bump_data_version(db.session.connection(), user_ids)
+
+    lines = defaultdict(list)
+    for c in changes:
+        field = FIELDS[c.field]
+        delta = c.new - (c.old or 0)
+        lines[c.user].append(fmt(
+            "MODIFIED",
+            f"{c.user.username} {c.field}",
+            f"${delta:.2f}" if field.money else f"{delta:+g}",
+            f"{show(field, c.old)} → {show(field, c.new)}",
+            f"Bulk import by {admin.username}"
+        ))
+    return lines
+
+
+def export_rows():
+    for user in load_users():
+        yield {'username': user.username, **{column: _value(user, field) for column, field in FIELDS.items()}}
+
+
+def export(fmt_name):
+    rows = list(export_rows())
+    if fmt_name == 'json':
+        return json.dumps(rows, indent=2)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
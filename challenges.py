@@ -0,0 +1,176 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete
+from models import db, User, Challenge, ChallengeProgress
+from ledger import adjust_points
+from config import *
+
+# Savings and credit challenges. Progress is kept current by the
+# CHALLENGE_TRIGGERS in models.py as transactions are written, so nothing here
+# scans history. Run `python challenges.py` nightly to settle challenges whose
+# window has ended.
+
+Metric = namedtuple('Metric', 'label money')
+
+METRICS = {
+    'save': Metric('Save money', True),
+    'pay_credit': Metric('Pay off credit', True),
+    'no_credit_draws': Metric('No credit draws', False),
+}
+
+
+class ChallengeError(Exception):
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def parse(form, children):
+    # Creator form to (column values, child ids), collecting every problem
+    errors = []
+    values = {
+        'title': (form.get('title') or '').strip(),
+        'description': (form.get('description') or '').strip() or None,
+        'metric': form.get('metric'),
+    }
+    if not values['title']:
+        errors.append('Title is required')
+    if values['metric'] not in METRICS:
+        errors.append('Choose what the challenge measures')
+
+    for field, label, kind, minimum in (
+        ('goal', 'Goal', float, 0),
+        ('reward_points', 'Reward points', int, 0),
+        ('days', 'Duration', int, 1),
+    ):
+        try:
+            values[field] = kind(form.get(field) or (0 if field == 'goal' else ''))
+        except ValueError:
+            errors.append(f'{label} must be a {"whole " if kind is int else ""}number')
+            continue
+        if values[field] < minimum:
+            errors.append(f'{label} must be at least {minimum}')
+    if values.get('days', 0) > CHALLENGE_MAX_DAYS:
+        errors.append(f'Duration is limited to {CHALLENGE_MAX_DAYS} days')
+    if values['metric'] in METRICS and METRICS[values['metric']].money and not values.get('goal'):
+        errors.append('Goal must be more than $0')
+
+    target = form.get('user_id') or 'all'
+    ids = {child.id for child in children}
+    user_ids = sorted(ids) if target == 'all' else [int(target)] if target.isdigit() and int(target) in ids else []
+    if not user_ids:
+        errors.append('Choose a child, or all children')
+    if errors:
+        raise ChallengeError(errors)
+    return values, user_ids
+
+
+def create(values, user_ids, creator):
+    # Progress starts at zero from now: only transactions written after this
+    # count, so nothing has to be replayed
+    values = dict(values)
+    # Whole seconds, like the CURRENT_TIMESTAMP transactions are stamped with
+    starts_at = datetime.utcnow().replace(microsecond=0)
+    ends_at = starts_at + timedelta(days=values.pop('days'))
+    challenge_id = db.session.execute(insert(Challenge).values(
+        **values, starts_at=starts_at, ends_at=ends_at, created_by=creator.id
+    )).inserted_primary_key[0]
+    db.session.execute(insert(ChallengeProgress), [
+        {'challenge_id': challenge_id, 'user_id': user_id, 'progress': 0.0} for user_id in user_ids
+    ])
+    db.session.commit()
+    return challenge_id
+
+
+def remove(challenge_id):
+    # Points already paid stay paid (and in the points ledger)
+    db.session.execute(delete(ChallengeProgress).where(ChallengeProgress.challenge_id == challenge_id))
+    result = db.session.execute(delete(Challenge).where(Challenge.id == challenge_id))
+    db.session.commit()
+    return result.rowcount
+
+
+def progress_rows(user_id=None, now=None):
+    # Current and recently finished challenges with each child's progress,
+    # in one query
+    now = now or datetime.utcnow()
+    stmt = (
+        select(
+            Challenge.id, Challenge.title, Challenge.description, Challenge.metric, Challenge.goal,
+            Challenge.reward_points, Challenge.starts_at, Challenge.ends_at,
+            ChallengeProgress.user_id, User.username, ChallengeProgress.progress,
+            ChallengeProgress.completed_at, ChallengeProgress.closed_at,
+        )
+        .join(ChallengeProgress, ChallengeProgress.challenge_id == Challenge.id)
+        .join(User, User.id == ChallengeProgress.user_id)
+        .where(Challenge.ends_at > now - timedelta(days=CHALLENGE_HISTORY_DAYS))
+        .order_by(Challenge.ends_at, Challenge.id, User.username)
+    )
+    if user_id is not None:
+        stmt = stmt.where(ChallengeProgress.user_id == user_id)
+    return db.session.execute(stmt).all()
+
+
+def status(row, now=None):
+    now = now or datetime.utcnow()
+    if row.completed_at:
+        return 'completed'
+    if row.metric == 'no_credit_draws' and row.progress > 0:
+        return 'missed'
+    if row.ends_at > now:
+        return 'active'
+    # Ended; a clean "no credit draws" is paid by the nightly settle
+    return 'settling' if row.metric == 'no_credit_draws' and not row.closed_at else 'missed'
+
+
+def percent(row, now=None):
+    # How far along the bar is: share of the goal, or for "no credit draws"
+    # share of the window survived so far
+    now = now or datetime.utcnow()
+    if row.completed_at:
+        return 100
+    if row.metric == 'no_credit_draws':
+        if row.progress > 0:
+            return 0
+        elapsed = (min(now, row.ends_at) - row.starts_at) / (row.ends_at - row.starts_at)
+        return round(100 * elapsed)
+    return max(0, min(100, round(100 * row.progress / row.goal))) if row.goal else 0
+
+
+def grouped(rows):
+    # {challenge: [progress rows]} in row order, for the page
+    challenges = {}
+    for row in rows:
+        challenges.setdefault(row.id, []).append(row)
+    return list(challenges.values())
+
+
+def settle(now=None):
+    # Nightly: close every challenge whose window has ended. "No credit draws"
+    # pays out here, if the child never drew on credit during the window.
+    now = now or datetime.utcnow()
+    rows = db.session.execute(
+        select(ChallengeProgress, Challenge)
+        .join(Challenge, Challenge.id == ChallengeProgress.challenge_id)
+        .where(ChallengeProgress.closed_at.is_(None), Challenge.ends_at <= now)
+    ).all()
+
+    awarded = []
+    for progress, challenge in rows:
+        if challenge.metric == 'no_credit_draws' and progress.completed_at is None and progress.progress == 0:
+            user = db.session.get(User, progress.user_id)
+            adjust_points(user, challenge.reward_points, 'challenge', note=challenge.title)
+            progress.completed_at = now
+            awarded.append((user.username, challenge.title, challenge.reward_points))
+        progress.closed_at = now
+    db.session.commit()
+    return len(rows), awarded
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        closed, awarded = settle()
+        for username, title, points in awarded:
+            print(f"  {username}: {title} (+{points} points)")
+        print(f"{datetime.now():%Y-%m-%d}: closed {closed} challenge entr{'y' if closed == 1 else 'ies'}, {len(awarded)} awarded.")
@@ -6,11 +6,37 @@ CREDIT_HISTORY_FILE = os.path.join(BASE_DIR, "log/credit_history.json")
 INTEREST_LOG_FILE = os.path.join(BASE_DIR, "log/interest_history.log")
 AVATAR_FOLDER = os.path.join(BASE_DIR, 'static', 'avatar')
 BG_FOLDER = os.path.join(BASE_DIR, 'static', 'bg')
+AI_LOG_FILE = os.path.join(BASE_DIR, "log/ai_history.log")
+
+# ================= IMAGES =================
+# Widths of the variants written for each upload (avatars are square crops)
+IMAGE_VARIANTS = {'avatar': (64, 256), 'bg': (1920,)}
+IMAGE_WEBP_QUALITY = 80
+IMAGE_JPEG_QUALITY = 82
+IMAGE_MAX_PIXELS = 40_000_000
+
+# ================= STATIC ASSETS =================
+# `python assets.py` copies these (globs under static/) to static/dist under
+# content-hashed names, with .gz/.br copies of the text files
+ASSET_DIST_FOLDER = os.path.join(BASE_DIR, 'static', 'dist')
+ASSET_MANIFEST = os.path.join(ASSET_DIST_FOLDER, 'manifest.json')
+ASSET_SOURCES = ['css/*.css', 'js/*.js', 'index.jpg', 'interest_graph.png', 'favicon.ico', 'avatar/default.*', 'bg/default.*']
+ASSET_COMPRESS_EXTENSIONS = {'css', 'js', 'svg', 'ico', 'json', 'txt'}
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
 
 # ================= SECURITY =================
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'gif'}
 MIN_PASS_LENGTH = 8
 
+# 2FA provisioning QR codes: issuer shown in authenticator apps, rendered
+# SVGs kept per worker, and browser cache lifetime for a versioned QR URL
+TOTP_ISSUER = "My Home Bank"
+TOTP_QR_CACHE_SIZE = 256
+TOTP_QR_MAX_AGE = 60 * 60
+
+# Rate-limit counters shared by all workers (see ratelimit_storage.py)
+RATELIMIT_STORAGE_URI = "sqlite:////homebank-ratelimit.db"
+
 # ================= CREDIT SCORE =================
 MAX_SCORE = 850
 MIN_SCORE = 300
@@ -28,10 +54,132 @@ UTILIZATION_REWARD_EXPONENT = 8
 SAVINGS_REWARD_RATE = 1
 MAX_POINTS = 80
 
+# Largest cash amount a shop reward can pay out (rewards.parse_reward)
+REWARD_MAX_CASH_AMOUNT = 1000.0
+
 # ================= BILLING =================
 BILLING_CYCLE_DAYS = 30
 MIN_DAYS_OUTSTANDING_FOR_FULL_POINTS = 5
 
+# ================= LEDGER =================
+# Retries for a balance change that hits a busy database, with jittered
+# exponential backoff starting at LEDGER_RETRY_DELAY seconds.
+LEDGER_RETRIES = 5
+LEDGER_RETRY_DELAY = 0.05
+
+# Most legs accepted by one /transfer/batch request
+BATCH_TRANSFER_MAX_LEGS = 100
+
+# ================= IDEMPOTENCY =================
+# Stored results of keyed POSTs (transfers, credit, redemptions) are replayed
+# for this many seconds. A repeat that arrives while the first request is
+# still running waits up to IDEMPOTENCY_WAIT seconds for its result.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT = 10
+IDEMPOTENCY_SWEEP_CHANCE = 0.01
+
+# ================= CACHING =================
+# Seconds a logged-in user's row and accounts may be served from memory on
+# GET requests; 0 disables the cross-request cache.
+USER_CACHE_TTL = 0
+
+# Rendered dashboard fragments (account cards, credit alerts), one entry per
+# user and fragment. Point FRAGMENT_CACHE_DB at a file, e.g.
+# os.path.join(BASE_DIR, "log/fragment_cache.db"), to share them between workers.
+FRAGMENT_CACHE_SIZE = 2048
+FRAGMENT_CACHE_DB = None
+
+# ================= EXPORTS =================
+# Rows fetched per round trip and written per response chunk when streaming
+# transaction exports
+EXPORT_BATCH_SIZE = 1000
+
+# ================= ANALYTICS =================
+# Days of daily rollups the nightly compactor (rollups.py) recomputes from raw
+# transactions, and the widest range the analytics API answers in one call
+ROLLUP_REBUILD_DAYS = 7
+ANALYTICS_MAX_DAYS = 3 * 366
+
+# ================= SEARCH =================
+# Transaction search: results per page by default and at most, and how many
+# words of a query are used
+SEARCH_PAGE_SIZE = 25
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_MAX_TERMS = 8
+
+# ================= ADMIN =================
+# Users listed per page in the admin panel
+ADMIN_USERS_PER_PAGE = 20
+
+# ================= IMPORTS =================
+# Bulk history importer (importer.py): rows per executemany, rows per
+# committed transaction, and how many skipped rows it prints
+IMPORT_BATCH_SIZE = 5000
+IMPORT_TRANSACTION_ROWS = 100000
+IMPORT_MAX_ERRORS_SHOWN = 20
+
+# ================= CHALLENGES =================
+# Longest challenge a parent can set, and how long finished ones stay listed
+CHALLENGE_MAX_DAYS = 366
+CHALLENGE_HISTORY_DAYS = 14
+
+# ================= SCHEDULED TRANSFERS =================
+# Recurring transfers (scheduler.py): due rules read per query, consecutive
+# failures before a rule is paused, and rules listed per page
+SCHEDULE_BATCH_SIZE = 200
+SCHEDULE_MAX_FAILURES = 3
+SCHEDULES_PER_PAGE = 25
+
+# ================= NOTIFICATIONS =================
+# Payment-due alerts (notifications.py): days ahead of a due date to warn,
+# how often the dashboard polls for new ones, and how long read ones are kept
+NOTIFY_DAYS_AHEAD = 3
+NOTIFY_POLL_SECONDS = 60
+NOTIFY_KEEP_DAYS = 90
+
+# ================= BACKUPS =================
+# Online snapshots (backups.py): where they go, how often the scheduler takes
+# one, and what retention keeps (the newest few, plus one per day and per week)
+BACKUP_FOLDER = os.path.join(BASE_DIR, "backups")
+BACKUP_INTERVAL = 6 * 60 * 60
+BACKUP_KEEP_LAST = 4
+BACKUP_KEEP_DAYS = 7
+BACKUP_KEEP_WEEKS = 8
+# Pages copied per step and the pause between steps; writers only wait for a
+# single step. After BACKUP_MAX_RESTARTS restarts caused by concurrent writes
+# the rest is copied in one step.
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005
+BACKUP_MAX_RESTARTS = 5
+BACKUP_BUSY_TIMEOUT = 30
+
+# ================= AI ASSISTANT =================
+OLLAMA_CHAT_URL = "http://localhost:11434/api/chat"
+OLLAMA_MODEL = "llama3.2:latest"
+AI_CONNECT_TIMEOUT = 5
+AI_TIMEOUT = 120
+
+# Per worker process: generations running at once, callers allowed to wait
+# for one, and how long they wait before getting the busy reply.
+AI_MAX_INFLIGHT = 2
+AI_MAX_QUEUE = 8
+AI_QUEUE_TIMEOUT = 15
+AI_BUSY_MESSAGE = "I'm helping a lot of people right now, please try again in a moment."
+AI_UNAVAILABLE_MESSAGE = "AI assistant is currently unavailable."
+
+# Cached per-user prompt: how many recent transactions it shows and a hard
+# cap on its size (estimated at AI_CHARS_PER_TOKEN characters per token).
+AI_CONTEXT_CACHE_SIZE = 256
+AI_CONTEXT_RECENT_TX = 15
+AI_PROMPT_TOKEN_BUDGET = 3000
+AI_CHARS_PER_TOKEN = 4
+
+# Answer cache for repeated questions. Set AI_ANSWER_CACHE_DB to None to keep
+# it in memory only.
+AI_ANSWER_CACHE_SIZE = 2000
+AI_ANSWER_CACHE_TTL = 6 * 60 * 60
+AI_ANSWER_CACHE_DB = os.path.join(BASE_DIR, "log/ai_answer_cache.db")
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -0,0 +1,227 @@
+import io
+import csv
+import json
+from datetime import datetime, date, timedelta
+from xml.sax.saxutils import escape
+from sqlalchemy import select, union_all, or_
+from models import db, User, Account, Transaction
+from config import *
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ofx': ('application/x-ofx', 'ofx'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+CSV_COLUMNS = [
+    'id', 'timestamp', 'amount', 'description',
+    'from_account_id', 'from_account_type', 'from_user', 'from_balance_after',
+    'to_account_id', 'to_account_type', 'to_user', 'to_balance_after',
+]
+
+OFX_ACCOUNT_TYPES = {'spending': 'CHECKING', 'savings': 'SAVINGS', 'credit': 'CREDITLINE'}
+
+tx = Transaction.__table__
+accounts = Account.__table__
+users = User.__table__
+
+
+class ExportError(Exception):
+    pass
+
+
+def parse_filters(args):
+    # start / end are inclusive YYYY-MM-DD dates; account may repeat
+    try:
+        start = date.fromisoformat(args['start']) if args.get('start') else None
+        end = date.fromisoformat(args['end']) if args.get('end') else None
+        account_ids = [int(a) for a in args.getlist('account') if a]
+    except ValueError:
+        raise ExportError('Invalid date or account filter')
+    return start, end, account_ids
+
+
+def _date_filters(timestamp, start, end):
+    filters = []
+    if start:
+        filters.append(timestamp >= datetime.combine(start, datetime.min.time()))
+    if end:
+        filters.append(timestamp < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    return filters
+
+
+def transactions_query(user_id, start=None, end=None, account_ids=None):
+    # user_id None means every user (family-wide, parents only)
+    from_acc = accounts.alias('from_acc')
+    to_acc = accounts.alias('to_acc')
+    from_user = users.alias('from_user')
+    to_user = users.alias('to_user')
+
+    stmt = (
+        select(
+            tx.c.id, tx.c.timestamp, tx.c.amount, tx.c.description,
+            tx.c.from_account_id, from_acc.c.type.label('from_account_type'),
+            from_user.c.username.label('from_user'), tx.c.from_balance_after,
+            tx.c.to_account_id, to_acc.c.type.label('to_account_type'),
+            to_user.c.username.label('to_user'), tx.c.to_balance_after,
+        )
+        .select_from(
+            tx.outerjoin(from_acc, from_acc.c.id == tx.c.from_account_id)
+              .outerjoin(to_acc, to_acc.c.id == tx.c.to_account_id)
+              .outerjoin(from_user, from_user.c.id == tx.c.from_user_id)
+              .outerjoin(to_user, to_user.c.id == tx.c.to_user_id)
+        )
+        .where(*_date_filters(tx.c.timestamp, start, end))
+        # Primary-key order streams straight off the table without a sort
+        .order_by(tx.c.id)
+    )
+    if user_id is not None:
+        stmt = stmt.where(or_(tx.c.from_user_id == user_id, tx.c.to_user_id == user_id))
+    if account_ids:
+        stmt = stmt.where(or_(tx.c.from_account_id.in_(account_ids), tx.c.to_account_id.in_(account_ids)))
+    return stmt
+
+
+def entries_query(user_id, start=None, end=None, account_ids=None):
+    # One signed line per account a transaction touched, grouped by account,
+    # which is how statement formats (OFX) want it
+    debits = select(
+        tx.c.from_account_id.label('account_id'), (-tx.c.amount).label('amount'),
+        tx.c.id, tx.c.timestamp, tx.c.description, tx.c.from_balance_after.label('balance_after')
+    ).where(tx.c.from_account_id.is_not(None), *_date_filters(tx.c.timestamp, start, end))
+    credits = select(
+        tx.c.to_account_id.label('account_id'), tx.c.amount,
+        tx.c.id, tx.c.timestamp, tx.c.description, tx.c.to_balance_after.label('balance_after')
+    ).where(tx.c.to_account_id.is_not(None), *_date_filters(tx.c.timestamp, start, end))
+    entries = union_all(debits, credits).subquery()
+
+    stmt = (
+        select(entries, accounts.c.type.label('account_type'), users.c.username)
+        .join(accounts, accounts.c.id == entries.c.account_id)
+        .join(users, users.c.id == accounts.c.user_id)
+        .order_by(entries.c.account_id, entries.c.id)
+    )
+    if user_id is not None:
+        stmt = stmt.where(accounts.c.user_id == user_id)
+    if account_ids:
+        stmt = stmt.where(entries.c.account_id.in_(account_ids))
+    return stmt
+
+
+def stream_rows(stmt):
+    # Rows come off a streaming cursor EXPORT_BATCH_SIZE at a time, so memory
+    # stays flat however long the history is
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(stmt)
+        for row in result:
+            yield row
+
+
+def _cell(value):
+    # Keep spreadsheet apps from evaluating user-written descriptions
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def export_csv(rows):
+    # transactions_query() selects its columns in CSV_COLUMNS order, so rows
+    # are written as they come; only the free-text description is touched
+    description = CSV_COLUMNS.index('description')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    batch = []
+    for row in rows:
+        values = list(row)
+        values[description] = _cell(values[description])
+        batch.append(values)
+        if len(batch) == EXPORT_BATCH_SIZE:
+            writer.writerows(batch)
+            batch = []
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    writer.writerows(batch)
+    yield buffer.getvalue()
+
+
+def export_ndjson(rows):
+    chunk = []
+    for row in rows:
+        record = row._asdict()
+        record['timestamp'] = record['timestamp'].isoformat() if record['timestamp'] else None
+        chunk.append(json.dumps(record))
+        if len(chunk) == EXPORT_BATCH_SIZE:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+def _ofx_date(value):
+    return value.strftime('%Y%m%d%H%M%S') if value else ''
+
+
+def export_ofx(entries, start=None, end=None):
+    now = datetime.now()
+    dt_start = _ofx_date(datetime.combine(start, datetime.min.time())) if start else '19700101000000'
+    dt_end = _ofx_date(datetime.combine(end, datetime.max.time())) if end else _ofx_date(now)
+
+    def open_statement(row):
+        return (
+            f"<STMTTRNRS><TRNUID>{row.account_id}</TRNUID>"
+            "<STATUS><CODE>0</CODE><SEVERITY>INFO</SEVERITY></STATUS>"
+            "<STMTRS><CURDEF>USD</CURDEF>"
+            f"<BANKACCTFROM><BANKID>HOMEBANK</BANKID><ACCTID>{row.account_id}</ACCTID>"
+            f"<ACCTTYPE>{OFX_ACCOUNT_TYPES.get(row.account_type, 'CHECKING')}</ACCTTYPE></BANKACCTFROM>"
+            f"<BANKTRANLIST><DTSTART>{dt_start}</DTSTART><DTEND>{dt_end}</DTEND>\n"
+        )
+
+    def close_statement(balance, as_of):
+        return (
+            "</BANKTRANLIST>"
+            f"<LEDGERBAL><BALAMT>{balance or 0:.2f}</BALAMT><DTASOF>{_ofx_date(as_of or now)}</DTASOF></LEDGERBAL>"
+            "</STMTRS></STMTTRNRS>\n"
+        )
+
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+        '<?OFX OFXHEADER="200" VERSION="220" SECURITY="NONE" OLDFILEUID="NONE" NEWFILEUID="NONE"?>\n'
+        "<OFX><SIGNONMSGSRSV1><SONRS><STATUS><CODE>0</CODE><SEVERITY>INFO</SEVERITY></STATUS>"
+        f"<DTSERVER>{_ofx_date(now)}</DTSERVER><LANGUAGE>ENG</LANGUAGE></SONRS></SIGNONMSGSRSV1>"
+        "<BANKMSGSRSV1>\n"
+    )
+
+    chunk = []
+    account_id = balance = as_of = None
+    for row in entries:
+        if row.account_id != account_id:
+            if account_id is not None:
+                chunk.append(close_statement(balance, as_of))
+            chunk.append(open_statement(row))
+            account_id = row.account_id
+
+        chunk.append(
+            f"<STMTTRN><TRNTYPE>{'CREDIT' if row.amount >= 0 else 'DEBIT'}</TRNTYPE>"
+            f"<DTPOSTED>{_ofx_date(row.timestamp)}</DTPOSTED><TRNAMT>{row.amount:.2f}</TRNAMT>"
+            f"<FITID>{row.id}</FITID><NAME>{escape((row.description or 'Transaction')[:32])}</NAME>"
+            f"<MEMO>{escape(row.description or '')}</MEMO></STMTTRN>\n"
+        )
+        balance, as_of = row.balance_after, row.timestamp
+
+        if len(chunk) >= EXPORT_BATCH_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+
+    if account_id is not None:
+        chunk.append(close_statement(balance, as_of))
+    chunk.append("</BANKMSGSRSV1></OFX>\n")
+    yield ''.join(chunk)
+
+
+def stream_export(fmt, user_id, start=None, end=None, account_ids=None):
+    if fmt == 'ofx':
+        return export_ofx(stream_rows(entries_query(user_id, start, end, account_ids)), start, end)
+    rows = stream_rows(transactions_query(user_id, start, end, account_ids))
+    return export_csv(rows) if fmt == 'csv' else export_ndjson(rows)
@@ -0,0 +1,100 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from config import *
+
+
+class FragmentCache:
+    # Rendered HTML fragments, one entry per (fragment, user), stamped with the
+    # user's data version (see models.UserDataVersion) plus anything else the
+    # fragment depends on. A stamp mismatch is a miss, and the next put
+    # replaces the stale entry, so nothing has to be invalidated explicitly.
+    # Entries live in an in-process LRU; when db_path is set they are also
+    # kept in a small SQLite file shared by every worker.
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE, db_path=FRAGMENT_CACHE_DB):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.db_path:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS fragment_cache ("
+                    "name TEXT NOT NULL, user_id INTEGER NOT NULL, stamp TEXT NOT NULL, "
+                    "html TEXT NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (name, user_id))"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_fragment_cache_last_used ON fragment_cache (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, name, user_id, stamp):
+        key = (name, user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        html = self._load(name, user_id, stamp) if self.db_path else None
+        if html is not None:
+            with self._lock:
+                self._remember(key, stamp, html)
+        return html
+
+    def put(self, name, user_id, stamp, html):
+        with self._lock:
+            self._remember((name, user_id), stamp, html)
+        if self.db_path:
+            self._store(name, user_id, stamp, html)
+
+    def _remember(self, key, stamp, html):
+        self._entries[key] = (stamp, html)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, name, user_id, stamp):
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT html FROM fragment_cache WHERE name = ? AND user_id = ? AND stamp = ?",
+                    (name, user_id, stamp)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE fragment_cache SET last_used = ? WHERE name = ? AND user_id = ?",
+                    (time.time(), name, user_id)
+                )
+                return row[0]
+        except sqlite3.Error:
+            return None
+
+    def _store(self, name, user_id, stamp, html):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO fragment_cache (name, user_id, stamp, html, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (name, user_id, stamp, html, time.time())
+                )
+                conn.execute(
+                    "DELETE FROM fragment_cache WHERE rowid IN ("
+                    "SELECT rowid FROM fragment_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,138 @@
+import json
+import time
+import random
+import secrets
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, session, flash, make_response, Response
+from flask_login import current_user
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.sqlite import insert
+from models import db, IdempotencyKey
+from config import *
+
+keys = IdempotencyKey.__table__
+
+
+def new_idempotency_key():
+    return secrets.token_hex(16)
+
+
+def request_key():
+    # Sent as an Idempotency-Key header by API clients, or as a hidden
+    # idempotency_key field by the HTML forms
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    return (key or '').strip() or None
+
+
+def _row(conn, key):
+    return conn.execute(
+        select(keys.c.path, keys.c.status, keys.c.response)
+        .where(keys.c.user_id == current_user.id, keys.c.key == key)
+    ).one_or_none()
+
+
+def _claim(key):
+    # Inserts the in-flight marker. Returns None when this request owns the
+    # key, otherwise the row left by the request that got there first.
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+
+    with db.engine.begin() as conn:
+        if random.random() < IDEMPOTENCY_SWEEP_CHANCE:
+            conn.execute(delete(keys).where(keys.c.created_at < cutoff))
+        else:
+            conn.execute(delete(keys).where(
+                keys.c.user_id == current_user.id, keys.c.key == key, keys.c.created_at < cutoff
+            ))
+
+        claimed = conn.execute(
+            insert(keys)
+            .values(user_id=current_user.id, key=key, path=request.path, created_at=now)
+            .on_conflict_do_nothing()
+        ).rowcount
+        return None if claimed else _row(conn, key)
+
+
+def _wait(key, row):
+    # A double submit usually lands while the first request is still running;
+    # wait briefly for its result rather than failing straight away.
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+    while row is not None and row.status is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+        with db.engine.connect() as conn:
+            row = _row(conn, key)
+    return row
+
+
+def _store(key, response, flashes):
+    data = {
+        "body": response.get_data(as_text=True),
+        "mimetype": response.mimetype,
+        "location": response.headers.get('Location'),
+        "flashes": flashes,
+    }
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(keys)
+            .where(keys.c.user_id == current_user.id, keys.c.key == key)
+            .values(status=response.status_code, response=json.dumps(data))
+        )
+
+
+def _release(key):
+    with db.engine.begin() as conn:
+        conn.execute(delete(keys).where(
+            keys.c.user_id == current_user.id, keys.c.key == key, keys.c.status.is_(None)
+        ))
+
+
+def _replay(row):
+    if row.path != request.path:
+        return {"error": "Idempotency key was already used for a different request"}, 422
+    if row.status is None:
+        return {"error": "A request with this idempotency key is still being processed"}, 409
+
+    data = json.loads(row.response)
+    for category, message in data["flashes"]:
+        flash(message, category)
+
+    response = Response(data["body"], status=row.status, mimetype=data["mimetype"])
+    if data["location"]:
+        response.headers['Location'] = data["location"]
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    # For POST views that move money. The first request with a given key runs
+    # and its response (status, body, redirect target and flashed messages) is
+    # stored; repeats with the same key get that response back without the
+    # view running again. Requests without a key behave as before.
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        key = request_key() if request.method == 'POST' else None
+        if key is None:
+            return view(*args, **kwargs)
+        if len(key) > 64:
+            return {"error": "Idempotency key must be at most 64 characters"}, 400
+
+        row = _claim(key)
+        while row is not None:
+            row = _wait(key, row)
+            if row is not None:
+                return _replay(row)
+            # The earlier request failed and gave the key up; try it ourselves
+            row = _claim(key)
+
+        flashed = len(session.get('_flashes', []))
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            # Nothing was recorded, so a retry is free to run the view again
+            _release(key)
+            raise
+
+        _store(key, response, [list(f) for f in session.get('_flashes', [])[flashed:]])
+        return response
+    return wrapped
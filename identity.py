@@ -0,0 +1,95 @@
+import time
+import threading
+from flask import g, request
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from models import db, User, Account
+from config import *
+
+
+def snapshot(obj):
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(type(obj)).column_attrs}
+
+
+def restore(model, values):
+    obj = model(**values)
+    make_transient_to_detached(obj)
+    return obj
+
+
+class UserCache:
+    # Optional cross-request cache of a user row plus their account rows, held
+    # as plain column values. Entries expire after `ttl` seconds and are dropped
+    # as soon as this process commits a change touching that user; the TTL
+    # bounds staleness from writes made by other workers.
+    def __init__(self, ttl=USER_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            self._entries.pop(user_id, None)
+        return None
+
+    def put(self, user):
+        data = (snapshot(user), [snapshot(acc) for acc in user.accounts])
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, data)
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_touched_users(session):
+    user_cache.invalidate(session.info.pop('touched_user_ids', ()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_touched_users(session):
+    session.info.pop('touched_user_ids', None)
+
+
+def load_user_with_accounts(user_id):
+    # Writes always start from fresh rows; only safe requests use the cache
+    use_cache = user_cache.ttl > 0 and request.method in ('GET', 'HEAD')
+
+    if use_cache:
+        cached = user_cache.get(user_id)
+        if cached:
+            user_values, account_values = cached
+            user = restore(User, user_values)
+            accounts = [restore(Account, values) for values in account_values]
+            set_committed_value(user, 'accounts', accounts)
+            for acc in accounts:
+                set_committed_value(acc, 'user', user)
+            db.session.add(user)
+            return user
+
+    user = db.session.execute(
+        db.select(User)
+        .options(joinedload(User.accounts))
+        .where(User.id == user_id)
+    ).unique().scalar_one_or_none()
+
+    if user and use_cache:
+        user_cache.put(user)
+    return user
+
+
+def current_accounts():
+    # The current user's accounts keyed by type, built once per request
+    if 'accounts_by_type' not in g:
+        g.accounts_by_type = {acc.type: acc for acc in current_user.accounts}
+    return g.accounts_by_type
@@ -0,0 +1,138 @@
+import io
+import os
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from flask import url_for
+from markupsafe import Markup
+from PIL import Image, ImageOps
+from models import db, User
+from assets import asset_url
+from config import *
+
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+# Processed uploads are stored as the first 16 hex digits of the SHA-256 of
+# the original file; anything else (default.gif, user_3.png) is a file that
+# was saved as-is and is served unchanged.
+DIGEST_RE = re.compile(r'[0-9a-f]{16}')
+
+FOLDERS = {'avatar': AVATAR_FOLDER, 'bg': BG_FOLDER}
+
+# One worker: uploads are processed in the order they arrived
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='images')
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def is_processed(name):
+    return bool(name) and DIGEST_RE.fullmatch(name) is not None
+
+
+def variant_name(digest, width, fmt):
+    return f"{digest}-{width}.{'jpg' if fmt == 'JPEG' else 'webp'}"
+
+
+def read_upload(file):
+    # Cheap checks done inside the request: the bytes must parse as an image
+    # and stay under the pixel limit. Decoding and resizing happen later.
+    data = file.read()
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # MAX_IMAGE_PIXELS only raises at twice the limit (below that
+            # Pillow just warns), so the limit itself is checked here
+            if img.width * img.height > IMAGE_MAX_PIXELS:
+                raise InvalidImage(f"Image is {img.width}x{img.height}; the limit is {IMAGE_MAX_PIXELS:,} pixels")
+            img.verify()
+    except (Image.DecompressionBombError, OSError, SyntaxError, ValueError) as e:
+        raise InvalidImage(str(e))
+    return data, hashlib.sha256(data).hexdigest()[:16]
+
+
+def _decode(data):
+    with Image.open(io.BytesIO(data)) as img:
+        img.seek(0)
+        img = ImageOps.exif_transpose(img)
+        # Copying into a fresh RGB image leaves EXIF, ICC, XMP and GPS behind
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            flat = Image.new('RGB', img.size, (255, 255, 255))
+            flat.paste(img.convert('RGBA'), mask=img.convert('RGBA').getchannel('A'))
+            return flat
+        return img.convert('RGB')
+
+
+def _resize(img, kind, width):
+    if kind == 'avatar':
+        return ImageOps.fit(img, (width, width), Image.LANCZOS)
+    if img.width <= width:
+        return img
+    return img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+
+
+def write_variants(data, digest, kind):
+    folder = FOLDERS[kind]
+    os.makedirs(folder, exist_ok=True)
+    img = _decode(data)
+
+    for width in IMAGE_VARIANTS[kind]:
+        resized = _resize(img, kind, width)
+        for fmt, options in (('WEBP', {'quality': IMAGE_WEBP_QUALITY, 'method': 6}),
+                             ('JPEG', {'quality': IMAGE_JPEG_QUALITY, 'optimize': True, 'progressive': True})):
+            path = os.path.join(folder, variant_name(digest, width, fmt))
+            if os.path.exists(path):
+                continue
+            # Write then rename so a half-written file is never served
+            tmp = f"{path}.tmp"
+            resized.save(tmp, fmt, **options)
+            os.replace(tmp, path)
+
+
+def _process(app, user_id, kind, data, digest):
+    with app.app_context():
+        try:
+            write_variants(data, digest, kind)
+        except Exception:
+            app.logger.exception("Image processing failed for user %s (%s)", user_id, kind)
+            return
+
+        user = db.session.get(User, user_id)
+        if user is not None:
+            setattr(user, 'avatar' if kind == 'avatar' else 'background', digest)
+            db.session.commit()
+
+
+def queue_upload(app, user_id, kind, data, digest):
+    # The user keeps their current image until the variants are on disk
+    return _executor.submit(_process, app, user_id, kind, data, digest)
+
+
+# ---- Template helpers ----
+def image_url(kind, name, width=None):
+    if not is_processed(name):
+        return asset_url(f"{kind}/{name}")
+    widths = IMAGE_VARIANTS[kind]
+    width = width if width in widths else widths[-1]
+    return url_for('static', filename=f"{kind}/{variant_name(name, width, 'JPEG')}")
+
+
+def image_srcset(kind, name):
+    if not is_processed(name):
+        return ''
+    entries = []
+    for width in IMAGE_VARIANTS[kind]:
+        url = url_for('static', filename=f"{kind}/{variant_name(name, width, 'WEBP')}")
+        entries.append(f"{url} {width}w")
+    return ', '.join(entries)
+
+
+def background_image(name):
+    # Value for the --bg-image custom property: WebP where the browser takes
+    # it, JPEG otherwise, for the full-width variant
+    if not is_processed(name):
+        return Markup(f"url('{asset_url(f'bg/{name}')}')")
+    width = IMAGE_VARIANTS['bg'][-1]
+    webp = url_for('static', filename=f"bg/{variant_name(name, width, 'WEBP')}")
+    jpeg = url_for('static', filename=f"bg/{variant_name(name, width, 'JPEG')}")
+    return Markup(f"image-set(url('{webp}') type('image/webp'), url('{jpeg}') type('image/jpeg'))")
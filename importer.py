@@ -0,0 +1,369 @@
+import os
+import csv
+import json
+import time
+import heapq
+import argparse
+from itertools import groupby
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select, update, text, func, bindparam
+from models import db, User, Account, Transaction, bump_data_version, rebuild_rollups, rebuild_search
+from notifications import refresh as refresh_notifications
+from config import *
+
+# Loads transaction history in bulk: CSV or NDJSON in the format the
+# exporter writes, or the per-user text logs in log/transactions/. Input is
+# streamed in IMPORT_BATCH_SIZE chunks, running balances are worked out per
+# account in the same pass, and rows go in with executemany inside
+# transactions of IMPORT_TRANSACTION_ROWS. The transaction table's indexes
+# and triggers (rollups, search) are dropped for the duration and rebuilt
+# in one set-based pass at the end. Usage:
+#   python importer.py history.csv
+#   python importer.py export.ndjson --opening current --keep-balances
+#   python importer.py log/transactions/*
+
+tx = Transaction.__table__
+
+# Plain tuples through the driver's executemany: at these volumes the
+# per-row parameter processing of an ORM or Core insert is the bottleneck
+INSERT_SQL = (
+    'INSERT INTO "transaction" (timestamp, amount, description, from_account_id, to_account_id, '
+    'from_user_id, to_user_id, from_balance_after, to_balance_after) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+
+
+class ImportRowError(Exception):
+    pass
+
+
+class Accounts:
+    # Every account keyed by id and by (username, type), loaded once
+    def __init__(self, connection):
+        rows = connection.execute(
+            select(Account.id, Account.type, Account.balance, Account.user_id, User.username)
+            .join(User, User.id == Account.user_id)
+        ).all()
+        self.by_id = {row.id: row for row in rows}
+        self.by_name = {(row.username, row.type): row for row in rows}
+
+    def named(self, username, acc_type):
+        row = self.by_name.get((username, acc_type))
+        if row is None:
+            raise ImportRowError(f"no {acc_type} account for user {username!r}")
+        return row
+
+    def numbered(self, acc_id):
+        row = self.by_id.get(acc_id)
+        if row is None:
+            raise ImportRowError(f"no account with id {acc_id}")
+        return row
+
+
+def balance_delta(acc_type, incoming, amount, description):
+    # Same rules the dashboard uses to sign amounts: credit balances are
+    # debt, so interest and fees raise them and only payments bring them down
+    if acc_type == 'credit':
+        desc = (description or '').lower()
+        if incoming and not any(word in desc for word in ('interest', 'fee', 'penalty')):
+            return -amount
+        return amount
+    return amount if incoming else -amount
+
+
+# ---- Readers: each yields (timestamp, amount, description, from, to) with
+# from/to an Accounts row or None for the Bank, or ('set', account, balance)
+# for an admin balance edit found in a text log ----
+
+def _record_side(accounts, record, side):
+    username = record.get(f'{side}_user')
+    acc_type = record.get(f'{side}_account_type')
+    acc_id = record.get(f'{side}_account_id')
+    # Names survive a move between installs; ids are the fallback
+    if username and acc_type:
+        return accounts.named(username, acc_type)
+    if acc_id not in (None, ''):
+        return accounts.numbered(int(acc_id))
+    return None
+
+
+def _records(accounts, records):
+    for line, record in records:
+        try:
+            timestamp = datetime.fromisoformat(str(record['timestamp']).replace('Z', ''))
+            amount = float(record['amount'])
+            from_acc = _record_side(accounts, record, 'from')
+            to_acc = _record_side(accounts, record, 'to')
+        except (KeyError, ValueError, TypeError, ImportRowError) as e:
+            yield ImportRowError(f"line {line}: {e}")
+            continue
+        if from_acc is None and to_acc is None:
+            yield ImportRowError(f"line {line}: both sides are the Bank")
+            continue
+        yield timestamp, amount, record.get('description') or '', from_acc, to_acc
+
+
+def read_csv(accounts, path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from _records(accounts, enumerate(csv.DictReader(f), start=2))
+
+
+def read_ndjson(accounts, path):
+    def records(f):
+        for line, raw in enumerate(f, start=1):
+            if raw.strip():
+                yield line, json.loads(raw)
+    with open(path, encoding='utf-8') as f:
+        yield from _records(accounts, records(f))
+
+
+def _log_lines(path):
+    # TIMESTAMP | ACTION | ROUTE | AMOUNT | CHANGE [| REASON], local time
+    owner = os.path.basename(path)
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            parts = [p.strip() for p in line.rstrip('\n').split(' | ')]
+            if len(parts) < 5:
+                continue
+            try:
+                local = datetime.strptime(parts[0], '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                continue  # header and separator rows
+            timestamp = local.astimezone(timezone.utc).replace(tzinfo=None)
+            yield timestamp, owner, line_no, parts[1], parts[2], parts[3], parts[4], ' | '.join(parts[5:])
+
+
+def _money(value):
+    return float(value.replace('$', '').replace(',', ''))
+
+
+def _route(route):
+    left, _, right = route.partition('→')
+    return left.strip(), right.strip()
+
+
+def read_logs(accounts, paths):
+    # Files are merged by timestamp. A transfer to another user is logged
+    # twice, as the sender's TRANSFER "<type|Bank> → <user>" and the
+    # recipient's RECEIVED "<sender|Bank> → <type>"; the two are paired within
+    # the same second so the row lands at the sender's position with both
+    # account types known, and the RECEIVED line is skipped.
+    account_types = {'spending', 'savings', 'credit'}
+    merged = heapq.merge(*(_log_lines(p) for p in paths), key=lambda entry: entry[0])
+
+    for timestamp, group in groupby(merged, key=lambda entry: entry[0]):
+        group = list(group)
+        received = {}
+        for i, (_, owner, _, action, route, amount, _, reason) in enumerate(group):
+            if action == 'RECEIVED':
+                sender, _ = _route(route)
+                received.setdefault((sender, owner, amount, reason), []).append(i)
+        pairs = {}
+        for i, (_, owner, _, action, route, amount, _, reason) in enumerate(group):
+            left, right = _route(route)
+            if action == 'TRANSFER' and right not in account_types and right != 'Bank':
+                match = received.get(('Bank' if left == 'Bank' else owner, right, amount, reason))
+                if match:
+                    pairs[i] = match.pop(0)
+        paired = set(pairs.values())
+
+        for i, (_, owner, line_no, action, route, amount, change, reason) in enumerate(group):
+            if i in paired:
+                continue
+            try:
+                if action == 'MODIFIED':
+                    # "<user> <type>" or "<user> <type>_balance": an admin edit,
+                    # which moves the running balance without a transaction
+                    username, _, field = route.rpartition(' ')
+                    acc_type = field[:-len('_balance')] if field.endswith('_balance') else field
+                    if acc_type in account_types:
+                        yield ('set', accounts.named(username, acc_type), _money(change.split('→')[-1]))
+                    continue
+
+                left, right = _route(route)
+                value = _money(amount)
+
+                if action == 'RECEIVED':
+                    # Unpaired: the sender's file is missing. Only a spending
+                    # account can pay another user.
+                    from_acc = None if left == 'Bank' else accounts.named(left, 'spending')
+                    yield timestamp, value, reason, from_acc, accounts.named(owner, right)
+
+                elif action in ('TRANSFER', 'PAYMENT', 'PENALTY', 'INTEREST', 'REWARD'):
+                    if right in account_types or right == 'Bank':
+                        from_acc = accounts.named(owner, left) if left != 'Bank' else None
+                        to_acc = accounts.named(owner, right) if right != 'Bank' else None
+                        if from_acc is not None or to_acc is not None:
+                            yield timestamp, value, reason, from_acc, to_acc
+                        continue
+
+                    # To another user; "Admin → kid" (allowance) pays from the
+                    # owner's spending account
+                    to_type = _route(group[pairs[i]][4])[1] if i in pairs else 'spending'
+                    if left == 'Bank':
+                        from_acc = None
+                    else:
+                        from_acc = accounts.named(owner, left if left in account_types else 'spending')
+                    yield timestamp, value, reason, from_acc, accounts.named(right, to_type)
+            except (ValueError, ImportRowError) as e:
+                yield ImportRowError(f"{owner}:{line_no}: {e}")
+
+
+# ---- Deferred indexes and triggers ----
+
+def suspend_indexes(connection):
+    # Drops the transaction table's secondary indexes, and the rollup and
+    # search triggers import_rows rebuilds after, and returns the SQL to put
+    # them back. The other triggers (challenges, notifications) stay, so app
+    # writes made while a long import runs still update them.
+    objects = connection.execute(text(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE tbl_name = 'transaction' AND sql IS NOT NULL AND (type = 'index' OR (type = 'trigger' "
+        "AND (name GLOB 'daily_rollup_*' OR name GLOB 'transaction_search_*')))"
+    )).all()
+    for obj in objects:
+        connection.exec_driver_sql(f'DROP {obj.type.upper()} IF EXISTS "{obj.name}"')
+    return [obj.sql for obj in objects]
+
+
+def restore_indexes(connection, ddl):
+    for sql in ddl:
+        connection.exec_driver_sql(sql)
+
+
+# ---- Import ----
+
+def import_rows(rows, opening='zero', keep_balances=False, report=print):
+    # rows: output of one of the readers above, in chronological order
+    started = time.perf_counter()
+    imported = skipped = 0
+    errors = []
+    running = {}
+    touched_users = set()
+    touched_credit = set()
+    first_day = None
+
+    with db.engine.connect() as connection:
+        with connection.begin():
+            current = dict(connection.execute(select(Account.id, Account.balance)).all())
+            first_id = connection.execute(select(func.max(tx.c.id))).scalar() or 0
+            ddl = suspend_indexes(connection)
+
+        def balance(acc):
+            if acc.id not in running:
+                running[acc.id] = (current.get(acc.id) or 0.0) if opening == 'current' else 0.0
+            return running[acc.id]
+
+        try:
+            batch = []
+            in_transaction = 0
+            transaction = connection.begin()
+            for row in rows:
+                if isinstance(row, ImportRowError):
+                    skipped += 1
+                    if len(errors) < IMPORT_MAX_ERRORS_SHOWN:
+                        errors.append(str(row))
+                    continue
+                if row[0] == 'set':
+                    _, acc, value = row
+                    running[acc.id] = round(value, 2)
+                    touched_users.add(acc.user_id)
+                    if acc.type == 'credit':
+                        touched_credit.add(acc.id)
+                    continue
+
+                timestamp, amount, description, from_acc, to_acc = row
+                sides = []
+                for acc, incoming in ((from_acc, False), (to_acc, True)):
+                    if acc is None:
+                        sides.append((None, None, None))
+                        continue
+                    running[acc.id] = round(balance(acc) + balance_delta(acc.type, incoming, amount, description), 2)
+                    sides.append((acc.id, acc.user_id, running[acc.id]))
+                    touched_users.add(acc.user_id)
+                    if acc.type == 'credit':
+                        touched_credit.add(acc.id)
+                (from_id, from_user, from_after), (to_id, to_user, to_after) = sides
+                record = (timestamp.isoformat(' '), amount, description,
+                          from_id, to_id, from_user, to_user, from_after, to_after)
+                batch.append(record)
+                if first_day is None or timestamp.date() < first_day:
+                    first_day = timestamp.date()
+
+                if len(batch) == IMPORT_BATCH_SIZE:
+                    connection.exec_driver_sql(INSERT_SQL, batch)
+                    imported += len(batch)
+                    in_transaction += len(batch)
+                    batch = []
+                    if in_transaction >= IMPORT_TRANSACTION_ROWS:
+                        transaction.commit()
+                        transaction = connection.begin()
+                        in_transaction = 0
+                        report(f"  {imported:,} rows, {imported / (time.perf_counter() - started):,.0f} rows/s")
+
+            if batch:
+                connection.exec_driver_sql(INSERT_SQL, batch)
+                imported += len(batch)
+
+            if not keep_balances and running:
+                connection.execute(
+                    update(Account).where(Account.id == bindparam('acc_id')).values(balance=bindparam('closing')),
+                    [{'acc_id': acc_id, 'closing': value} for acc_id, value in running.items()]
+                )
+            # Core writes skip the flush hooks, so bump the caches' versions here
+            bump_data_version(connection, touched_users)
+            transaction.commit()
+        except BaseException:
+            transaction.rollback()
+            raise
+        finally:
+            # Whatever made it in gets indexed, even if the import stopped early
+            with connection.begin():
+                restore_indexes(connection, ddl)
+                if (connection.execute(select(func.max(tx.c.id))).scalar() or 0) > first_id:
+                    # A day of slack covers the shift between UTC timestamps and
+                    # the local days rollups are kept in
+                    rebuild_rollups(connection, first_day - timedelta(days=1))
+                    rebuild_search(connection, after_id=first_id)
+                    # Imported payments and balances count towards this cycle's alerts
+                    refresh_notifications(connection, touched_credit)
+
+    return imported, skipped, errors, time.perf_counter() - started
+
+
+def open_input(accounts, paths, fmt):
+    if fmt == 'log':
+        return read_logs(accounts, paths)
+    reader = read_csv if fmt == 'csv' else read_ndjson
+
+    def chained():
+        for path in paths:
+            yield from reader(accounts, path)
+    return chained()
+
+
+def guess_format(paths):
+    ext = os.path.splitext(paths[0])[1].lower()
+    return {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}.get(ext, 'log')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk-load transaction history.")
+    parser.add_argument('paths', nargs='+', help="CSV/NDJSON export files, or log/transactions/<user> files")
+    parser.add_argument('--format', choices=('csv', 'ndjson', 'log'), help="default: from the file extension")
+    parser.add_argument('--opening', choices=('zero', 'current'), default='zero',
+                        help="running balances start from zero (default) or from each account's current balance")
+    parser.add_argument('--keep-balances', action='store_true',
+                        help="leave account balances alone instead of setting them to the imported closing balance")
+    args = parser.parse_args()
+
+    from app import app
+    with app.app_context():
+        with db.engine.connect() as connection:
+            accounts = Accounts(connection)
+        rows = open_input(accounts, args.paths, args.format or guess_format(args.paths))
+        imported, skipped, errors, elapsed = import_rows(rows, args.opening, args.keep_balances)
+
+    for error in errors:
+        print(f"  skipped {error}")
+    print(f"{datetime.now()}: imported {imported:,} transactions ({skipped:,} skipped) "
+          f"in {elapsed:.1f}s, {imported / elapsed if elapsed else 0:,.0f} rows/s.")
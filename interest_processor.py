@@ -5,6 +5,8 @@ import os
 from app import app
 from config import *
 from models import db, Account, Transaction, User
+from ledger import adjust_balance, adjust_points
+from notifications import refresh as refresh_notifications
 from datetime import datetime, timezone, date, timedelta
 
 def get_interest_rate(account: Account):
@@ -188,14 +190,14 @@ def apply_monthly_billing():
                     score_gain = round(ON_TIME_PAYMENT_REWARD * utilization_factor)
                     user.credit_score = min(MAX_SCORE, user.credit_score + score_gain)
                     points = MAX_POINTS
-                    user.reward_points += points
+                    adjust_points(user, points, 'full_payment')
                     note_parts.append(f"(Full payment; Score: +{score_gain}; Points: +{points})")
                 elif carried_balance and total_payments < min_due:
                     penalty = round(NO_PAYMENT_PENALTY * persistent_fraction) if persistent_fraction > 0 else NO_PAYMENT_PENALTY
                     user.credit_score = max(MIN_SCORE, user.credit_score - penalty)
-                    pre_penalty = credit.balance
                     fees += NO_PAYMENT_FEE
-                    credit.balance = round(credit.balance + NO_PAYMENT_FEE, 2)
+                    adjust_balance(credit, NO_PAYMENT_FEE)
+                    pre_penalty = round(credit.balance - NO_PAYMENT_FEE, 2)
                     credit.past_due = True
                     db.session.add(Transaction(
                         to_account_id=credit.id,
@@ -221,7 +223,7 @@ def apply_monthly_billing():
                     penalty = round(NO_PAYMENT_PENALTY * (1 - fraction_paid))
                     user.credit_score = max(MIN_SCORE, user.credit_score - penalty)
                     points = min(MAX_POINTS, round(MAX_POINTS * fraction_paid))
-                    user.reward_points += points
+                    adjust_points(user, points, 'partial_payment')
                     if penalty < 0:
                         note_parts.append(f"(Partial payment; Score: +{penalty * -1}; Points: +{points})")
                     else:
@@ -232,7 +234,7 @@ def apply_monthly_billing():
                     score_gain = round(ON_TIME_PAYMENT_REWARD * min((credit.credit_limit / total_payments), 1))
                     user.credit_score = min(MAX_SCORE, user.credit_score + score_gain)
                     points = MAX_POINTS
-                    user.reward_points += points
+                    adjust_points(user, points, 'full_payment')
                     note_parts.append(f"(Full payment; Score: +{score_gain}; Points: +{points})")
                 elif carried_balance and total_payments >= min_due:
                     fraction_paid = total_payments / ((credit.past_amt + min_due) / 2) if old_balance > 0 else 0
@@ -240,16 +242,16 @@ def apply_monthly_billing():
                     penalty = round(NO_PAYMENT_PENALTY * (1 - fraction_paid))
                     user.credit_score = max(MIN_SCORE, user.credit_score - penalty)
                     points = min(MAX_POINTS, round(MAX_POINTS * fraction_paid))
-                    user.reward_points += points
+                    adjust_points(user, points, 'partial_payment')
                     if penalty < 0:
                         note_parts.append(f"(Partial payment; Score: +{penalty * -1}; Points: +{points})")
                     else:
                         note_parts.append(f"(Partial payment; Score: -{penalty}; Points: +{points})")
                 elif carried_balance and total_payments < min_due:
                     user.credit_score = max(MIN_SCORE, user.credit_score - NO_PAYMENT_PENALTY)
-                    pre_penalty = credit.balance
                     fees += NO_PAYMENT_FEE
-                    credit.balance = round(credit.balance + NO_PAYMENT_FEE, 2)
+                    adjust_balance(credit, NO_PAYMENT_FEE)
+                    pre_penalty = round(credit.balance - NO_PAYMENT_FEE, 2)
                     credit.past_due = True
                     db.session.add(Transaction(
                         to_account_id=credit.id,
@@ -282,7 +284,7 @@ def apply_monthly_billing():
                     points = 0
                     if remaining_min_due <= 0:
                         points = UTILIZATION_REWARD_EXPONENT
-                        user.reward_points += points
+                        adjust_points(user, points, 'low_utilization')
                     note_parts.append(f"(Low utilization; Score: +{LOW_UTILIZATION_REWARD}; Points: +{points})")
 
                 # ---------- No Utilization Penalty ----------
@@ -296,8 +298,8 @@ def apply_monthly_billing():
             if credit.balance > 0:
                 interest = round(credit.balance * monthly_rate, 2)
             if interest >= 0.01:
-                pre_interest = credit.balance
-                credit.balance = round(credit.balance + interest, 2)
+                adjust_balance(credit, interest)
+                pre_interest = round(credit.balance - interest, 2)
                 db.session.add(Transaction(
                     to_account_id=credit.id,
                     to_user_id=user.id,
@@ -347,6 +349,9 @@ def apply_monthly_billing():
             print(log_message)
             log_interest(log_message, True)
 
+        # Billing moves due dates and past-due flags, so the alerts follow in
+        # the same commit
+        refresh_notifications(db.session.connection())
         db.session.commit()
         return old_due
 
@@ -373,8 +378,8 @@ def apply_monthly_savings_interest(due_date):
                 if interest < 0.01:
                     continue
 
-                pre_interest = account.balance
-                account.balance = round(account.balance + interest, 2)
+                adjust_balance(account, interest)
+                pre_interest = round(account.balance - interest, 2)
                 tx = Transaction(
                     from_account_id=None,
                     to_account_id=account.id,
@@ -0,0 +1,166 @@
+import time
+import random
+from sqlalchemy import update, select, insert, func, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from models import db, User, Account, PointsEntry, RewardRedemption, bump_data_version
+from config import *
+
+
+class LedgerError(Exception):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    def __init__(self, account_id):
+        super().__init__(f"Insufficient funds in account {account_id}")
+        self.account_id = account_id
+
+
+class InsufficientPoints(LedgerError):
+    def __init__(self, user_id):
+        super().__init__(f"Not enough reward points for user {user_id}")
+        self.user_id = user_id
+
+
+def _adjust(model, obj_id, user_id, column, delta, minimum=None, maximum=None, rounding=None):
+    # Single conditional UPDATE: the bounds are checked against the row as it
+    # is at write time, so concurrent requests can never overdraw or lose an
+    # update, and nothing has to be locked beforehand.
+    col = getattr(model, column)
+    new_value = col + delta if rounding is None else func.round(col + delta, rounding)
+
+    stmt = update(model).where(model.id == obj_id).values({column: new_value})
+    if minimum is not None:
+        stmt = stmt.where(col + delta >= minimum)
+    if maximum is not None:
+        stmt = stmt.where(col + delta <= maximum)
+
+    result = db.session.execute(stmt, execution_options={"synchronize_session": False})
+    if result.rowcount == 0:
+        return None
+    return _written(model, obj_id, user_id, column)
+
+
+def _written(model, obj_id, user_id, column):
+    value = db.session.execute(select(getattr(model, column)).where(model.id == obj_id)).scalar_one()
+
+    # Keep an already-loaded instance in step without marking it dirty
+    obj = db.session.identity_map.get(identity_key(model, obj_id))
+    if obj is not None:
+        set_committed_value(obj, column, value)
+
+    # Core UPDATEs skip the flush hooks, so record the change for the caches
+    db.session.info.setdefault('touched_user_ids', set()).add(user_id)
+    bump_data_version(db.session.connection(), [user_id])
+    return value
+
+
+def adjust_balance(account, delta, minimum=None, maximum=None):
+    value = _adjust(Account, account.id, account.user_id, 'balance', delta,
+                    minimum=minimum, maximum=maximum, rounding=2)
+    if value is None:
+        raise InsufficientFunds(account.id)
+    return value
+
+
+def adjust_points(user, delta, reason, minimum=0, note=None):
+    value = _adjust(User, user.id, user.id, 'reward_points', delta,
+                    minimum=minimum if delta < 0 else None)
+    if value is None:
+        raise InsufficientPoints(user.id)
+    if delta:
+        db.session.execute(insert(PointsEntry).values(
+            user_id=user.id, delta=delta, reason=reason, balance_after=value, note=note
+        ))
+    return value
+
+
+# Ledger rows for absolute overrides, as the difference from the stored total.
+# Runs before the UPDATE in the same transaction: the INSERT takes the write
+# lock, so the total cannot move in between.
+SET_POINTS_SQL = text(
+    'INSERT INTO points_ledger (user_id, timestamp, delta, reason, balance_after, note) '
+    'SELECT id, CURRENT_TIMESTAMP, :value - COALESCE(reward_points, 0), :reason, :value, :note '
+    'FROM "user" WHERE id = :user_id AND COALESCE(reward_points, 0) != :value'
+)
+
+
+def record_points_set(values, reason, note=None):
+    # values: [(user id, new total)]
+    if values:
+        db.session.execute(SET_POINTS_SQL, [
+            {'user_id': user_id, 'value': value, 'reason': reason, 'note': note} for user_id, value in values
+        ])
+
+
+def set_points(user, value, reason, note=None):
+    record_points_set([(user.id, value)], reason, note)
+    db.session.execute(
+        update(User).where(User.id == user.id).values(reward_points=value),
+        execution_options={"synchronize_session": False}
+    )
+    return _written(User, user.id, user.id, 'reward_points')
+
+
+class RewardUnavailable(LedgerError):
+    def __init__(self, reward_id):
+        super().__init__(f"Reward {reward_id} is inactive, out of stock or over its limit")
+        self.reward_id = reward_id
+
+
+# Start of the current local day/week/month, in the UTC text form timestamps
+# are stored in
+PERIOD_START_SQL = (
+    "CASE reward.limit_period "
+    "WHEN 'day' THEN datetime('now', 'localtime', 'start of day', 'utc') "
+    "WHEN 'week' THEN datetime('now', 'localtime', 'start of day', '-6 days', 'weekday 1', 'utc') "
+    "ELSE datetime('now', 'localtime', 'start of month', 'utc') END"
+)
+
+# Takes one unit of stock only if the reward is active, in stock and under the
+# user's limit for the period, and returns the price as it is at write time
+CLAIM_REWARD_SQL = text(
+    "UPDATE reward SET stock = stock - 1 "
+    "WHERE id = :reward_id AND active AND (stock IS NULL OR stock > 0) "
+    "AND (limit_count IS NULL OR ("
+    "SELECT COUNT(*) FROM reward_redemption "
+    "WHERE reward_redemption.user_id = :user_id AND reward_redemption.reward_id = reward.id "
+    f"AND reward_redemption.timestamp >= {PERIOD_START_SQL}) < limit_count) "
+    "RETURNING id, name, points, type, amount"
+)
+
+
+def redeem_reward(user, reward_id):
+    # Stock and points are both conditional UPDATEs in the caller's
+    # transaction, so either both change or (on a LedgerError) neither does
+    reward = db.session.execute(CLAIM_REWARD_SQL, {'reward_id': reward_id, 'user_id': user.id}).first()
+    if reward is None:
+        raise RewardUnavailable(reward_id)
+    adjust_points(user, -reward.points, 'redeemed', note=reward.name)
+    db.session.execute(insert(RewardRedemption).values(reward_id=reward.id, user_id=user.id, points=reward.points))
+    return reward
+
+
+def is_busy(error):
+    return "database is locked" in str(error) or "database is busy" in str(error)
+
+
+def run_atomic(fn, retries=LEDGER_RETRIES):
+    # Runs fn() and commits. A LedgerError rolls everything back and is raised
+    # to the caller; a busy database rolls back and re-runs fn() with backoff.
+    for attempt in range(retries + 1):
+        try:
+            result = fn()
+            db.session.commit()
+            return result
+        except LedgerError:
+            db.session.rollback()
+            raise
+        except OperationalError as e:
+            db.session.rollback()
+            if attempt == retries or not is_busy(e):
+                raise
+            time.sleep(LEDGER_RETRY_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5))
+
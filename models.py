@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import date
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from datetime import date, datetime
 db = SQLAlchemy()
 
 class User(db.Model, UserMixin):
@@ -56,6 +58,413 @@ class Transaction(db.Model):
     def __repr__(self):
         return f'<Tx {self.id} {self.amount}>'
 
+class UserDataVersion(db.Model):
+    # Bumped in the same DB transaction as any change to a user's profile,
+    # accounts or transactions, so per-user caches in any worker process can
+    # tell whether what they hold is still current.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class IdempotencyKey(db.Model):
+    # Result of a money-moving POST, stored under the key the client sent so a
+    # retry or double submit replays it instead of running again. status is
+    # NULL while the first request is still in flight.
+    __table_args__ = (db.UniqueConstraint('user_id', 'key'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    path = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.Integer, nullable=True)
+    response = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class DailyRollup(db.Model):
+    # Per account, per local day and category totals of the transaction
+    # table, kept current by the ROLLUP_TRIGGERS below in the same DB
+    # transaction as every insert/update/delete, and rebuilt nightly by
+    # rollups.py. Analytics read only this table.
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    category = db.Column(db.String(20), primary_key=True)
+    inflow = db.Column(db.Float, nullable=False, default=0.0)
+    outflow = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class PointsEntry(db.Model):
+    # One row per change to User.reward_points, written by ledger.py in the
+    # same DB transaction as the change, so a user's deltas always sum to
+    # their stored total (points.py reconcile checks exactly that).
+    __tablename__ = 'points_ledger'
+    __table_args__ = (db.Index('ix_points_ledger_user_time', 'user_id', 'timestamp'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp(), index=True)
+    delta = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)
+    balance_after = db.Column(db.Integer, nullable=True)
+    note = db.Column(db.String(200), nullable=True)
+
+class Reward(db.Model):
+    # Reward shop catalog, edited by parents at /admin/rewards. Rows are never
+    # deleted (redemptions point at them); retired rewards are made inactive.
+    # stock None means unlimited; limit_count per limit_period caps how often
+    # one user can redeem it. revision goes up on every edit so each worker
+    # can tell its cached catalog is stale (see rewards.catalog).
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    symbol = db.Column(db.String(16), nullable=False, default='🎁')
+    points = db.Column(db.Integer, nullable=False)
+    type = db.Column(db.String(20), nullable=False, default='special')  # cash or special
+    amount = db.Column(db.Float, nullable=True)
+    stock = db.Column(db.Integer, nullable=True)
+    limit_count = db.Column(db.Integer, nullable=True)
+    limit_period = db.Column(db.String(10), nullable=True)  # day, week or month
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    revision = db.Column(db.Integer, nullable=False, default=1)
+
+class RewardRedemption(db.Model):
+    __table_args__ = (db.Index('ix_reward_redemption_user_reward_time', 'user_id', 'reward_id', 'timestamp'),)
+    id = db.Column(db.Integer, primary_key=True)
+    reward_id = db.Column(db.Integer, db.ForeignKey('reward.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    points = db.Column(db.Integer, nullable=False)
+
+class Challenge(db.Model):
+    # A goal set by a parent for a window of time. metric is one of
+    # challenges.METRICS; progress per child is kept in ChallengeProgress.
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(80), nullable=False)
+    description = db.Column(db.String(200), nullable=True)
+    metric = db.Column(db.String(20), nullable=False)
+    goal = db.Column(db.Float, nullable=False, default=0.0)
+    reward_points = db.Column(db.Integer, nullable=False, default=0)
+    starts_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    ends_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+
+class ChallengeProgress(db.Model):
+    # One row per child taking part. progress is advanced by the
+    # CHALLENGE_TRIGGERS below as each transaction is written, and the points
+    # are awarded in the same DB transaction as the one that completes it.
+    # closed_at is set by the nightly job (challenges.py) when the window ends.
+    challenge_id = db.Column(db.Integer, db.ForeignKey('challenge.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, index=True)
+    progress = db.Column(db.Float, nullable=False, default=0.0)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    closed_at = db.Column(db.DateTime, nullable=True)
+
+class ScheduledTransfer(db.Model):
+    # A recurring transfer set up by a parent and run by scheduler.py.
+    # next_run_at is server local time and NULL while the rule is paused; the
+    # executor reads only rows that are due through its index, so the number
+    # of rules on file doesn't matter. Account ids are NULL for the Bank.
+    id = db.Column(db.Integer, primary_key=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    from_account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=True)
+    to_account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=True)
+    # scheduler.KINDS: a fixed amount, a sweep of everything above `amount`,
+    # or the credit minimum due
+    kind = db.Column(db.String(20), nullable=False, default='fixed')
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    description = db.Column(db.String(200), nullable=True)
+    interval = db.Column(db.String(10), nullable=False)
+    every = db.Column(db.Integer, nullable=False, default=1)
+    starts_at = db.Column(db.DateTime, nullable=False)
+    next_run_at = db.Column(db.DateTime, nullable=True, index=True)
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(200), nullable=True)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+
+    from_account = db.relationship('Account', foreign_keys=[from_account_id])
+    to_account = db.relationship('Account', foreign_keys=[to_account_id])
+
+class Notification(db.Model):
+    # Payment-due alerts for credit accounts (notifications.KINDS), written in
+    # one set-based pass by notifications.py and kept current on payments by
+    # NOTIFICATION_TRIGGERS. One row per account, kind and due date, so the
+    # job can re-run; a notification the user has read stays read.
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'kind', 'due_date'),
+        db.Index('ix_notification_unread', 'user_id', 'id', sqlite_where=db.text('read_at IS NULL')),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    due_date = db.Column(db.Date, nullable=False)
+    balance = db.Column(db.Float, nullable=False, default=0.0)
+    min_due = db.Column(db.Float, nullable=False, default=0.0)
+    past_due = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    refreshed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    read_at = db.Column(db.DateTime, nullable=True)
+
+def rollup_day(row):
+    # Days are bucketed in server local time, the way the family reads them
+    return f"date(COALESCE({row}timestamp, CURRENT_TIMESTAMP), 'localtime')"
+
+def rollup_category(row):
+    desc = f"{row}description"
+    return (
+        f"CASE WHEN {desc} = 'Weekly allowance' THEN 'allowance' "
+        f"WHEN {desc} IN ('Savings interest payment', 'Credit interest charge') THEN 'interest' "
+        f"WHEN {desc} IN ('Savings withdrawal penalty', 'Late payment fee') THEN 'penalty' "
+        f"WHEN {desc} LIKE 'Redeemed reward:%' THEN 'reward' "
+        f"WHEN {desc} = 'Credit withdraw' THEN 'borrow' "
+        f"WHEN {desc} = 'Credit payment' THEN 'payment' "
+        f"ELSE 'transfer' END"
+    )
+
+def _rollup_add(row):
+    statements = []
+    for side, column in (('from', 'outflow'), ('to', 'inflow')):
+        statements.append(
+            f"INSERT INTO daily_rollup (account_id, day, category, inflow, outflow, count) "
+            f"SELECT {row}{side}_account_id, {rollup_day(row)}, {rollup_category(row)}, "
+            f"{'0, ' + row + 'amount' if column == 'outflow' else row + 'amount, 0'}, 1 "
+            f"WHERE {row}{side}_account_id IS NOT NULL "
+            f"ON CONFLICT(account_id, day, category) DO UPDATE SET "
+            f"{column} = {column} + excluded.{column}, count = count + 1;"
+        )
+    return ' '.join(statements)
+
+def _rollup_remove(row):
+    statements = []
+    for side, column in (('from', 'outflow'), ('to', 'inflow')):
+        statements.append(
+            f"UPDATE daily_rollup SET {column} = {column} - {row}amount, count = count - 1 "
+            f"WHERE account_id = {row}{side}_account_id AND day = {rollup_day(row)} "
+            f"AND category = {rollup_category(row)};"
+        )
+    return ' '.join(statements)
+
+ROLLUP_TRIGGERS = [
+    'CREATE INDEX IF NOT EXISTS ix_transaction_timestamp ON "transaction" (timestamp)',
+    f'CREATE TRIGGER IF NOT EXISTS daily_rollup_insert AFTER INSERT ON "transaction" '
+    f'BEGIN {_rollup_add("NEW.")} END',
+    f'CREATE TRIGGER IF NOT EXISTS daily_rollup_delete AFTER DELETE ON "transaction" '
+    f'BEGIN {_rollup_remove("OLD.")} END',
+    f'CREATE TRIGGER IF NOT EXISTS daily_rollup_update AFTER UPDATE OF '
+    f'from_account_id, to_account_id, amount, timestamp, description ON "transaction" '
+    f'BEGIN {_rollup_remove("OLD.")} {_rollup_add("NEW.")} END',
+]
+
+def _challenge_step(row):
+    # What one transaction adds to a progress row, by metric: net money moved
+    # into savings from an account (interest and allowance don't count),
+    # credit payments made, and credit draws taken
+    def account_type(side):
+        return f"(SELECT type FROM account WHERE id = {row}{side}_account_id)"
+    user = "challenge_progress.user_id"
+    return (
+        f"CASE challenge.metric "
+        f"WHEN 'save' THEN "
+        f"(CASE WHEN {row}from_account_id IS NOT NULL AND {row}to_user_id = {user} "
+        f"AND {account_type('to')} = 'savings' THEN {row}amount ELSE 0 END) - "
+        f"(CASE WHEN {row}to_account_id IS NOT NULL AND {row}from_user_id = {user} "
+        f"AND {account_type('from')} = 'savings' THEN {row}amount ELSE 0 END) "
+        f"WHEN 'pay_credit' THEN "
+        f"CASE WHEN {row}description = 'Credit payment' AND {row}to_user_id = {user} THEN {row}amount ELSE 0 END "
+        f"WHEN 'no_credit_draws' THEN "
+        f"CASE WHEN {row}description = 'Credit withdraw' AND {row}from_user_id = {user} THEN 1 ELSE 0 END "
+        f"ELSE 0 END"
+    )
+
+CHALLENGE_TRIGGERS = [
+    # Advance every open challenge of the users on a new transaction whose
+    # window it falls in
+    f'CREATE TRIGGER IF NOT EXISTS challenge_progress_insert AFTER INSERT ON "transaction" BEGIN '
+    f'UPDATE challenge_progress SET progress = progress + ('
+    f'SELECT {_challenge_step("NEW.")} FROM challenge WHERE challenge.id = challenge_progress.challenge_id) '
+    f'WHERE user_id IN (NEW.from_user_id, NEW.to_user_id) AND completed_at IS NULL AND closed_at IS NULL '
+    f'AND challenge_id IN (SELECT id FROM challenge WHERE '
+    f'datetime(starts_at) <= datetime(COALESCE(NEW.timestamp, CURRENT_TIMESTAMP)) '
+    f'AND datetime(ends_at) > datetime(COALESCE(NEW.timestamp, CURRENT_TIMESTAMP))); END',
+    # Reaching the goal completes the challenge and pays its points, with the
+    # ledger entry and cache version bump a points change always gets.
+    # no_credit_draws has no goal to reach; it is settled when the window ends.
+    'CREATE TRIGGER IF NOT EXISTS challenge_completed AFTER UPDATE OF progress ON challenge_progress '
+    'WHEN NEW.completed_at IS NULL AND NEW.progress > OLD.progress AND NEW.progress >= ('
+    "SELECT goal FROM challenge WHERE id = NEW.challenge_id AND metric != 'no_credit_draws') BEGIN "
+    'UPDATE challenge_progress SET completed_at = CURRENT_TIMESTAMP '
+    'WHERE challenge_id = NEW.challenge_id AND user_id = NEW.user_id; '
+    'UPDATE "user" SET reward_points = COALESCE(reward_points, 0) + '
+    '(SELECT reward_points FROM challenge WHERE id = NEW.challenge_id) WHERE id = NEW.user_id; '
+    'INSERT INTO points_ledger (user_id, timestamp, delta, reason, balance_after, note) '
+    "SELECT NEW.user_id, CURRENT_TIMESTAMP, challenge.reward_points, 'challenge', \"user\".reward_points, challenge.title "
+    'FROM challenge, "user" WHERE challenge.id = NEW.challenge_id AND "user".id = NEW.user_id '
+    'AND challenge.reward_points != 0; '
+    'INSERT INTO user_data_version (user_id, version) VALUES (NEW.user_id, 1) '
+    'ON CONFLICT(user_id) DO UPDATE SET version = version + 1; END',
+]
+
+NOTIFICATION_TRIGGERS = [
+    # A credit payment comes off the minimum due on the account's unread
+    # alerts; one that covers it clears them
+    'CREATE TRIGGER IF NOT EXISTS notification_payment AFTER INSERT ON "transaction" '
+    "WHEN NEW.description = 'Credit payment' AND NEW.to_account_id IS NOT NULL BEGIN "
+    'DELETE FROM notification WHERE account_id = NEW.to_account_id AND read_at IS NULL '
+    'AND min_due - NEW.amount < 0.005; '
+    'UPDATE notification SET min_due = round(min_due - NEW.amount, 2) '
+    'WHERE account_id = NEW.to_account_id AND read_at IS NULL; END',
+    # Unread alerts show the balance as of the latest transaction
+    'CREATE TRIGGER IF NOT EXISTS notification_balance AFTER INSERT ON "transaction" BEGIN '
+    'UPDATE notification SET balance = COALESCE(CASE WHEN account_id = NEW.to_account_id '
+    'THEN NEW.to_balance_after ELSE NEW.from_balance_after END, balance) '
+    'WHERE account_id IN (NEW.from_account_id, NEW.to_account_id) AND read_at IS NULL; END',
+]
+
+def rebuild_rollups(connection, since=None):
+    # Recomputes rollups from raw transactions, for every day from `since`
+    # (a date) on, or for all history when since is None
+    entries = (
+        f'SELECT from_account_id AS account_id, {rollup_day("")} AS day, {rollup_category("")} AS category, '
+        f'0 AS inflow, amount AS outflow FROM "transaction" WHERE from_account_id IS NOT NULL {{window}} '
+        f'UNION ALL '
+        f'SELECT to_account_id, {rollup_day("")}, {rollup_category("")}, '
+        f'amount, 0 FROM "transaction" WHERE to_account_id IS NOT NULL {{window}}'
+    )
+    params = {}
+    if since is None:
+        connection.execute(text("DELETE FROM daily_rollup"))
+        entries = entries.format(window='')
+    else:
+        params['since'] = since.isoformat()
+        connection.execute(text("DELETE FROM daily_rollup WHERE day >= :since"), params)
+        # A day of slack either side of UTC lets the timestamp index narrow
+        # the scan; the outer filter then cuts on the exact local day
+        entries = entries.format(window="AND timestamp >= datetime(:since, '-1 day')")
+    connection.execute(
+        text(
+            "INSERT INTO daily_rollup (account_id, day, category, inflow, outflow, count) "
+            "SELECT account_id, day, category, SUM(inflow), SUM(outflow), COUNT(*) "
+            f"FROM ({entries}) {'WHERE day >= :since ' if since else ''}"
+            "GROUP BY account_id, day, category"
+        ),
+        params
+    )
+    # Days emptied by deletes or edits before the window
+    connection.execute(text("DELETE FROM daily_rollup WHERE count <= 0"))
+
+def _search_users(row):
+    return (
+        f"COALESCE((SELECT username FROM \"user\" WHERE id = {row}from_user_id), '') || ' ' || "
+        f"COALESCE((SELECT username FROM \"user\" WHERE id = {row}to_user_id), '')"
+    )
+
+def _search_accounts(row):
+    # A missing side is the Bank, so "bank" finds deposits and withdrawals
+    return (
+        f"COALESCE((SELECT type FROM account WHERE id = {row}from_account_id), 'bank') || ' ' || "
+        f"COALESCE((SELECT type FROM account WHERE id = {row}to_account_id), 'bank')"
+    )
+
+# Full-text index over transaction descriptions plus the usernames and
+# account types on either side, keyed by transaction id (rowid) and kept in
+# sync by triggers. prefix= builds the 2- and 3-character prefix indexes
+# that make as-you-type "word*" queries cheap.
+SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS transaction_search USING fts5("
+    "description, users, accounts, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    f'CREATE TRIGGER IF NOT EXISTS transaction_search_insert AFTER INSERT ON "transaction" BEGIN '
+    f'INSERT INTO transaction_search (rowid, description, users, accounts) '
+    f'VALUES (NEW.id, NEW.description, {_search_users("NEW.")}, {_search_accounts("NEW.")}); END',
+    'CREATE TRIGGER IF NOT EXISTS transaction_search_delete AFTER DELETE ON "transaction" BEGIN '
+    'DELETE FROM transaction_search WHERE rowid = OLD.id; END',
+    f'CREATE TRIGGER IF NOT EXISTS transaction_search_update AFTER UPDATE OF '
+    f'description, from_user_id, to_user_id, from_account_id, to_account_id ON "transaction" BEGIN '
+    f'DELETE FROM transaction_search WHERE rowid = OLD.id; '
+    f'INSERT INTO transaction_search (rowid, description, users, accounts) '
+    f'VALUES (NEW.id, NEW.description, {_search_users("NEW.")}, {_search_accounts("NEW.")}); END',
+    f'CREATE TRIGGER IF NOT EXISTS transaction_search_rename AFTER UPDATE OF username ON "user" BEGIN '
+    f'UPDATE transaction_search SET users = '
+    f'(SELECT {_search_users("t.")} FROM "transaction" t WHERE t.id = transaction_search.rowid) '
+    f'WHERE rowid IN (SELECT id FROM "transaction" WHERE from_user_id = NEW.id OR to_user_id = NEW.id); END',
+]
+
+def rebuild_search(connection, after_id=None):
+    # Re-indexes every transaction, or only those after `after_id` (which
+    # must not be indexed yet)
+    if after_id is None:
+        connection.execute(text("DELETE FROM transaction_search"))
+    connection.execute(
+        text(
+            "INSERT INTO transaction_search (rowid, description, users, accounts) "
+            f'SELECT id, description, {_search_users("")}, {_search_accounts("")} FROM "transaction" '
+            "WHERE id > :after_id"
+        ),
+        {'after_id': after_id or 0}
+    )
+
+def bump_data_version(connection, user_ids):
+    user_ids = [uid for uid in set(user_ids) if uid]
+    if not user_ids:
+        return
+    connection.execute(
+        text(
+            "INSERT INTO user_data_version (user_id, version) VALUES (:user_id, 1) "
+            "ON CONFLICT(user_id) DO UPDATE SET version = version + 1"
+        ),
+        [{"user_id": uid} for uid in user_ids]
+    )
+
+def get_data_version(user_id):
+    version = db.session.execute(
+        db.select(UserDataVersion.version).where(UserDataVersion.user_id == user_id)
+    ).scalar()
+    return version or 0
+
+def touched_user_ids(session):
+    user_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, User):
+            user_ids.add(obj.id)
+        elif isinstance(obj, Account):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, Transaction):
+            user_ids.update((obj.from_user_id, obj.to_user_id))
+    return user_ids
+
+@event.listens_for(Session, 'after_flush')
+def bump_versions_after_flush(session, flush_context):
+    user_ids = touched_user_ids(session)
+    # Kept until commit/rollback for in-process caches to act on
+    session.info.setdefault('touched_user_ids', set()).update(user_ids)
+    bump_data_version(session.connection(), user_ids)
+
 def init_db(app):
     with app.app_context():
         db.create_all()
+        with db.engine.begin() as connection:
+            backfill = not connection.execute(text("SELECT 1 FROM daily_rollup LIMIT 1")).first()
+            opening = not connection.execute(text("SELECT 1 FROM points_ledger LIMIT 1")).first()
+            index = not connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'transaction_search'")
+            ).first()
+            notify = not connection.execute(text("SELECT 1 FROM notification LIMIT 1")).first()
+            for ddl in ROLLUP_TRIGGERS + SEARCH_DDL + CHALLENGE_TRIGGERS + NOTIFICATION_TRIGGERS:
+                connection.exec_driver_sql(ddl)
+            # First start after upgrading: fold in the history that predates the triggers
+            if backfill:
+                rebuild_rollups(connection)
+            if index:
+                rebuild_search(connection)
+            if not connection.execute(text("SELECT 1 FROM reward LIMIT 1")).first():
+                from rewards import DEFAULT_REWARDS
+                connection.execute(Reward.__table__.insert(), [
+                    {'amount': None, **reward} for reward in DEFAULT_REWARDS
+                ])
+            # Points earned before the ledger existed become one opening entry each
+            if opening:
+                connection.execute(text(
+                    "INSERT INTO points_ledger (user_id, timestamp, delta, reason, balance_after, note) "
+                    "SELECT id, CURRENT_TIMESTAMP, reward_points, 'opening', reward_points, 'Balance before the points ledger' "
+                    "FROM \"user\" WHERE COALESCE(reward_points, 0) != 0"
+                ))
+            # Alerts already due before notifications.py first runs
+            if notify:
+                from notifications import refresh
+                refresh(connection)
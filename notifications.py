@@ -0,0 +1,134 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, update, text, bindparam
+from models import db, Notification
+from config import *
+
+# Payment-due alerts for credit accounts. Run `python notifications.py`
+# daily (after interest_processor.py): one set-based pass works out the
+# upcoming and past-due alerts for every credit account and upserts them
+# into the notification table. Payments adjust the affected rows as they
+# are written (NOTIFICATION_TRIGGERS in models.py), so the dashboard only
+# ever reads its unread rows, and polls /api/notifications for new ones.
+
+KINDS = {
+    'upcoming': 'Payment due soon',
+    'due': 'Payment due',
+    'past_due': 'Overdue',
+}
+
+# Same figures as the account cards: the minimum due is MIN_PAYMENT_AMT of
+# the balance carried into the cycle, less what has been paid this cycle
+REFRESH_SQL = '''
+INSERT INTO notification (user_id, account_id, kind, due_date, balance, min_due, past_due, created_at, refreshed_at)
+WITH credit AS (
+    SELECT a.id AS account_id, a.user_id, a.balance, a.past_due, date(a.due_date) AS due_date,
+           round(:rate * max(a.past_amt, 0), 2) AS min_due,
+           (SELECT COALESCE(SUM(t.amount), 0) FROM "transaction" t
+            WHERE t.to_account_id = a.id AND t.description = 'Credit payment'
+              AND t.timestamp >= datetime(a.due_date, :cycle_start)
+              AND t.timestamp < datetime(a.due_date, '+1 day')) AS paid
+    FROM account a
+    WHERE a.type = 'credit' AND a.due_date IS NOT NULL {accounts}
+),
+alerts AS (
+    -- One alert per account: a payment coming due (flagged if the account is
+    -- also past due), otherwise a past_due alert for the missed due date
+    SELECT user_id, account_id, CASE WHEN due_date > :today THEN 'upcoming' ELSE 'due' END AS kind,
+           due_date, balance, round(min_due - paid, 2) AS remaining, past_due
+    FROM credit
+    WHERE min_due - paid >= 0.005 AND due_date <= date(:today, :ahead)
+    UNION ALL
+    SELECT user_id, account_id, 'past_due', date(due_date, :cycle_back), balance,
+           round(max(min_due - paid, 0), 2), past_due
+    FROM credit
+    WHERE past_due AND NOT (min_due - paid >= 0.005 AND due_date <= date(:today, :ahead))
+)
+SELECT user_id, account_id, kind, due_date, balance, remaining, past_due, :now, :now FROM alerts WHERE true
+ON CONFLICT (account_id, kind, due_date) DO UPDATE SET
+    balance = excluded.balance, min_due = excluded.min_due, past_due = excluded.past_due,
+    refreshed_at = excluded.refreshed_at
+'''
+
+# Unread alerts the pass above no longer produces (paid, or a new cycle)
+STALE_SQL = 'DELETE FROM notification WHERE read_at IS NULL AND refreshed_at != :now {accounts}'
+
+
+def _stamp(when):
+    # The format SQLAlchemy stores DateTime columns in
+    return when.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def refresh(connection, account_ids=None, today=None):
+    # Brings the unread alerts for every credit account (or just account_ids)
+    # up to date. Returns (alerts written, stale alerts removed).
+    if account_ids is not None and not account_ids:
+        return 0, 0
+    params = {
+        'rate': MIN_PAYMENT_AMT,
+        'cycle_start': f'-{BILLING_CYCLE_DAYS - 1} days',
+        'cycle_back': f'-{BILLING_CYCLE_DAYS} days',
+        'today': (today or date.today()).isoformat(),
+        'ahead': f'+{NOTIFY_DAYS_AHEAD} days',
+        'now': _stamp(datetime.utcnow()),
+    }
+    upsert, stale = text(REFRESH_SQL.format(accounts='')), text(STALE_SQL.format(accounts=''))
+    if account_ids is not None:
+        params['account_ids'] = list(account_ids)
+        upsert = text(REFRESH_SQL.format(accounts='AND a.id IN :account_ids')).bindparams(
+            bindparam('account_ids', expanding=True))
+        stale = text(STALE_SQL.format(accounts='AND account_id IN :account_ids')).bindparams(
+            bindparam('account_ids', expanding=True))
+    written = connection.execute(upsert, params).rowcount
+    removed = connection.execute(stale, params).rowcount
+    return written, removed
+
+
+def prune(connection, now=None):
+    # Read alerts older than NOTIFY_KEEP_DAYS
+    cutoff = (now or datetime.utcnow()) - timedelta(days=NOTIFY_KEEP_DAYS)
+    return connection.execute(
+        text('DELETE FROM notification WHERE read_at IS NOT NULL AND read_at < :cutoff'),
+        {'cutoff': _stamp(cutoff)}
+    ).rowcount
+
+
+def unread(user_id, after=0):
+    # Served by the partial ix_notification_unread index
+    return db.session.execute(
+        select(Notification)
+        .where(Notification.user_id == user_id, Notification.read_at.is_(None), Notification.id > after)
+        .order_by(Notification.id)
+    ).scalars().all()
+
+
+def mark_read(user_id, ids):
+    result = db.session.execute(
+        update(Notification)
+        .where(Notification.user_id == user_id, Notification.id.in_(ids), Notification.read_at.is_(None))
+        .values(read_at=datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def as_dict(notification):
+    return {
+        'id': notification.id,
+        'kind': notification.kind,
+        'title': KINDS.get(notification.kind, notification.kind),
+        'account_id': notification.account_id,
+        'due_date': notification.due_date.isoformat(),
+        'balance': notification.balance,
+        'min_due': notification.min_due,
+        'past_due': notification.past_due,
+    }
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        connection = db.session.connection()
+        written, removed = refresh(connection)
+        pruned = prune(connection)
+        db.session.commit()
+        print(f"{date.today()}: {written} alert(s) written, {removed} cleared, {pruned} old read alert(s) removed.")
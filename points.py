@@ -0,0 +1,137 @@
+import argparse
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import select, insert, func, case
+from models import db, User, PointsEntry
+from rollups import PERIODS, period_labels
+from config import *
+
+# Reward points: aggregates over the points ledger and the reconcile check.
+#   python points.py summary [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--period day|week|month]
+#   python points.py reconcile [--fix]
+
+# Reason codes written by ledger.adjust_points / set_points
+REASONS = {
+    'opening': 'Balance before the ledger',
+    'savings': 'Savings deposits',
+    'full_payment': 'Full credit payment',
+    'partial_payment': 'Partial credit payment',
+    'low_utilization': 'Low credit utilization',
+    'redeemed': 'Redeemed rewards',
+    'challenge': 'Completed challenges',
+    'admin': 'Set by a parent',
+    'adjustment': 'Reconcile adjustment',
+}
+
+ledger = PointsEntry.__table__
+users = User.__table__
+
+
+def ledger_day(column):
+    # Local days, like the transaction rollups
+    return func.date(column, 'localtime')
+
+
+def summary_query(start, end, period, user_ids=None):
+    day = ledger_day(ledger.c.timestamp)
+    bucket = PERIODS[period](day).label('period')
+    stmt = (
+        select(
+            ledger.c.user_id, bucket, ledger.c.reason,
+            func.sum(case((ledger.c.delta > 0, ledger.c.delta), else_=0)).label('earned'),
+            func.sum(case((ledger.c.delta < 0, -ledger.c.delta), else_=0)).label('spent'),
+            func.count().label('count'),
+        )
+        # Range on the indexed column; a day either side covers the local offset
+        .where(ledger.c.timestamp >= datetime.combine(start - timedelta(days=1), time()),
+               ledger.c.timestamp < datetime.combine(end + timedelta(days=2), time()))
+        .where(day >= start.isoformat(), day <= end.isoformat())
+        .group_by(ledger.c.user_id, bucket, ledger.c.reason)
+    )
+    if user_ids:
+        stmt = stmt.where(ledger.c.user_id.in_(user_ids))
+    return stmt
+
+
+def points_summary(start, end, period='month', user_ids=None):
+    # Points earned and spent per user, period and reason
+    labels = period_labels(start, end, period)
+    names = dict(db.session.execute(select(users.c.id, users.c.username)).all())
+
+    report = {}
+    for row in db.session.execute(summary_query(start, end, period, user_ids)):
+        user = report.setdefault(row.user_id, {
+            'user_id': row.user_id,
+            'username': names.get(row.user_id),
+            'periods': {},
+            'totals': {},
+        })
+        user['periods'].setdefault(row.period, {})[row.reason] = {
+            'earned': row.earned, 'spent': row.spent, 'count': row.count,
+        }
+        totals = user['totals'].setdefault(row.reason, {'earned': 0, 'spent': 0, 'count': 0})
+        totals['earned'] += row.earned
+        totals['spent'] += row.spent
+        totals['count'] += row.count
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'period': period,
+        'periods': labels,
+        'reasons': REASONS,
+        'users': sorted(report.values(), key=lambda u: u['username'] or ''),
+    }
+
+
+def reconcile(fix=False):
+    # Every user whose stored total differs from the sum of their ledger, in
+    # one grouped query. With fix=True the stored total is taken as correct
+    # and an 'adjustment' entry records the difference.
+    stored = func.coalesce(users.c.reward_points, 0)
+    summed = func.coalesce(func.sum(ledger.c.delta), 0)
+    rows = db.session.execute(
+        select(users.c.id, users.c.username, stored.label('stored'), summed.label('ledger'))
+        .select_from(users.outerjoin(ledger, ledger.c.user_id == users.c.id))
+        .group_by(users.c.id)
+        .having(stored != summed)
+        .order_by(users.c.username)
+    ).all()
+
+    if fix and rows:
+        db.session.execute(insert(PointsEntry), [
+            {'user_id': r.id, 'delta': r.stored - r.ledger, 'reason': 'adjustment',
+             'balance_after': r.stored, 'note': 'points.py reconcile --fix'}
+            for r in rows
+        ])
+        db.session.commit()
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reward points ledger reports.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    summary = commands.add_parser('summary', help="points earned and spent per period and reason")
+    summary.add_argument('--start', type=date.fromisoformat)
+    summary.add_argument('--end', type=date.fromisoformat)
+    summary.add_argument('--period', choices=list(PERIODS), default='month')
+    check = commands.add_parser('reconcile', help="compare stored totals with the ledger")
+    check.add_argument('--fix', action='store_true', help="record adjustment entries for any difference")
+    args = parser.parse_args()
+
+    from app import app
+    with app.app_context():
+        if args.command == 'summary':
+            end = args.end or date.today()
+            start = args.start or end - timedelta(days=365)
+            report = points_summary(start, end, args.period)
+            for user in report['users']:
+                print(user['username'])
+                for period in report['periods']:
+                    for reason, totals in sorted(user['periods'].get(period, {}).items()):
+                        print(f"  {period}  {reason:<16} +{totals['earned']:<6} -{totals['spent']:<6} ({totals['count']} entries)")
+        else:
+            rows = reconcile(args.fix)
+            for r in rows:
+                print(f"{r.username}: stored {r.stored}, ledger {r.ledger} (difference {r.stored - r.ledger:+d})"
+                      f"{' - adjusted' if args.fix else ''}")
+            print(f"{date.today()}: {len(rows)} user(s) out of balance" if rows else f"{date.today()}: points ledger balances.")
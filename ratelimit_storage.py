@@ -0,0 +1,85 @@
+import os
+import time
+import random
+import sqlite3
+import threading
+from limits.storage import Storage
+
+
+class SQLiteStorage(Storage):
+    # Fixed-window counters for Flask-Limiter kept in a local SQLite file, so
+    # every gunicorn worker shares the same counts and they survive restarts.
+    # Each hit is a single atomic upsert; connections are per thread and run in
+    # WAL mode so readers never block the writer.
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.path = uri.split("://", 1)[1]
+        self._local = threading.local()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS ratelimit ("
+            "key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        conn = self._connection()
+
+        # ---- Occasionally sweep finished windows ----
+        if random.random() < 0.001:
+            conn.execute("DELETE FROM ratelimit WHERE expires_at <= ?", (now,))
+
+        row = conn.execute(
+            "INSERT INTO ratelimit (key, count, expires_at) VALUES (:key, :amount, :expires_at) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "count = CASE WHEN expires_at <= :now THEN excluded.count ELSE count + excluded.count END, "
+            "expires_at = CASE WHEN expires_at <= :now OR :elastic THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING count",
+            {"key": key, "amount": amount, "expires_at": now + expiry,
+             "now": now, "elastic": int(bool(elastic_expiry))}
+        ).fetchone()
+        return row[0]
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT count FROM ratelimit WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT expires_at FROM ratelimit WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._connection().execute("DELETE FROM ratelimit").rowcount
+
+    def clear(self, key):
+        self._connection().execute("DELETE FROM ratelimit WHERE key = ?", (key,))
@@ -1,4 +1,15 @@
-REWARDS = [
+import math
+import threading
+from collections import namedtuple
+from sqlalchemy import select, update, insert, func, text
+from models import db, Reward
+from ledger import PERIOD_START_SQL
+from config import *
+
+# Reward shop catalog. The rewards live in the reward table (parents edit them
+# at /admin/rewards); DEFAULT_REWARDS seeds it on first start.
+
+DEFAULT_REWARDS = [
     {"points": 1500, "name": "Amusement Park Pass", "type": "special", "symbol":"🪪"},
     {"points": 1000, "name": "$100", "type": "cash", "amount": 100, "symbol":"💵"},
     {"points": 750, "name": "School Day Pass", "type": "special", "symbol":"🎒"},
@@ -14,4 +25,137 @@ REWARDS = [
     {"points": 150, "name": "Ice Cream", "type": "special", "symbol":"🍨"},
     {"points": 50, "name": "Candy bar", "type": "special", "symbol":"🍫"},
     {"points": 25, "name": "Cookie", "type": "special", "symbol":"🍪"},
-]
\ No newline at end of file
+]
+
+
+TYPES = ('special', 'cash')
+LIMIT_PERIODS = ('day', 'week', 'month')
+
+# Catalog fields as the shop shows them. Stock is not part of the snapshot:
+# it changes with every redemption and is read live (see availability).
+CatalogReward = namedtuple('CatalogReward', 'id name symbol points type amount limit_count limit_period')
+
+_snapshot = {'revision': None, 'rewards': []}
+_snapshot_lock = threading.Lock()
+
+
+class RewardError(Exception):
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def catalog_revision():
+    # Every edit bumps one row's revision and every new row adds one, so the
+    # sum only ever goes up
+    return db.session.execute(select(func.coalesce(func.sum(Reward.revision), 0))).scalar()
+
+
+def catalog():
+    # Active rewards, most expensive first, rebuilt only when the catalog has
+    # been edited (in this worker or any other)
+    revision = catalog_revision()
+    with _snapshot_lock:
+        if _snapshot['revision'] == revision:
+            return _snapshot['rewards']
+
+    rows = db.session.execute(
+        select(*(getattr(Reward, field) for field in CatalogReward._fields))
+        .where(Reward.active)
+        .order_by(Reward.points.desc(), Reward.id)
+    ).all()
+    rewards = [CatalogReward(*row) for row in rows]
+    with _snapshot_lock:
+        _snapshot.update(revision=revision, rewards=rewards)
+    return rewards
+
+
+def invalidate():
+    with _snapshot_lock:
+        _snapshot['revision'] = None
+
+
+def availability(user_id):
+    # {reward id: how many more this user can redeem right now} for rewards
+    # with stock or a period limit; the rest are unlimited
+    rows = db.session.execute(text(
+        "SELECT reward.id, reward.stock, reward.limit_count, ("
+        "SELECT COUNT(*) FROM reward_redemption "
+        "WHERE reward_redemption.user_id = :user_id AND reward_redemption.reward_id = reward.id "
+        f"AND reward_redemption.timestamp >= {PERIOD_START_SQL}) AS used "
+        "FROM reward WHERE active AND (stock IS NOT NULL OR limit_count IS NOT NULL)"
+    ), {'user_id': user_id}).all()
+
+    left = {}
+    for row in rows:
+        limits = []
+        if row.stock is not None:
+            limits.append(row.stock)
+        if row.limit_count is not None:
+            limits.append(row.limit_count - row.used)
+        left[row.id] = max(0, min(limits))
+    return left
+
+
+def parse_reward(form):
+    # Editor form to column values, collecting every problem
+    errors = []
+    values = {
+        'name': (form.get('name') or '').strip(),
+        'symbol': (form.get('symbol') or '').strip() or '🎁',
+        'type': form.get('type') or 'special',
+        'limit_period': form.get('limit_period') or None,
+        'active': bool(form.get('active')),
+    }
+    if not values['name']:
+        errors.append('Name is required')
+    if values['type'] not in TYPES:
+        errors.append('Type must be special or cash')
+
+    for field, label, kind, required in (
+        ('points', 'Points', int, True),
+        ('amount', 'Cash amount', float, values['type'] == 'cash'),
+        ('stock', 'Stock', int, False),
+        ('limit_count', 'Limit', int, False),
+    ):
+        raw = (form.get(field) or '').strip()
+        if not raw:
+            values[field] = None
+            if required:
+                errors.append(f'{label} is required')
+            continue
+        try:
+            values[field] = kind(raw)
+            if not math.isfinite(values[field]):
+                raise ValueError(raw)
+        except ValueError:
+            errors.append(f'{label} must be a {"whole " if kind is int else ""}number')
+            continue
+        if values[field] < 0 or (field == 'points' and values[field] == 0):
+            errors.append(f'{label} must be {"positive" if field == "points" else "zero or more"}')
+        elif field == 'amount' and values[field] > REWARD_MAX_CASH_AMOUNT:
+            errors.append(f'{label} must be at most ${REWARD_MAX_CASH_AMOUNT:,.2f}')
+
+    if values['type'] != 'cash':
+        values['amount'] = None
+    if values['limit_count'] is None:
+        values['limit_period'] = None
+    elif values['limit_period'] not in LIMIT_PERIODS:
+        errors.append('Limit period must be day, week or month')
+    if errors:
+        raise RewardError(errors)
+    return values
+
+
+def save_reward(reward_id, values):
+    if reward_id is None:
+        reward_id = db.session.execute(insert(Reward).values(**values)).inserted_primary_key[0]
+    else:
+        result = db.session.execute(
+            update(Reward).where(Reward.id == reward_id).values(**values, revision=Reward.revision + 1)
+        )
+        if result.rowcount == 0:
+            raise RewardError([f'Unknown reward {reward_id}'])
+    db.session.commit()
+    invalidate()
+    return reward_id
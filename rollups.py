@@ -0,0 +1,162 @@
+import sys
+from datetime import date, timedelta
+from sqlalchemy import select, func
+from models import db, User, Account, DailyRollup, rebuild_rollups
+from config import *
+
+# How a day is bucketed for each ?period=; every bucket is labelled with the
+# ISO date it starts on (weeks start on Monday)
+PERIODS = {
+    'day': lambda day: func.date(day),
+    'week': lambda day: func.date(day, '-6 days', 'weekday 1'),
+    'month': lambda day: func.strftime('%Y-%m-01', day),
+}
+
+SERIES = ('spending', 'saving', 'borrowing', 'interest_earned', 'interest_charged')
+
+rollup = DailyRollup.__table__
+accounts = Account.__table__
+users = User.__table__
+
+
+class AnalyticsError(Exception):
+    pass
+
+
+def parse_range(args):
+    # ?start=YYYY-MM-DD&end=YYYY-MM-DD&period=day|week|month&user=<id>...
+    # Defaults to the last 12 weeks, by week
+    try:
+        end = date.fromisoformat(args['end']) if args.get('end') else date.today()
+        start = date.fromisoformat(args['start']) if args.get('start') else end - timedelta(weeks=12)
+        user_ids = [int(u) for u in args.getlist('user') if u]
+    except ValueError:
+        raise AnalyticsError('Invalid date or user filter')
+    period = args.get('period', 'week')
+    if period not in PERIODS:
+        raise AnalyticsError('period must be day, week or month')
+    if start > end:
+        raise AnalyticsError('start must not be after end')
+    if (end - start).days >= ANALYTICS_MAX_DAYS:
+        raise AnalyticsError(f'Range is limited to {ANALYTICS_MAX_DAYS} days')
+    return start, end, period, user_ids
+
+
+def bucket_label(day, period):
+    if period == 'week':
+        day -= timedelta(days=day.weekday())
+    elif period == 'month':
+        day = day.replace(day=1)
+    return day.isoformat()
+
+
+def period_labels(start, end, period):
+    labels = []
+    day = start
+    while day <= end:
+        label = bucket_label(day, period)
+        if not labels or labels[-1] != label:
+            labels.append(label)
+        day += timedelta(days=1)
+    return labels
+
+
+def rollup_query(start, end, period, user_ids=None):
+    bucket = PERIODS[period](rollup.c.day).label('period')
+    stmt = (
+        select(
+            accounts.c.user_id, accounts.c.type.label('account_type'), bucket, rollup.c.category,
+            func.sum(rollup.c.inflow).label('inflow'),
+            func.sum(rollup.c.outflow).label('outflow'),
+            func.sum(rollup.c.count).label('count'),
+        )
+        .join(accounts, accounts.c.id == rollup.c.account_id)
+        .where(rollup.c.day >= start, rollup.c.day <= end)
+        .group_by(accounts.c.user_id, accounts.c.type, bucket, rollup.c.category)
+    )
+    if user_ids:
+        stmt = stmt.where(accounts.c.user_id.in_(user_ids))
+    return stmt
+
+
+def _series_values(account_type, category, inflow, outflow):
+    # Which chart lines a rollup row feeds
+    if account_type == 'spending' and category != 'payment':
+        yield 'spending', outflow
+    elif account_type == 'savings':
+        yield 'saving', inflow - outflow
+        if category == 'interest':
+            yield 'interest_earned', inflow
+    elif account_type == 'credit':
+        if category == 'borrow':
+            yield 'borrowing', inflow + outflow
+        elif category == 'interest':
+            yield 'interest_charged', inflow + outflow
+
+
+def family_analytics(start, end, period='week', user_ids=None):
+    labels = period_labels(start, end, period)
+    index = {label: i for i, label in enumerate(labels)}
+
+    children = db.session.execute(
+        select(users.c.id, users.c.username).where(users.c.role == 'child').order_by(users.c.username)
+    ).all()
+    if user_ids:
+        children = [c for c in children if c.id in user_ids]
+
+    report = {}
+    for child in children:
+        report[child.id] = {
+            'user_id': child.id,
+            'username': child.username,
+            'series': {name: [0.0] * len(labels) for name in SERIES},
+            'totals': {},
+        }
+
+    for row in db.session.execute(rollup_query(start, end, period, list(report))):
+        child = report.get(row.user_id)
+        if child is None:
+            continue
+        i = index[row.period]
+        for name, value in _series_values(row.account_type, row.category, row.inflow, row.outflow):
+            child['series'][name][i] += value
+
+        totals = child['totals'].setdefault(row.category, {'inflow': 0.0, 'outflow': 0.0, 'count': 0})
+        totals['inflow'] += row.inflow
+        totals['outflow'] += row.outflow
+        totals['count'] += row.count
+
+    for child in report.values():
+        for name, values in child['series'].items():
+            child['series'][name] = [round(v, 2) for v in values]
+        for totals in child['totals'].values():
+            totals['net'] = round(totals['inflow'] - totals['outflow'], 2)
+            totals['inflow'] = round(totals['inflow'], 2)
+            totals['outflow'] = round(totals['outflow'], 2)
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'period': period,
+        'periods': labels,
+        'children': list(report.values()),
+    }
+
+
+def compact(days=ROLLUP_REBUILD_DAYS):
+    # Nightly: recompute the recent window from raw transactions, correcting
+    # anything the triggers could not see (rows written with triggers off,
+    # float drift), and drop rollups emptied by deletes. days=None rebuilds
+    # all of history.
+    since = date.today() - timedelta(days=days) if days is not None else None
+    with db.engine.begin() as connection:
+        rebuild_rollups(connection, since)
+        rows = connection.execute(select(func.count()).select_from(rollup)).scalar()
+    return since, rows
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        since, rows = compact(None if '--full' in sys.argv else ROLLUP_REBUILD_DAYS)
+        print(f"{date.today()}: rebuilt daily rollups {'since ' + since.isoformat() if since else 'for all history'}; {rows} rows.")
@@ -0,0 +1,292 @@
+import sys
+import math
+import time
+from calendar import monthrange
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete
+from models import db, User, Account, ScheduledTransfer
+from ledger import run_atomic, InsufficientFunds
+from transfers import (validate_transfer, apply_transfers, transfer_log_lines, remaining_minimum_due,
+                       apply_credit_payment, credit_payment_log_line, TransferError)
+from config import *
+
+# Recurring transfers set up by parents: chore pay every Friday, a monthly
+# savings sweep, auto-pay of the credit minimum due. Each rule carries its
+# next_run_at, so a run reads only the rules that are due, BATCH_SIZE at a
+# time through the index, whatever the number of rules on file. Every rule is
+# checked by the same validate_transfer as /transfer, as the parent who set
+# it up. Run from cron every few minutes:
+#   python scheduler.py            (run whatever is due, once)
+#   python scheduler.py loop 300   (run every 300 seconds)
+
+Kind = namedtuple('Kind', 'label amount_label')
+
+KINDS = {
+    'fixed': Kind('Fixed amount', 'Amount'),
+    'sweep': Kind('Everything above', 'Keep'),
+    'credit_minimum': Kind('Credit minimum due', None),
+}
+
+INTERVALS = {'daily': 'day', 'weekly': 'week', 'monthly': 'month'}
+
+
+class ScheduleError(Exception):
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def account_raw(account):
+    # The form value validate_transfer takes
+    return 'bank' if account is None else str(account.id)
+
+
+def add_months(when, months):
+    year, month = divmod(when.month - 1 + months, 12)
+    year += when.year
+    return when.replace(year=year, month=month + 1, day=min(when.day, monthrange(year, month + 1)[1]))
+
+
+def occurrence_after(rule, current):
+    # Monthly rules count from starts_at, so a rule set for the 31st runs on
+    # the last day of short months and goes back to the 31st after them
+    if rule.interval == 'monthly':
+        elapsed = (current.year - rule.starts_at.year) * 12 + current.month - rule.starts_at.month
+        return add_months(rule.starts_at, (elapsed // rule.every + 1) * rule.every)
+    return current + timedelta(days=rule.every * (7 if rule.interval == 'weekly' else 1))
+
+
+def following(rule, now):
+    # The first occurrence after now. Occurrences missed while the job was
+    # not running are skipped, not replayed.
+    next_run = rule.next_run_at or rule.starts_at
+    while next_run <= now:
+        next_run = occurrence_after(rule, next_run)
+    return next_run
+
+
+def parse(form, creator):
+    # Editor form to column values, collecting every problem
+    errors = []
+    kind = form.get('kind')
+    values = {
+        'kind': kind,
+        'description': (form.get('description') or '').strip() or None,
+        'interval': form.get('interval'),
+    }
+    if kind not in KINDS:
+        errors.append('Choose what the rule transfers')
+    if values['interval'] not in INTERVALS:
+        errors.append('Choose how often it runs')
+
+    try:
+        values['every'] = int(form.get('every') or 1)
+        if values['every'] < 1:
+            errors.append('Repeat must be at least 1')
+    except ValueError:
+        errors.append('Repeat must be a whole number')
+
+    try:
+        values['amount'] = round(float(form.get('amount') or 0), 2)
+        if not math.isfinite(values['amount']):
+            raise ValueError(form.get('amount'))
+    except ValueError:
+        values.pop('amount', None)
+        errors.append('Amount must be a number')
+    if kind == 'credit_minimum':
+        values['amount'] = 0.0
+    elif 'amount' not in values:
+        pass
+    elif kind == 'fixed' and values['amount'] <= 0:
+        errors.append('Amount must be more than $0')
+    elif kind == 'sweep' and values['amount'] < 0:
+        errors.append('Keep must be $0 or more')
+
+    try:
+        values['starts_at'] = datetime.strptime(form.get('starts_at') or '', '%Y-%m-%dT%H:%M')
+    except ValueError:
+        errors.append('Choose when it first runs')
+
+    try:
+        from_acc, to_acc = (None if form.get(f) == 'bank' else db.session.get(Account, int(form.get(f) or 0))
+                            for f in ('from_account', 'to_account'))
+    except ValueError:
+        from_acc = to_acc = None
+        errors.append('Invalid account')
+    else:
+        if (from_acc is None and form.get('from_account') != 'bank') or \
+                (to_acc is None and form.get('to_account') != 'bank'):
+            errors.append('Account not found')
+        elif kind == 'credit_minimum':
+            if from_acc is None or to_acc is None or from_acc.type != 'spending' or to_acc.type != 'credit' \
+                    or from_acc.user_id != to_acc.user_id:
+                errors.append('Credit auto-pay runs from a spending account to the same child\'s credit account')
+        elif kind == 'sweep' and from_acc is None:
+            errors.append('A sweep needs an account to sweep from')
+        elif kind in KINDS and 'amount' in values:
+            # The /transfer rules, short of the balance (that is checked at
+            # each run)
+            try:
+                validate_transfer(creator, form.get('from_account'), form.get('to_account'),
+                                  values.get('amount') if kind == 'fixed' else 1.0,
+                                  balances={} if from_acc is None else {from_acc.id: float('inf')})
+            except TransferError as e:
+                errors.append(e.message)
+        values['from_account_id'] = from_acc.id if from_acc else None
+        values['to_account_id'] = to_acc.id if to_acc else None
+
+    if errors:
+        raise ScheduleError(errors)
+    return values
+
+
+def create(values, creator):
+    rule_id = db.session.execute(insert(ScheduledTransfer).values(
+        **values, next_run_at=values['starts_at'], created_by=creator.id
+    )).inserted_primary_key[0]
+    db.session.commit()
+    return rule_id
+
+
+def pause(rule, paused, now=None):
+    # Paused rules have no next_run_at, so the executor never sees them;
+    # resuming picks up at the next occurrence from now
+    rule.next_run_at = None if paused else following(rule, now or datetime.now())
+    if not paused:
+        rule.failures = 0
+    db.session.commit()
+
+
+def remove(rule_id):
+    result = db.session.execute(delete(ScheduledTransfer).where(ScheduledTransfer.id == rule_id))
+    db.session.commit()
+    return result.rowcount
+
+
+def due_ids(now, limit):
+    # Served by the next_run_at index: cost follows the number due, not the
+    # number on file
+    return db.session.execute(
+        select(ScheduledTransfer.id)
+        .where(ScheduledTransfer.next_run_at <= now)
+        .order_by(ScheduledTransfer.next_run_at, ScheduledTransfer.id)
+        .limit(limit)
+    ).scalars().all()
+
+
+def run_rule(rule, creator, now):
+    # Applies one due rule and advances it in the same transaction. Returns
+    # the activity log lines as (user, message) pairs; raises TransferError
+    # or InsufficientFunds with nothing applied.
+    def advance():
+        rule.next_run_at = following(rule, now)
+        rule.last_run_at = now
+        rule.last_error = None
+        rule.failures = 0
+
+    if creator is None or creator.role != 'parent':
+        raise TransferError('The parent who set this up no longer has access')
+    if (rule.from_account_id and rule.from_account is None) or (rule.to_account_id and rule.to_account is None):
+        raise TransferError('Account not found')
+    desc = rule.description or 'Scheduled transfer'
+
+    if rule.kind == 'credit_minimum':
+        spending, credit = rule.from_account, rule.to_account
+        remaining = remaining_minimum_due(credit) if credit.due_date else 0
+        amount = round(min(remaining, credit.balance), 2)
+        if amount < 0.01:
+            run_atomic(advance)
+            return []
+        if spending.balance < amount:
+            raise TransferError('Insufficient funds')
+        clears_past_due = credit.past_due and remaining - amount <= 0
+
+        def apply():
+            balances = apply_credit_payment(spending, credit, amount, clears_past_due)
+            advance()
+            return balances
+        spending_balance, credit_balance = run_atomic(apply)
+        return [(spending.user, credit_payment_log_line(spending, credit, amount, spending_balance, credit_balance))]
+
+    amount = rule.amount
+    if rule.kind == 'sweep':
+        amount = round(rule.from_account.balance - rule.amount, 2)
+        if amount < 0.01:
+            run_atomic(advance)
+            return []
+    leg = validate_transfer(creator, account_raw(rule.from_account), account_raw(rule.to_account), amount, desc)
+
+    def apply():
+        after = apply_transfers(creator, [leg])[0]
+        advance()
+        return after
+    return transfer_log_lines(creator, leg, run_atomic(apply))
+
+
+def record_failure(rule_id, error, now):
+    # Skips this occurrence; after SCHEDULE_MAX_FAILURES in a row the rule is
+    # paused until a parent resumes it
+    rule = db.session.get(ScheduledTransfer, rule_id)
+    rule.failures += 1
+    rule.last_run_at = now
+    rule.last_error = error[:200]
+    rule.next_run_at = None if rule.failures >= SCHEDULE_MAX_FAILURES else following(rule, now)
+    db.session.commit()
+    return rule
+
+
+def run_due(now=None, batch_size=SCHEDULE_BATCH_SIZE, log=None):
+    # Runs every due rule, one transaction each so one failure doesn't hold
+    # up the rest. log(user, messages) writes the activity logs (app's by
+    # default). Returns (ran, failed) lists of (rule, detail).
+    if log is None:
+        from app import log_user_transactions as log
+    now = now or datetime.now()
+    ran, failed = [], []
+    while True:
+        ids = due_ids(now, batch_size)
+        if not ids:
+            break
+        rules = db.session.execute(select(ScheduledTransfer).where(ScheduledTransfer.id.in_(ids))).scalars().all()
+        creators = {u.id: u for u in db.session.execute(
+            select(User).where(User.id.in_({rule.created_by for rule in rules}))
+        ).scalars()}
+        for rule in sorted(rules, key=lambda r: (r.next_run_at, r.id)):
+            rule_id = rule.id
+            try:
+                lines = run_rule(rule, creators.get(rule.created_by), now)
+            except TransferError as e:
+                failed.append((record_failure(rule_id, e.message, now), e.message))
+                continue
+            except InsufficientFunds:
+                # Balance moved between the check and the write
+                failed.append((record_failure(rule_id, 'Insufficient funds', now), 'Insufficient funds'))
+                continue
+            by_user = {}
+            for user, message in lines:
+                by_user.setdefault(user, []).append(message)
+            for user, messages in by_user.items():
+                log(user, messages)
+            ran.append((rule, len(lines)))
+    return ran, failed
+
+
+def run_once():
+    ran, failed = run_due()
+    for rule, error in failed:
+        paused = ' - paused' if rule.next_run_at is None else ''
+        print(f"  rule {rule.id} ({rule.description or KINDS[rule.kind].label}): {error}{paused}")
+    print(f"{datetime.now():%Y-%m-%d %H:%M}: ran {len(ran)} scheduled transfer(s), {len(failed)} failed.")
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        if len(sys.argv) > 1 and sys.argv[1] == 'loop':
+            interval = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+            while True:
+                run_once()
+                time.sleep(interval)
+        else:
+            run_once()
@@ -0,0 +1,93 @@
+import re
+from sqlalchemy import select, table, column, func, literal_column, or_
+from models import db, User, Account, Transaction
+from exports import parse_filters, ExportError, _date_filters
+from config import *
+
+# Column weights for bm25(): a hit in the description counts far more than
+# one on a username or account type
+SEARCH_WEIGHTS = (10.0, 2.0, 1.0)
+HIGHLIGHT = ('\x02', '\x03')
+
+fts = table('transaction_search', column('rowid'))
+match_target = literal_column('transaction_search')
+tx = Transaction.__table__
+accounts = Account.__table__
+users = User.__table__
+
+
+class SearchError(Exception):
+    pass
+
+
+def match_query(q):
+    # Free text to an FTS5 expression: every word must appear, as a prefix
+    # ("lawn" finds "lawnmower"). Only word characters get through, so user
+    # input can never form FTS5 syntax.
+    terms = re.findall(r'\w+', q or '')[:SEARCH_MAX_TERMS]
+    if not terms:
+        raise SearchError('Enter something to search for')
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def parse_search(args):
+    # ?q=...&start=YYYY-MM-DD&end=YYYY-MM-DD&account=<id>...&limit=&offset=
+    try:
+        start, end, account_ids = parse_filters(args)
+    except ExportError as e:
+        raise SearchError(str(e))
+    limit = min(max(args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_MAX_PAGE_SIZE)
+    offset = max(args.get('offset', 0, type=int), 0)
+    return match_query(args.get('q')), start, end, account_ids, limit, offset
+
+
+def search_query(match, user_id, start=None, end=None, account_ids=None, limit=SEARCH_PAGE_SIZE, offset=0):
+    # user_id None searches every user (parents only)
+    from_acc = accounts.alias('from_acc')
+    to_acc = accounts.alias('to_acc')
+    from_user = users.alias('from_user')
+    to_user = users.alias('to_user')
+    rank = func.bm25(match_target, *SEARCH_WEIGHTS).label('rank')
+
+    stmt = (
+        select(
+            tx.c.id, tx.c.timestamp, tx.c.amount, tx.c.description,
+            func.snippet(match_target, 0, *HIGHLIGHT, '…', 16).label('snippet'),
+            tx.c.from_account_id, from_acc.c.type.label('from_account_type'), from_user.c.username.label('from_user'),
+            tx.c.to_account_id, to_acc.c.type.label('to_account_type'), to_user.c.username.label('to_user'),
+        )
+        .select_from(
+            fts.join(tx, tx.c.id == fts.c.rowid)
+              .outerjoin(from_acc, from_acc.c.id == tx.c.from_account_id)
+              .outerjoin(to_acc, to_acc.c.id == tx.c.to_account_id)
+              .outerjoin(from_user, from_user.c.id == tx.c.from_user_id)
+              .outerjoin(to_user, to_user.c.id == tx.c.to_user_id)
+        )
+        .where(match_target.op('MATCH')(match), *_date_filters(tx.c.timestamp, start, end))
+        # Best match first, newest first among equals
+        .order_by(rank, tx.c.id.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+    if user_id is not None:
+        stmt = stmt.where(or_(tx.c.from_user_id == user_id, tx.c.to_user_id == user_id))
+    if account_ids:
+        stmt = stmt.where(or_(tx.c.from_account_id.in_(account_ids), tx.c.to_account_id.in_(account_ids)))
+    return stmt
+
+
+def search_transactions(match, user_id, start=None, end=None, account_ids=None, limit=SEARCH_PAGE_SIZE, offset=0):
+    rows = db.session.execute(search_query(match, user_id, start, end, account_ids, limit, offset))
+    results = []
+    for row in rows:
+        record = row._asdict()
+        record['timestamp'] = record['timestamp'].isoformat() if record['timestamp'] else None
+        results.append(record)
+    return {
+        'results': results,
+        'limit': limit,
+        'offset': offset,
+        # A full page means there may be more
+        'next_offset': offset + limit if len(results) == limit else None,
+        'highlight': HIGHLIGHT,
+    }
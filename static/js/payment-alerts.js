@@ -1,36 +1,43 @@
-function setCookie(name, value) {
-  const expires = new Date(Date.now() + 30).toUTCString();
-  document.cookie =
-    name +
-    '=' +
-    encodeURIComponent(value) +
-    '; expires=' +
-    expires +
-    '; path=/; SameSite=Lax';
-}
-
-function getCookie(name) {
-  return document.cookie
-    .split('; ')
-    .find(row => row.startsWith(name + '='))?.split('=')[1];
-}
-
-function acknowledgePaymentAlert() {
-  document.querySelectorAll('[data-account]').forEach(el => {
-    setCookie(`payment_alert_ack_${el.dataset.account}`, '1');
-  });
-  document.getElementById('payment-alert-overlay')?.remove();
-}
-
-(function () {
-  const alerts = document.querySelectorAll('[data-account]');
-  if (!alerts.length) return;
-
-  const allAck = [...alerts].every(el =>
-    getCookie(`payment_alert_ack_${el.dataset.account}`)
-  );
-
-  if (allAck) {
-    document.getElementById('payment-alert-overlay')?.remove();
-  }
-})();
+// Payment-due alerts come from the notification table. Dismissing marks
+// them read on the server; new ones are polled for while the page is open.
+const paymentAlerts = (() => {
+  const script = document.currentScript;
+  return {
+    after: Number(script?.dataset.after || 0),
+    poll: Number(script?.dataset.poll || 60) * 1000,
+  };
+})();
+
+function acknowledgePaymentAlert() {
+  const ids = [...document.querySelectorAll('[data-notification]')]
+    .map(el => Number(el.dataset.notification));
+  if (ids.length) {
+    // keepalive, so "Make Payment" can navigate away while this is sent
+    fetch('/api/notifications/read', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ ids }),
+      keepalive: true,
+    });
+  }
+  document.getElementById('payment-alert-overlay')?.remove();
+}
+
+function pollPaymentAlerts() {
+  if (document.hidden) {
+    setTimeout(pollPaymentAlerts, paymentAlerts.poll);
+    return;
+  }
+  fetch(`/api/notifications?after=${paymentAlerts.after}`, { headers: { Accept: 'application/json' } })
+    .then(response => (response.ok ? response.json() : null))
+    .then(data => {
+      if (!data || !data.notifications.length) return;
+      paymentAlerts.after = data.last_id;
+      document.getElementById('payment-alert-overlay')?.remove();
+      document.body.insertAdjacentHTML('afterbegin', data.html);
+    })
+    .catch(() => {})
+    .finally(() => setTimeout(pollPaymentAlerts, paymentAlerts.poll));
+}
+
+setTimeout(pollPaymentAlerts, paymentAlerts.poll);
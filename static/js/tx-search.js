@@ -0,0 +1,101 @@
+(function () {
+  const form = document.getElementById('tx-search');
+  const results = document.getElementById('tx-search-results');
+  const list = document.getElementById('tx-list');
+  const filters = document.getElementById('tx-filters');
+  const pagination = document.getElementById('tx-pagination');
+
+  if (!form) return;
+
+  const input = form.querySelector('input[name="q"]');
+  let timer = null;
+  let latest = 0;
+
+  function showList(visible) {
+    list.hidden = !visible;
+    filters.hidden = !visible;
+    pagination.hidden = !visible;
+    results.hidden = visible;
+  }
+
+  // The snippet marks hits with control characters rather than HTML, so the
+  // description is always inserted as text
+  function highlighted(snippet, [open, close]) {
+    const fragment = document.createDocumentFragment();
+    snippet.split(open).forEach((part, i) => {
+      const [hit, rest] = i === 0 ? ['', part] : part.split(close);
+      if (hit) {
+        const mark = document.createElement('mark');
+        mark.textContent = hit;
+        fragment.appendChild(mark);
+      }
+      fragment.appendChild(document.createTextNode(rest || ''));
+    });
+    return fragment;
+  }
+
+  function describe(r) {
+    const side = (user, type) => (type ? `${user || ''} ${type}`.trim() : 'Bank');
+    return `${side(r.from_user, r.from_account_type)} → ${side(r.to_user, r.to_account_type)}`;
+  }
+
+  function render(data) {
+    results.replaceChildren();
+    if (!data.results.length) {
+      const li = document.createElement('li');
+      li.textContent = 'No matching transactions';
+      results.appendChild(li);
+      return;
+    }
+    for (const r of data.results) {
+      const li = document.createElement('li');
+      li.className = 'tx-item';
+      li.style.display = 'flex';
+
+      const left = document.createElement('div');
+      left.className = 'tx-left';
+      const when = document.createElement('strong');
+      when.textContent = new Date(r.timestamp + 'Z').toLocaleString();
+      left.append(when, document.createElement('br'), highlighted(r.snippet || r.description || '', data.highlight));
+      const parties = document.createElement('div');
+      parties.style.cssText = 'color:var(--secondary);font-size:.8rem;';
+      parties.textContent = describe(r);
+      left.appendChild(parties);
+
+      const right = document.createElement('div');
+      right.className = 'tx-right';
+      right.style.textAlign = 'right';
+      right.textContent = '$' + r.amount.toFixed(2);
+
+      li.append(left, right);
+      results.appendChild(li);
+    }
+  }
+
+  async function search() {
+    const q = input.value.trim();
+    if (!q) {
+      showList(true);
+      return;
+    }
+    const request = ++latest;
+    const response = await fetch(form.action + '?' + new URLSearchParams({ q }));
+    if (request !== latest) return;  // a newer query is already on its way
+    showList(false);
+    if (!response.ok) {
+      results.replaceChildren();
+      return;
+    }
+    render(await response.json());
+  }
+
+  form.addEventListener('submit', event => {
+    event.preventDefault();
+    search();
+  });
+
+  input.addEventListener('input', () => {
+    clearTimeout(timer);
+    timer = setTimeout(search, 250);
+  });
+})();
@@ -0,0 +1,291 @@
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy import insert, func
+from models import db, Account, Transaction
+from ledger import adjust_balance, adjust_points
+from config import *
+
+
+class TransferError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+# from_acc / to_acc are None for the Bank
+TransferLeg = namedtuple('TransferLeg', 'from_acc to_acc amount penalty points description')
+
+
+def fmt(action, path, amount, balance, desc=''):
+    return (
+        f"{action:<8} | "
+        f"{path:<20} | "
+        f"{amount:<8} | "
+        f"{balance:<41}"
+        f"{' | ' + desc if desc else ''}"
+    )
+
+
+def resolve_account(raw):
+    if raw == 'bank':
+        return None
+    try:
+        acc_id = int(raw)
+    except (TypeError, ValueError):
+        raise TransferError('Invalid account')
+    acc = db.session.get(Account, acc_id)
+    if acc is None:
+        raise TransferError('Account not found', 404)
+    return acc
+
+
+def validate_transfer(user, from_raw, to_raw, amount, desc='', balances=None):
+    # The rules behind /transfer. `balances` holds projected balances by account
+    # id, so a batch is checked as if its earlier legs had already run.
+    balances = {} if balances is None else balances
+
+    # ---- Parent-only Bank handling ----
+    from_bank = from_raw == 'bank'
+    to_bank   = to_raw == 'bank'
+
+    if (from_bank or to_bank) and user.role != 'parent':
+        raise TransferError('Only parents can move money to or from the Bank', 403)
+
+    if from_bank and to_bank:
+        raise TransferError('Cannot transfer to the same account')
+
+    from_acc = resolve_account(from_raw)
+    to_acc   = resolve_account(to_raw)
+
+    # ---- Validation ----
+    if not from_bank and not to_bank and from_acc.id == to_acc.id:
+        raise TransferError('Cannot transfer to the same account')
+
+    if not from_bank and from_acc.user_id != user.id and user.role != 'parent':
+        raise TransferError('Not allowed to transfer from this account', 403)
+
+    if amount <= 0:
+        raise TransferError('Invalid transfer amount')
+
+    if not from_bank and from_acc.type == 'credit':
+        raise TransferError('Cannot transfer from credit accounts')
+
+    if not to_bank and to_acc.type == 'credit':
+        raise TransferError('Cannot transfer to credit accounts')
+
+    from_balance = None if from_bank else balances.get(from_acc.id, from_acc.balance)
+
+    # ---- Savings rules ----
+    penalty = 0
+    if not from_bank and from_acc.type == 'savings':
+        if not (
+            not to_bank and
+            to_acc.user_id == from_acc.user_id and
+            to_acc.type == 'spending'
+        ):
+            raise TransferError('Savings can only transfer to your own spending account')
+
+        if amount < 1.00:
+            raise TransferError('Minimum $1 transfer from savings required')
+
+        penalty = round(amount * 0.10, 2)
+        total = amount + penalty
+
+        if from_balance < total:
+            raise TransferError(f'Insufficient funds including ${penalty:.2f} penalty')
+
+    if not from_bank and from_balance < amount:
+        raise TransferError('Insufficient funds')
+
+    points = 0
+    if not to_bank and to_acc.type == 'savings' and to_acc.user_id == user.id:
+        points = int(amount * SAVINGS_REWARD_RATE)
+
+    if not from_bank:
+        balances[from_acc.id] = round(from_balance - amount - penalty, 2)
+    if not to_bank:
+        balances[to_acc.id] = round(balances.get(to_acc.id, to_acc.balance) + amount, 2)
+
+    return TransferLeg(from_acc, to_acc, amount, penalty, points, desc)
+
+
+def apply_transfers(user, legs):
+    # Applies validated legs inside the caller's transaction (see run_atomic).
+    # Balances are re-checked by the conditional updates at write time; the
+    # transaction rows go in as one multi-row insert. Returns the balances
+    # after each leg.
+    results = []
+    rows = []
+    points = 0
+
+    for leg in legs:
+        from_acc, to_acc, amount = leg.from_acc, leg.to_acc, leg.amount
+        after = {}
+
+        if leg.penalty >= 0.01:
+            after['penalty'] = adjust_balance(from_acc, -leg.penalty, minimum=amount)
+            rows.append(dict(
+                from_account_id=from_acc.id,
+                to_account_id=None,
+                from_user_id=from_acc.user_id,
+                to_user_id=None,
+                amount=leg.penalty,
+                from_balance_after=after['penalty'],
+                to_balance_after=to_acc.balance,
+                description='Savings withdrawal penalty'
+            ))
+
+        # ---- Debit source ----
+        if from_acc is not None:
+            after['from'] = adjust_balance(from_acc, -amount, minimum=0)
+
+        # ---- Credit destination ----
+        if to_acc is not None:
+            after['to'] = adjust_balance(to_acc, amount)
+
+        # ---- Transaction log ----
+        rows.append(dict(
+            from_account_id=None if from_acc is None else from_acc.id,
+            to_account_id=None if to_acc is None else to_acc.id,
+            from_user_id=user.id if from_acc is None else from_acc.user_id,
+            to_user_id=None if to_acc is None else to_acc.user_id,
+            amount=amount,
+            from_balance_after=after.get('from'),
+            to_balance_after=after.get('to'),
+            description=leg.description or (
+                'Bank deposit' if from_acc is None else
+                'Bank withdrawal' if to_acc is None else
+                'Transfer'
+            )
+        ))
+
+        points += leg.points
+        results.append(after)
+
+    if rows:
+        db.session.execute(insert(Transaction), rows)
+
+    # ---- Rewards ----
+    if points:
+        adjust_points(user, points, 'savings')
+    return results
+
+
+def remaining_minimum_due(credit):
+    # What is still owed towards this cycle's minimum payment
+    carried_balance = max(credit.past_amt, 0)
+    min_due = round(MIN_PAYMENT_AMT * carried_balance, 2)
+    cycle_start = date.fromisoformat(credit.due_date) - timedelta(days=30)
+    cycle_start_dt = datetime.combine(cycle_start, datetime.min.time())
+    cycle_end_dt = datetime.combine(date.fromisoformat(credit.due_date), datetime.max.time())
+
+    already_paid = db.session.query(func.coalesce(func.sum(Transaction.amount), 0.0)).filter(
+        Transaction.to_account_id == credit.id,
+        Transaction.description == 'Credit payment',
+        Transaction.timestamp >= cycle_start_dt,
+        Transaction.timestamp <= cycle_end_dt
+    ).scalar()
+    return round(max(min_due - already_paid, 0), 2)
+
+
+def apply_credit_payment(spending, credit, amount, clears_past_due=False):
+    # Inside the caller's transaction, like apply_transfers
+    if clears_past_due:
+        credit.past_due = False
+    spending_balance = adjust_balance(spending, -amount, minimum=0)
+    credit_balance = adjust_balance(credit, -amount, minimum=0)
+
+    db.session.add(Transaction(
+        from_account_id=spending.id,
+        to_account_id=credit.id,
+        from_user_id=spending.user_id,
+        to_user_id=credit.user_id,
+        amount=amount,
+        from_balance_after=spending_balance,
+        to_balance_after=credit_balance,
+        description='Credit payment'
+    ))
+    return spending_balance, credit_balance
+
+
+def credit_payment_log_line(spending, credit, amount, spending_balance, credit_balance):
+    return fmt(
+        "PAYMENT",
+        f"{spending.type} → {credit.type}",
+        f"${amount:.2f}",
+        f"${spending_balance + amount:.2f} → ${spending_balance:.2f} ≡ "
+        f"${credit_balance + amount:.2f} → ${credit_balance:.2f}",
+        "Credit payment"
+    )
+
+
+def transfer_log_lines(user, leg, after):
+    # Activity log lines for one applied leg as (user, message) pairs
+    from_acc, to_acc, amount, desc = leg.from_acc, leg.to_acc, leg.amount, leg.description
+    lines = []
+
+    if leg.penalty >= 0.01:
+        lines.append((user, fmt(
+            "PENALTY",
+            f"{from_acc.type} → Bank",
+            f"${leg.penalty:.2f}",
+            f"${after['penalty'] + leg.penalty:.2f} → ${after['penalty']:.2f}",
+            'Savings withdrawal penalty'
+        )))
+
+    og_from_balance = after['from'] + amount if from_acc is not None else None
+    og_to_balance = after['to'] - amount if to_acc is not None else None
+
+    if from_acc is None:
+        lines.append((user, fmt(
+            "TRANSFER",
+            f"Bank → {to_acc.user.username}",
+            f"${amount:.2f}",
+            f"${og_to_balance:.2f} → ${after['to']:.2f}",
+            desc
+        )))
+        lines.append((to_acc.user, fmt(
+            "RECEIVED",
+            f"Bank → {to_acc.type}",
+            f"${amount:.2f}",
+            f"${og_to_balance:.2f} → ${after['to']:.2f}",
+            desc
+        )))
+
+    elif to_acc is None:
+        lines.append((from_acc.user, fmt(
+            "TRANSFER",
+            f"{from_acc.type} → Bank",
+            f"${amount:.2f}",
+            f"${og_from_balance:.2f} → ${after['from']:.2f}",
+            desc
+        )))
+
+    elif from_acc.user == to_acc.user:
+        lines.append((from_acc.user, fmt(
+            "TRANSFER",
+            f"{from_acc.type} → {to_acc.type}",
+            f"${amount:.2f}",
+            f"${og_from_balance:.2f} → ${after['from']:.2f} ≡ "
+            f"${og_to_balance:.2f} → ${after['to']:.2f}",
+            desc
+        )))
+
+    else:
+        lines.append((from_acc.user, fmt(
+            "TRANSFER",
+            f"{from_acc.type} → {to_acc.user.username}",
+            f"${amount:.2f}",
+            f"${og_from_balance:.2f} → ${after['from']:.2f}",
+            desc
+        )))
+        lines.append((to_acc.user, fmt(
+            "RECEIVED",
+            f"{from_acc.user.username} → {to_acc.type}",
+            f"${amount:.2f}",
+            f"${og_to_balance:.2f} → ${after['to']:.2f}",
+            desc
+        )))
+
+    return lines
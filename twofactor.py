@@ -0,0 +1,69 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import pyotp
+import qrcode
+from config import *
+
+_qr_cache = OrderedDict()
+_qr_lock = threading.Lock()
+
+
+def provisioning_uri(user):
+    return pyotp.totp.TOTP(user.totp_secret).provisioning_uri(
+        name=user.username, issuer_name=TOTP_ISSUER
+    )
+
+
+def qr_version(uri):
+    # Changes whenever the secret (or username) does, so the QR URL does too
+    return hashlib.sha256(uri.encode()).hexdigest()[:16]
+
+
+def render_qr_svg(uri):
+    qr = qrcode.QRCode(border=4)
+    qr.add_data(uri)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+
+    # One path segment per horizontal run of dark modules
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            runs.append(f"M{start} {y}h{x - start}v1H{start}z")
+
+    size = len(matrix)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(runs)}"/></svg>'
+    )
+
+
+def qr_svg(uri):
+    version = qr_version(uri)
+    with _qr_lock:
+        svg = _qr_cache.get(version)
+        if svg is not None:
+            _qr_cache.move_to_end(version)
+            return version, svg
+
+    svg = render_qr_svg(uri)
+    with _qr_lock:
+        _qr_cache[version] = svg
+        while len(_qr_cache) > TOTP_QR_CACHE_SIZE:
+            _qr_cache.popitem(last=False)
+    return version, svg
+
+
+def forget_qr(uri):
+    # Called when a secret is dropped so its QR does not linger in memory
+    with _qr_lock:
+        _qr_cache.pop(qr_version(uri), None)
@@ -1,6 +1,7 @@
 import os
 from app import app
 from models import db, User, Account, Transaction
+from ledger import adjust_balance
 from datetime import datetime, timedelta, date
 
 def log_user_transaction(user, message):
@@ -52,10 +53,8 @@ def give_allowance():
             ALLOWANCE_AMOUNT = user.allowance_rate
             spending = Account.query.filter_by(user_id=user.id, type='spending').first()
             if spending and ALLOWANCE_AMOUNT > 0:
-                og_mom_balance = admin_acc.balance
-                og_child_balance = spending.balance
-                spending.balance += ALLOWANCE_AMOUNT
-                admin_acc.balance -= ALLOWANCE_AMOUNT
+                child_balance = adjust_balance(spending, ALLOWANCE_AMOUNT)
+                mom_balance = adjust_balance(admin_acc, -ALLOWANCE_AMOUNT)
 
                 # Record transaction from Admin account
                 tx = Transaction(
@@ -64,8 +63,8 @@ def give_allowance():
                     from_user_id=admin.id,
                     to_user_id=user.id,
                     amount=ALLOWANCE_AMOUNT,
-                    from_balance_after=admin_acc.balance,
-                    to_balance_after=spending.balance,
+                    from_balance_after=mom_balance,
+                    to_balance_after=child_balance,
                     description='Weekly allowance'
                 )
                 db.session.add(tx)
@@ -77,7 +76,7 @@ def give_allowance():
                         "TRANSFER",
                         f"Admin → {user.username}",
                         f"${ALLOWANCE_AMOUNT:.2f}",
-                        f"${og_mom_balance:.2f} → ${admin_acc.balance:.2f}",
+                        f"${mom_balance + ALLOWANCE_AMOUNT:.2f} → ${mom_balance:.2f}",
                         "Weekly allowance"
                     )
                 )
@@ -88,7 +87,7 @@ def give_allowance():
                         "RECEIVED",
                         "Admin → spending",
                         f"${ALLOWANCE_AMOUNT:.2f}",
-                        f"${og_child_balance:.2f} → ${spending.balance:.2f}",
+                        f"${child_balance - ALLOWANCE_AMOUNT:.2f} → ${child_balance:.2f}",
                         "Weekly allowance"
                     )
                 )